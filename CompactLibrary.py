@@ -0,0 +1,250 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import typing
+from array import array
+
+import MusicLibrary as ml
+import SongStore as ss
+
+# Binary library file, little endian, every section starting on an 8 byte boundary:
+#   header
+#   string table offsets (string_count + 1 uint64) and utf-8 string data
+#   category name string ids (category_count uint64) and category row offsets (category_count + 1 uint64)
+#   weights (weight_count int64)
+#   artist name, song name and file path string ids (song_count uint32 each)
+#   priorities and number of repeats (song_count int64 each)
+#   json encoded extras, such as the scan snapshot
+#   durations in seconds (song_count float64), since version 2
+HEADER_FORMAT = '<8sIIQQQQQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FORMAT_VERSION = 2
+READABLE_FORMAT_VERSIONS = (1, 2)
+
+
+def align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+# String table of a mapped file, strings are decoded the first time they are read
+class MappedStringTable:
+    def __init__(self, offsets: memoryview, data: memoryview, copy_of: typing.Optional['MappedStringTable'] = None):
+        self.offsets: memoryview = offsets
+        self.data: memoryview = data
+        self.decoded: typing.Dict[int, str] = copy_of.decoded if copy_of else {}
+        self.appended: typing.List[str] = copy_of.appended if copy_of else []
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1 + len(self.appended)
+
+    def __getitem__(self, string_id: int) -> str:
+        string = self.decoded.get(string_id)
+        if string is None:
+            if string_id >= len(self.offsets) - 1:
+                return self.appended[string_id - len(self.offsets) + 1]
+            string = str(self.data[self.offsets[string_id]:self.offsets[string_id + 1]], 'utf-8')
+            self.decoded[string_id] = string
+        return string
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for string_id in range(len(self)):
+            yield self[string_id]
+
+    def append(self, string: str):
+        self.appended.append(string)
+
+
+# SongStore whose columns are views into a private (copy on write) mapping of a library file
+class MappedSongStore(ss.SongStore):
+    def __init__(self, file_name: str):
+        ss.SongStore.__init__(self)
+        self.mapping: typing.Optional[mmap.mmap] = None
+        self.map_file(file_name)
+
+    def map_file(self, file_name: str):
+        self.file_name: str = os.path.abspath(file_name)
+        with open(file_name, 'rb') as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.string_ids = None
+
+        (magic, version, _, string_count, string_data_size, song_count, category_count, weight_count,
+         extras_size) = struct.unpack_from(HEADER_FORMAT, self.mapping)
+        if magic != ml.COMPACT_LIBRARY_MAGIC or version not in READABLE_FORMAT_VERSIONS:
+            raise ValueError(f'{file_name} is not a compact music library')
+
+        buffer = memoryview(self.mapping)
+        offset = HEADER_SIZE
+
+        def take(size: int, typecode: typing.Optional[str] = None):
+            nonlocal offset
+            section = buffer[offset:offset + size]
+            offset = align(offset + size)
+            if typecode is None:
+                return section
+            if sys.byteorder != 'little':
+                column = array(typecode, section.tobytes())
+                column.byteswap()
+                return column
+            return section.cast(typecode)
+
+        string_offsets = take((string_count + 1) * 8, 'Q')
+        string_data = take(string_data_size)
+        self.strings = MappedStringTable(string_offsets, string_data)
+        self.category_name_ids = take(category_count * 8, 'Q')
+        self.category_names = [self.strings[string_id] for string_id in self.category_name_ids]
+        self.category_offsets = take((category_count + 1) * 8, 'Q')
+        self.weights: typing.List[int] = list(take(weight_count * 8, 'q'))
+        self.artist_name_ids = take(song_count * 4, 'I')
+        self.song_name_ids = take(song_count * 4, 'I')
+        self.file_path_ids = take(song_count * 4, 'I')
+        self.priorities = take(song_count * 8, 'q')
+        self.repeats = take(song_count * 8, 'q')
+        self.extras = json.loads(str(take(extras_size), 'utf-8')) if extras_size else {}
+        if version >= 2:
+            self.durations = take(song_count * 8, 'd')
+        else:
+            self.durations = array('d', bytes(song_count * 8))
+
+    def unmap(self):
+        # Copies the columns into memory and closes the mapping, as Windows can't replace a file that is mapped
+        if self.mapping is None:
+            return
+        self.strings = MappedStringTable(memoryview(copy_column('Q', self.strings.offsets)),
+                                         memoryview(bytes(self.strings.data)), self.strings)
+        self.category_name_ids = copy_column('Q', self.category_name_ids)
+        self.category_offsets = copy_column('Q', self.category_offsets)
+        self.artist_name_ids = copy_column('I', self.artist_name_ids)
+        self.song_name_ids = copy_column('I', self.song_name_ids)
+        self.file_path_ids = copy_column('I', self.file_path_ids)
+        self.priorities = copy_column('q', self.priorities)
+        self.repeats = copy_column('q', self.repeats)
+        self.durations = copy_column('d', self.durations)
+        self.mapping.close()
+        self.mapping = None
+
+    def intern_string(self, string: str) -> int:
+        # Only needed when a song's strings are edited, so the lookup table is built on first use
+        if self.string_ids is None:
+            self.string_ids = {existing_string: string_id for string_id, existing_string in enumerate(self.strings)}
+        return ss.SongStore.intern_string(self, string)
+
+
+def copy_column(typecode: str, column: typing.Union[memoryview, array]) -> array:
+    if isinstance(column, array):
+        return column  # already in memory, see MappedSongStore.map_file on big endian machines
+    copied_column = array(typecode)
+    copied_column.frombytes(column.cast('B'))
+    return copied_column
+
+
+def get_mapped_stores(library: ml.MusicLibrary, file_name: str) -> typing.List[MappedSongStore]:
+    file_name = os.path.abspath(file_name)
+    stores = {id(songs.store): songs.store for songs in library.categories.values()
+              if isinstance(songs, ss.SongViewList) and isinstance(songs.store, MappedSongStore)
+              and songs.store.file_name == file_name and songs.store.mapping is not None}
+    return list(stores.values())
+
+
+def is_whole_store(library: ml.MusicLibrary, store: ss.SongStore) -> bool:
+    # Whether the library's songs are exactly the store's rows in order, as they are written back to file
+    categories = list(library.categories.items())
+    return len(categories) == len(store.category_names) and all(
+        isinstance(songs, ss.SongViewList) and songs.store is store and category == store.category_names[number]
+        and songs.rows == store.get_category_rows(number) for number, (category, songs) in enumerate(categories))
+
+
+def get_whole_store(library: ml.MusicLibrary) -> typing.Optional[ss.SongStore]:
+    songs = next(iter(library.categories.values()), None)
+    if isinstance(songs, ss.SongViewList) and is_whole_store(library, songs.store):
+        return songs.store
+    return None
+
+
+def get_string_table(store: ss.SongStore) -> typing.Tuple[array, bytes]:
+    # Offsets and utf-8 data of the store's strings. Those of a mapped file are copied as they are, without
+    # decoding them.
+    if isinstance(store.strings, MappedStringTable):
+        string_offsets = array('Q', store.strings.offsets)
+        encoded_strings = [bytes(store.strings.data[:string_offsets[-1]])]
+        appended_strings = store.strings.appended
+    else:
+        string_offsets = array('Q', [0])
+        encoded_strings = []
+        appended_strings = store.strings
+    for string in appended_strings:
+        encoded_string = string.encode('utf-8')
+        string_offsets.append(string_offsets[-1] + len(encoded_string))
+        encoded_strings.append(encoded_string)
+    return string_offsets, b''.join(encoded_strings)
+
+
+def save_compact_library(library: ml.MusicLibrary, file_name: str):
+    # Written next to the target and renamed over it. A library mapped from the target is moved into memory first,
+    # since Windows can't replace a mapped file, and mapped from the new file once it is in place.
+    mapped_stores = get_mapped_stores(library, file_name)
+    for store in mapped_stores:
+        store.unmap()
+    ml.replace_file_atomically(file_name, 'wb', lambda file: write_compact_library(library, file))
+    for store in mapped_stores:
+        if is_whole_store(library, store):
+            store.map_file(file_name)
+
+
+def write_compact_library(library: ml.MusicLibrary, file: typing.BinaryIO):
+    # A library loaded from a compact file, and not rearranged since, is written straight from the columns of its
+    # store, without creating a view per song
+    store = get_whole_store(library)
+    if isinstance(store, MappedSongStore):
+        category_name_ids = array('Q', store.category_name_ids)
+    else:
+        store = store or ss.create_store(library)
+        category_name_ids = array('Q', [store.intern_string(category) for category in store.category_names])
+    string_offsets, string_data = get_string_table(store)
+    extras = {}
+    if library.scan_snapshot:
+        extras['scan_snapshot'] = ml.snapshot_to_dict(library.scan_snapshot)
+    if library.journal_id:
+        extras['journal_id'] = library.journal_id
+    encoded_extras = json.dumps(extras).encode('utf-8') if extras else b''
+
+    sections = [
+        string_offsets,
+        string_data,
+        category_name_ids,
+        array('Q', store.category_offsets),
+        array('q', library.weights),
+        array('I', store.artist_name_ids),
+        array('I', store.song_name_ids),
+        array('I', store.file_path_ids),
+        array('q', store.priorities),
+        array('q', store.repeats),
+        encoded_extras,
+        array('d', store.durations),
+    ]
+
+    header = struct.pack(HEADER_FORMAT, ml.COMPACT_LIBRARY_MAGIC, FORMAT_VERSION, 0, len(string_offsets) - 1,
+                         len(string_data), len(store), len(store.category_names), len(library.weights),
+                         len(encoded_extras))
+    file.write(header)
+    offset = HEADER_SIZE
+    for section in sections:
+        if isinstance(section, array):
+            if sys.byteorder != 'little':
+                section.byteswap()
+            section = section.tobytes()
+        file.write(section)
+        offset += len(section)
+        file.write(bytes(align(offset) - offset))
+        offset = align(offset)
+
+
+def load_compact_library(file_name: str) -> ml.MusicLibrary:
+    store = MappedSongStore(file_name)
+    library = ss.create_library_from_store(store)
+    library.weights = store.weights
+    if 'scan_snapshot' in store.extras:
+        library.scan_snapshot = ml.snapshot_from_dict(store.extras['scan_snapshot'])
+    library.journal_id = store.extras.get('journal_id')
+    return library
@@ -0,0 +1,144 @@
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+import typing
+
+# Opt in timers and counters for library operations and editor callbacks. Nothing is wrapped unless
+# instrumentation is enabled, either with MUSIC_LIBRARY_INSTRUMENT=1 or by calling enable() before the
+# instrumented functions are used, so there is no cost when it is off.
+#   MUSIC_LIBRARY_INSTRUMENT_INTERVAL=10     print a summary every 10 seconds, as well as at exit
+#   MUSIC_LIBRARY_PROFILE=set_priority       capture a cProfile of every call to one operation,
+#                                            written to set_priority.prof (or MUSIC_LIBRARY_PROFILE_FILE) at exit
+
+LIBRARY_OPERATIONS = [
+    'create_library', 'scan_library', 'read_song_tags', 'get_updated_library', 'get_updated_library_keep_repeats',
+    'get_updated_library_incremental', 'merge_library', 'save_library', 'load_library',
+    'pick_random_song_from_library', 'generate_playlist', 'get_picker_index', 'get_priority_statistics',
+    'calculate_relative_frequency', 'get_number_of_songs_for_priority', 'update_repeats', 'reset_repeats',
+    'reset_repeats_special', 'decay_repeats', 'normalize_repeats', 'reset_repeat_data', 'write_song_list',
+    'write_song_list_bare', 'write_song_list_json',
+]
+
+
+class OperationStats:
+    def __init__(self):
+        self.calls: int = 0
+        self.total_seconds: float = 0.0
+        self.max_seconds: float = 0.0
+
+
+enabled: bool = False
+profile_operation: typing.Optional[str] = None
+profiler: typing.Optional['cProfile.Profile'] = None
+profiling: bool = False  # the profiler can't be started again from a nested call
+operation_stats: typing.Dict[str, OperationStats] = {}
+stats_lock = threading.Lock()
+
+
+def wrap(name: str, function: typing.Callable) -> typing.Callable:
+    stats = operation_stats.setdefault(name, OperationStats())
+    is_profiled = profile_operation is not None and name.split('.')[-1] == profile_operation
+
+    @functools.wraps(function)
+    def instrumented_function(*args, **kwargs):
+        global profiling
+        start_time = time.perf_counter()
+        try:
+            if is_profiled and not profiling:
+                profiling = True
+                try:
+                    return profiler.runcall(function, *args, **kwargs)
+                finally:
+                    profiling = False
+            return function(*args, **kwargs)
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            with stats_lock:
+                stats.calls += 1
+                stats.total_seconds += elapsed_time
+                stats.max_seconds = max(stats.max_seconds, elapsed_time)
+
+    instrumented_function.uninstrumented_function = function
+    return instrumented_function
+
+
+def instrument(owner: typing.Any, prefix: str, attribute_names: typing.Iterable[str]):
+    # Replaces functions of a module or methods of a class with timed versions, when instrumentation is on
+    if not enabled:
+        return
+    for attribute_name in attribute_names:
+        function = getattr(owner, attribute_name)
+        if hasattr(function, 'uninstrumented_function'):
+            continue
+        setattr(owner, attribute_name, wrap(f'{prefix}.{attribute_name}', function))
+
+
+def instrument_library():
+    import MusicLibrary
+    instrument(MusicLibrary, 'MusicLibrary', LIBRARY_OPERATIONS)
+
+
+def enable(operation_to_profile: typing.Optional[str] = None, summary_interval: typing.Optional[float] = None):
+    global enabled, profile_operation, profiler
+    if enabled:
+        return
+    enabled = True
+    profile_operation = operation_to_profile
+    if profile_operation:
+        import cProfile
+        profiler = cProfile.Profile()
+    instrument_library()
+    atexit.register(write_report)
+    if summary_interval:
+        start_periodic_summary(summary_interval)
+
+
+def enable_from_environment():
+    if os.environ.get('MUSIC_LIBRARY_INSTRUMENT', '') not in ('', '0') or os.environ.get('MUSIC_LIBRARY_PROFILE'):
+        interval = os.environ.get('MUSIC_LIBRARY_INSTRUMENT_INTERVAL')
+        enable(os.environ.get('MUSIC_LIBRARY_PROFILE') or None, float(interval) if interval else None)
+
+
+def get_summary() -> typing.List[str]:
+    lines = ['{:<50} {:>8} {:>12} {:>12} {:>12}'.format('Operation', 'Calls', 'Total ms', 'Mean ms', 'Max ms')]
+    with stats_lock:
+        for name, stats in sorted(operation_stats.items(), key=lambda item: -item[1].total_seconds):
+            if not stats.calls:
+                continue
+            lines.append('{:<50} {:>8} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+                name, stats.calls, stats.total_seconds * 1000, stats.total_seconds / stats.calls * 1000,
+                stats.max_seconds * 1000))
+    return lines
+
+
+def print_summary(file: typing.TextIO = sys.stderr):
+    print('\n'.join(get_summary()), file=file)
+
+
+def reset():
+    with stats_lock:
+        for stats in operation_stats.values():
+            stats.calls = 0
+            stats.total_seconds = 0.0
+            stats.max_seconds = 0.0
+
+
+def start_periodic_summary(interval: float, file: typing.TextIO = sys.stderr):
+    def print_summaries():
+        while True:
+            time.sleep(interval)
+            print_summary(file)
+
+    threading.Thread(target=print_summaries, daemon=True).start()
+
+
+def write_report():
+    print_summary()
+    if profiler is not None:
+        import pstats
+        profile_file_name = os.environ.get('MUSIC_LIBRARY_PROFILE_FILE', f'{profile_operation}.prof')
+        profiler.dump_stats(profile_file_name)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import typing
+from itertools import chain
+
+import LibraryExport
+import MusicLibrary as ml
+import RotationSimulator
+import SongSearch
+import TimedPlaylist
+
+# Times the library operations on synthetic libraries, e.g.
+#   python LibraryBenchmark.py --songs 1000 10000 100000 --output results.json
+#   python LibraryBenchmark.py --songs 1000 10000 100000 --compare results.json
+# Results are written as json, and --compare reports operations that got slower than a previous run.
+
+
+class BenchmarkConfig:
+    def __init__(self):
+        self.number_of_songs: int = 1000
+        self.number_of_categories: int = 10
+        self.category_distribution: str = 'uniform'  # 'uniform' or 'zipf' for a few large and many small categories
+        self.priority_distribution: typing.List[float] = [1.0 for i in range(ml.num_priorities)]
+        self.number_of_artists: int = 500
+        self.picks: int = 1000
+        self.repeats: int = 3
+        self.scan_tree: bool = True
+        self.write_tags: bool = True  # give the files of the music tree ID3 tags and an mpeg frame
+        self.tag_workers: int = os.cpu_count() or 1
+        self.seed: int = 0
+
+
+def get_category_sizes(config: BenchmarkConfig) -> typing.List[int]:
+    if config.category_distribution == 'zipf':
+        shares = [1.0 / (category_number + 1) for category_number in range(config.number_of_categories)]
+    else:
+        shares = [1.0 for category_number in range(config.number_of_categories)]
+    share_sum = sum(shares)
+    sizes = [int(config.number_of_songs * share / share_sum) for share in shares]
+    sizes[0] += config.number_of_songs - sum(sizes)
+    return sizes
+
+
+def get_song_file_names(config: BenchmarkConfig, rng: random.Random) -> typing.Dict[str, typing.List[str]]:
+    categories = {}
+    song_number = 0
+    for category_number, category_size in enumerate(get_category_sizes(config)):
+        file_names = []
+        for _ in range(category_size):
+            file_names.append(f'Artist {rng.randrange(config.number_of_artists)} - Song {song_number}.mp3')
+            song_number += 1
+        categories[f'Category {category_number}'] = file_names
+    return categories
+
+
+def generate_library(config: BenchmarkConfig) -> ml.MusicLibrary:
+    rng = random.Random(config.seed)
+    library = ml.MusicLibrary()
+    priorities = list(range(len(config.priority_distribution)))
+    for category, file_names in get_song_file_names(config, rng).items():
+        library.categories[category] = [ml.create_song_info(category, file_name) for file_name in file_names]
+        for song, priority in zip(library.categories[category],
+                                  rng.choices(priorities, config.priority_distribution, k=len(file_names))):
+            song.priority = priority
+    library.weights = [rng.randrange(1, 10) for i in range(ml.num_priorities)]
+    for song in chain(*library.categories.values()):
+        song.duration = rng.uniform(120.0, 420.0)
+    return library
+
+
+def get_id3_text_frame(frame_id: bytes, text: str) -> bytes:
+    data = b'\x03' + text.encode('utf-8')
+    return frame_id + len(data).to_bytes(4, 'big') + b'\x00\x00' + data
+
+
+def get_tagged_file_data(file_name: str) -> bytes:
+    # ID3v2.3 tag with the artist and title of the file name, followed by a few silent 128 kbit/s frames
+    artist_name, song_name = os.path.splitext(file_name)[0].split(' - ')
+    frames = get_id3_text_frame(b'TPE1', artist_name) + get_id3_text_frame(b'TIT2', song_name)
+    tag_size = bytes((len(frames) >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    mpeg_frame = b'\xff\xfb\x90\x00' + bytes(413)
+    return b'ID3\x03\x00\x00' + tag_size + frames + mpeg_frame * 4
+
+
+def generate_music_tree(config: BenchmarkConfig, path: str):
+    # Empty or minimal tagged mp3 files laid out the same way as generate_library's songs. Directories are dated
+    # an hour back, like a tree that was copied in well before the library was scanned.
+    rng = random.Random(config.seed)
+    directory_time = time.time() - 3600
+    for category, file_names in get_song_file_names(config, rng).items():
+        os.makedirs(os.path.join(path, category))
+        for file_name in file_names:
+            with open(os.path.join(path, category, file_name), 'wb') as file:
+                if config.write_tags:
+                    file.write(get_tagged_file_data(file_name))
+        os.utime(os.path.join(path, category), (directory_time, directory_time))
+
+
+def time_operation(operation: typing.Callable[[], typing.Any], repeats: int,
+                   operations_per_run: int = 1) -> typing.Dict[str, typing.Any]:
+    times = []
+    try:
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            operation()
+            times.append((time.perf_counter() - start_time) / operations_per_run)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    return {'seconds_min': min(times), 'seconds_mean': sum(times) / len(times), 'runs': len(times)}
+
+
+def run_benchmark(config: BenchmarkConfig) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    results = {}
+    library = generate_library(config)
+    work_directory = tempfile.mkdtemp(prefix='music_library_benchmark_')
+    try:
+        if config.scan_tree:
+            music_path = os.path.join(work_directory, 'music')
+            generate_music_tree(config, music_path)
+            results['create_library'] = time_operation(lambda: ml.create_library(music_path), config.repeats)
+            scanned_library = ml.create_library(music_path)
+            ml.merge_library(library, scanned_library)
+            results['get_updated_library'] = time_operation(
+                lambda: ml.get_updated_library(scanned_library, music_path), config.repeats)
+            results['get_updated_library_incremental'] = time_operation(
+                lambda: ml.get_updated_library_incremental(scanned_library, music_path), config.repeats)
+            if config.write_tags:
+                # Tag reading on its own, reported as files per second as well
+                for operation, tag_workers in (('read_tags', 1), ('read_tags_parallel', config.tag_workers)):
+                    libraries = []
+                    results[operation] = time_operation(
+                        lambda: libraries.append(ml.create_library(music_path, max_workers=tag_workers,
+                                                                   read_tags=True)), config.repeats)
+                    if libraries:
+                        results[operation]['files_per_second'] = max(ml.get_tag_throughput(tagged_library)
+                                                                     for tagged_library in libraries)
+
+        # Picks are drawn from the seed as well, so runs compared against each other make the same picks
+        rng = ml.create_rng(config.seed, 'picks')
+        results['pick_random_song_from_library'] = time_operation(
+            lambda: [ml.pick_random_song_from_library(library, rng) for _ in range(config.picks)], config.repeats,
+            config.picks)
+        results['generate_playlist'] = time_operation(
+            lambda: ml.generate_playlist(library, 40, allow_duplicates=False, rng=rng), config.repeats)
+        # A week of hourly playlists
+        results['generate_timed_playlists'] = time_operation(
+            lambda: TimedPlaylist.generate_timed_playlists(library, 7 * 24, 3600, 30, rng=rng), config.repeats)
+        results['simulate_rotation'] = time_operation(
+            lambda: RotationSimulator.simulate_rotation(library, 1000000, 40, rng=rng), config.repeats)
+        results['build_search_index'] = time_operation(lambda: SongSearch.get_search_index(library), 1)
+        # Selective queries, as typed into the editor's search box
+        search_queries = [SongSearch.parse_query(query_text) for query_text in
+                          ('artist 12 song 4', 'song 4242', 'artist 7 p:2-4', 'c:"Category 3" r:0 artist 1', 'p:4 r:0')]
+        results['search_songs'] = time_operation(
+            lambda: [SongSearch.search_songs(library, query, 1000) for query in search_queries], config.repeats,
+            len(search_queries))
+        results['calculate_relative_frequency'] = time_operation(
+            lambda: ml.calculate_relative_frequency(library, 40), config.repeats)
+        results['reset_repeats_special'] = time_operation(lambda: ml.reset_repeats_special(library), config.repeats)
+        results['decay_repeats'] = time_operation(lambda: ml.decay_repeats(library, 0.5), config.repeats)
+
+        json_file_name = os.path.join(work_directory, 'library.json')
+        compact_file_name = os.path.join(work_directory, 'library' + ml.COMPACT_LIBRARY_EXTENSION)
+        results['save_library'] = time_operation(lambda: ml.save_library(library, json_file_name), config.repeats)
+        results['load_library'] = time_operation(lambda: ml.load_library(json_file_name), config.repeats)
+        results['save_library_compact'] = time_operation(lambda: ml.save_library(library, compact_file_name),
+                                                         config.repeats)
+        results['load_library_compact'] = time_operation(lambda: ml.load_library(compact_file_name), config.repeats)
+        for export_format in ('text', 'json', 'csv', 'm3u'):
+            export_file_name = os.path.join(work_directory, 'export.' + export_format)
+            results[f'export_{export_format}'] = time_operation(
+                lambda: LibraryExport.export_library(library, export_file_name, export_format), config.repeats)
+        results['export_csv_gzip'] = time_operation(
+            lambda: LibraryExport.export_library(library, os.path.join(work_directory, 'export.csv.gz'), 'csv'),
+            config.repeats)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    return results
+
+
+def compare_results(baseline: typing.Dict[str, typing.Any], current: typing.Dict[str, typing.Any],
+                    threshold: float) -> typing.Tuple[typing.List[str], int]:
+    # Returns a line per operation found in both runs and the number of operations slower by more than threshold
+    lines = []
+    regressions = 0
+    for size, operations in current['results'].items():
+        for operation, result in operations.items():
+            baseline_result = baseline['results'].get(size, {}).get(operation)
+            if not baseline_result or 'seconds_min' not in baseline_result or 'seconds_min' not in result:
+                continue
+            ratio = result['seconds_min'] / baseline_result['seconds_min'] if baseline_result['seconds_min'] else 1.0
+            is_regression = ratio > 1.0 + threshold
+            regressions += is_regression
+            lines.append('{:>9} {:<34} {:>12.6f} {:>12.6f} {:>7.2f}x{}'.format(
+                size, operation, baseline_result['seconds_min'], result['seconds_min'], ratio,
+                '  REGRESSION' if is_regression else ''))
+    lines.append(f'{regressions} regressions')
+    return lines, regressions
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark music library operations on synthetic libraries.')
+    parser.add_argument('--songs', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--category-distribution', choices=('uniform', 'zipf'), default='uniform')
+    parser.add_argument('--priority-distribution', default=None,
+                        help='comma separated relative number of songs per priority, e.g. 5,3,2')
+    parser.add_argument('--artists', type=int, default=500)
+    parser.add_argument('--picks', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-scan', action='store_true', help="skip operations that need files on disk")
+    parser.add_argument('--no-tags', action='store_true', help="write empty files and skip reading tags")
+    parser.add_argument('--tag-workers', type=int, default=os.cpu_count() or 1,
+                        help='processes for the parallel tag reading run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown counted as a regression')
+    args = parser.parse_args(argv)
+
+    output = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {},
+    }
+    for number_of_songs in args.songs:
+        config = BenchmarkConfig()
+        config.number_of_songs = number_of_songs
+        config.number_of_categories = args.categories
+        config.category_distribution = args.category_distribution
+        if args.priority_distribution:
+            config.priority_distribution = [float(share) for share in args.priority_distribution.split(',')]
+        config.number_of_artists = args.artists
+        config.picks = args.picks
+        config.repeats = args.repeats
+        config.scan_tree = not args.no_scan
+        config.write_tags = not args.no_tags
+        config.tag_workers = args.tag_workers
+        config.seed = args.seed
+        output['results'][str(number_of_songs)] = run_benchmark(config)
+        for operation, result in output['results'][str(number_of_songs)].items():
+            print('{:>9} {:<34} {}{}'.format(number_of_songs, operation,
+                                              result['error'] if 'error' in result
+                                              else '{:.6f} s'.format(result['seconds_min']),
+                                              ', {:.0f} files/s'.format(result['files_per_second'])
+                                              if 'files_per_second' in result else ''), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        lines, regressions = compare_results(baseline, output, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+import csv
+import gzip
+import io
+import json
+import os
+import typing
+
+import MusicLibrary as ml
+
+# Song lists written out of a library, one format per generator. A generator yields the text of a chunk of
+# songs at a time and write_export writes each chunk with one call into a large buffer, so exporting uses the
+# same memory for any size of library and nothing like the whole to_dict tree is built first.
+#   text   songs per category with their priority and how often they come up, for reading
+#   bare   songs per category as artist-"title
+#   json   same document as json.dump(ml.to_dict(library))
+#   csv    one row per song with a header row
+#   m3u    extended m3u playlist of every song, with durations when known and paths relative to the playlist
+# Files ending in .gz are gzip compressed, whatever the format. Uncompressed text, bare and json files are written
+# in the locale's encoding like the write_song_list functions always did, everything else is utf-8.
+EXPORT_CHUNK_SONGS = 2048  # songs encoded per chunk
+EXPORT_BUFFER_SIZE = 1024 * 1024
+EXPORT_GZIP_LEVEL = 6  # the default of 9 is several times slower for a slightly smaller file
+GZIP_EXTENSION = '.gz'
+
+CSV_COLUMNS = ['category', 'artist_name', 'song_name', 'priority', 'number_of_repeats', 'duration', 'file_path']
+FORMAT_EXTENSIONS = {'.txt': 'text', '.json': 'json', '.csv': 'csv', '.m3u': 'm3u', '.m3u8': 'm3u'}
+LOCALE_ENCODING_FORMATS = {'text', 'bare', 'json'}
+
+
+def get_chunks(songs: typing.Iterable[ml.SongInfo],
+               format_song: typing.Callable[[ml.SongInfo], str]) -> typing.Iterator[str]:
+    lines: typing.List[str] = []
+    for song in songs:
+        lines.append(format_song(song))
+        if len(lines) == EXPORT_CHUNK_SONGS:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def get_song_groups(songs: typing.Iterable[ml.SongInfo]) -> typing.Iterator[typing.List[ml.SongInfo]]:
+    group: typing.List[ml.SongInfo] = []
+    for song in songs:
+        group.append(song)
+        if len(group) == EXPORT_CHUNK_SONGS:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def iter_song_list(library: ml.MusicLibrary) -> typing.Iterator[str]:
+    relative_frequencies = ['{:.2f}'.format(relative_frequency) if relative_frequency != '--' else '--'
+                            for relative_frequency in ml.calculate_relative_frequency(library, 40)]
+
+    def format_song(song: ml.SongInfo) -> str:
+        return '{:<15}{:<20} {} - {}\n'.format(f'Priority: {song.priority}',
+                                               f'Frequency: {relative_frequencies[song.priority]}',
+                                               song.artist_name, song.song_name)
+
+    for category, songs in library.categories.items():
+        yield category + '\n'
+        yield from get_chunks(songs, format_song)
+        yield '\n'
+
+
+def iter_song_list_bare(library: ml.MusicLibrary) -> typing.Iterator[str]:
+    for category, songs in library.categories.items():
+        yield '(cat)' + category + '\n'
+        yield from get_chunks(songs, lambda song: f'{song.artist_name}-"{song.song_name}\n')
+        yield '\n'
+
+
+def iter_json_items(encoder: json.JSONEncoder, items: typing.Iterable[typing.Tuple[str, typing.Any]],
+                    get_value_chunks: typing.Callable[[str, typing.Any], typing.Iterator[str]]) -> typing.Iterator[str]:
+    yield '{'
+    for item_number, (key, value) in enumerate(items):
+        yield (', ' if item_number else '') + encoder.encode(key) + ': '
+        yield from get_value_chunks(key, value)
+    yield '}'
+
+
+def iter_json_songs(encoder: json.JSONEncoder, songs: typing.Iterable[ml.SongInfo]) -> typing.Iterator[str]:
+    # A chunk of songs is encoded as one list and the brackets cut off, which keeps the encoding in the C encoder
+    yield '['
+    for group_number, group in enumerate(get_song_groups(songs)):
+        encoded_group = encoder.encode([ml.song_to_dict(song) for song in group])
+        yield (', ' if group_number else '') + encoded_group[1:-1]
+    yield ']'
+
+
+def iter_json_object(encoder: json.JSONEncoder, obj: typing.Dict[str, typing.Any]) -> typing.Iterator[str]:
+    # Large dicts, like the files of a scan snapshot, are encoded a chunk of items at a time
+    items = list(obj.items())
+    yield '{'
+    for start in range(0, len(items), EXPORT_CHUNK_SONGS):
+        encoded_chunk = encoder.encode(dict(items[start:start + EXPORT_CHUNK_SONGS]))
+        yield (', ' if start else '') + encoded_chunk[1:-1]
+    yield '}'
+
+
+def iter_song_list_json(library: ml.MusicLibrary) -> typing.Iterator[str]:
+    encoder = json.JSONEncoder()
+
+    def get_snapshot_chunks(key: str, value: typing.Any) -> typing.Iterator[str]:
+        if key == 'files':
+            return iter_json_object(encoder, value)
+        return iter([encoder.encode(value)])
+
+    def get_library_chunks(key: str, value: typing.Any) -> typing.Iterator[str]:
+        if key == 'categories':
+            return iter_json_items(encoder, library.categories.items(),
+                                   lambda category, songs: iter_json_songs(encoder, songs))
+        if key == 'scan_snapshot':
+            return iter_json_items(encoder, ml.snapshot_to_dict(library.scan_snapshot).items(), get_snapshot_chunks)
+        return iter([encoder.encode(value)])
+
+    # Same keys in the same order as to_dict, the songs and snapshot are filled in as they are written
+    library_items = [('categories', None), ('weights', library.weights)]
+    if library.scan_snapshot:
+        library_items.append(('scan_snapshot', None))
+    if library.journal_id:
+        library_items.append(('journal_id', library.journal_id))
+    yield from iter_json_items(encoder, library_items, get_library_chunks)
+
+
+def iter_song_list_csv(library: ml.MusicLibrary) -> typing.Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+    for category, songs in library.categories.items():
+        for group in get_song_groups(songs):
+            writer.writerows((category, song.artist_name, song.song_name, song.priority, song.number_of_repeats,
+                              song.duration or '', song.file_path) for song in group)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def get_playlist_entry_path(full_path: str, playlist_directory: str) -> str:
+    try:
+        return os.path.relpath(full_path, playlist_directory)
+    except ValueError:  # on another drive than the playlist
+        return full_path
+
+
+def iter_song_list_m3u(library: ml.MusicLibrary, playlist_path: typing.Optional[str] = None) -> typing.Iterator[str]:
+    # Players resolve entries from the playlist's directory, so the songs' paths are rewritten relative to it when
+    # the library knows where its files are. Without a playlist path or a scan snapshot they stay as in the library.
+    library_path = library.scan_snapshot.library_path if library.scan_snapshot else ''
+    playlist_directory = os.path.dirname(os.path.abspath(playlist_path)) if playlist_path and library_path else ''
+
+    def format_song(song: ml.SongInfo) -> str:
+        title = f'{song.artist_name} - {song.song_name}' if song.artist_name else song.song_name
+        duration = round(song.duration) if song.duration else -1
+        entry_path = song.file_path
+        if playlist_directory:
+            entry_path = get_playlist_entry_path(os.path.join(library_path, song.file_path), playlist_directory)
+        return f'#EXTINF:{duration},{title}\n{entry_path}\n'
+
+    yield '#EXTM3U\n'
+    for songs in library.categories.values():
+        yield from get_chunks(songs, format_song)
+
+
+EXPORT_FORMATS: typing.Dict[str, typing.Callable[[ml.MusicLibrary], typing.Iterator[str]]] = {
+    'text': iter_song_list,
+    'bare': iter_song_list_bare,
+    'json': iter_song_list_json,
+    'csv': iter_song_list_csv,
+    'm3u': iter_song_list_m3u,
+}
+
+
+def is_compressed(file_path: str) -> bool:
+    return file_path.lower().endswith(GZIP_EXTENSION)
+
+
+def get_export_format(file_path: str, default: str = 'text') -> str:
+    # Format implied by the extension, looking past a .gz
+    if is_compressed(file_path):
+        file_path = file_path[:-len(GZIP_EXTENSION)]
+    return FORMAT_EXTENSIONS.get(os.path.splitext(file_path)[1].lower(), default)
+
+
+def write_export(chunks: typing.Iterable[str], file_path: str, compress: typing.Optional[bool] = None,
+                 encoding: typing.Optional[str] = 'utf-8'):
+    # compress defaults to whether the file ends in .gz, an encoding of None is the locale's
+    if compress is None:
+        compress = is_compressed(file_path)
+    if compress:
+        inner_file_name = os.path.basename(file_path)
+        if is_compressed(inner_file_name):
+            inner_file_name = inner_file_name[:-len(GZIP_EXTENSION)]
+        with open(file_path, 'wb') as raw_file:
+            with gzip.GzipFile(inner_file_name, 'wb', EXPORT_GZIP_LEVEL, raw_file) as gzip_file:
+                with io.TextIOWrapper(io.BufferedWriter(gzip_file, EXPORT_BUFFER_SIZE), encoding=encoding) as file:
+                    file.writelines(chunks)
+    else:
+        with open(file_path, 'w', encoding=encoding, buffering=EXPORT_BUFFER_SIZE) as file:
+            file.writelines(chunks)
+
+
+def export_library(library: ml.MusicLibrary, file_path: str, export_format: typing.Optional[str] = None,
+                   compress: typing.Optional[bool] = None):
+    # export_format defaults to the one implied by the file's extension
+    if export_format is None:
+        export_format = get_export_format(file_path)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {export_format}, expected one of {", ".join(EXPORT_FORMATS)}')
+    if export_format == 'm3u':
+        chunks = iter_song_list_m3u(library, file_path)
+    else:
+        chunks = EXPORT_FORMATS[export_format](library)
+    if compress is None:
+        compress = is_compressed(file_path)
+    encoding = None if export_format in LOCALE_ENCODING_FORMATS and not compress else 'utf-8'
+    write_export(chunks, file_path, compress, encoding)
@@ -0,0 +1,169 @@
+import json
+import os
+import typing
+
+import MusicLibrary as ml
+import SongStore
+
+# Append only log of song changes kept next to a library file, so picks survive a crash without rewriting the
+# whole library. The first line names the save of the library it applies to, every other line is a song's new
+# priority and repeats: {"c": category, "i": index in category, "p": priority, "r": number of repeats}.
+# Entries hold absolute values, so replaying a journal more than once gives the same library.
+JOURNAL_EXTENSION = '.journal'
+
+
+def get_journal_file_name(library_file_name: str) -> str:
+    return os.path.abspath(library_file_name) + JOURNAL_EXTENSION
+
+
+class LibraryJournal:
+    def __init__(self, library: ml.MusicLibrary, library_file_name: str, compaction_interval: int, sync: bool):
+        self.library: ml.MusicLibrary = library
+        self.library_file_name: str = os.path.abspath(library_file_name)
+        self.file_name: str = get_journal_file_name(library_file_name)
+        self.compaction_interval: int = compaction_interval  # entries before the library is saved, 0 for never
+        self.sync: bool = sync  # fsync after every entry, survives power loss and not just a crashed process
+        self.song_locations: typing.Dict[int, typing.Tuple[str, int]] = {}
+        # Store, rows and name of SongViewList categories, whose views are located by their row instead
+        self.row_locations: typing.List[typing.Tuple[SongStore.SongStore, range, str]] = []
+        self.signature: typing.Tuple = ()  # of the library when song_locations was taken
+        self.number_of_entries: int = 0
+        self.file: typing.Optional[typing.TextIO] = None
+
+    def locate_songs(self):
+        self.song_locations = {}
+        self.row_locations = []
+        for category, songs in self.library.categories.items():
+            if isinstance(songs, SongStore.SongViewList):
+                self.row_locations.append((songs.store, songs.rows, category))
+            else:
+                self.song_locations.update((id(song), (category, song_number))
+                                           for song_number, song in enumerate(songs))
+        self.signature = ml.get_library_signature(self.library)
+
+    def locate_song(self, song: ml.SongInfo) -> typing.Optional[typing.Tuple[str, int]]:
+        if isinstance(song, SongStore.SongView):
+            for store, rows, category in self.row_locations:
+                if song.store is store and song.row in rows:
+                    return category, song.row - rows.start
+        return self.song_locations.get(id(song))
+
+    def resume(self, number_of_entries: int):
+        # Keeps appending to a journal that was already replayed into the library
+        self.locate_songs()
+        self.number_of_entries = number_of_entries
+        with open(self.file_name, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            ends_with_newline = file.read(1) == b'\n'
+        self.file = open(self.file_name, 'a')
+        if not ends_with_newline:
+            # Ends an entry left unfinished by a crash, replaying skips it
+            self.file.write('\n')
+
+    def reset(self):
+        # Starts an empty journal for the library's current save
+        if self.file:
+            self.file.close()
+        self.locate_songs()
+        self.number_of_entries = 0
+        self.file = open(self.file_name, 'w')
+        self.file.write(json.dumps({'journal_id': self.library.journal_id}) + '\n')
+        self.flush()
+
+    def record_song_change(self, song: ml.SongInfo, priority: int, number_of_repeats: int):
+        # The song being changed still has its old values here, so a compaction saves it as it was before this
+        # entry. Songs added, removed or moved in the category lists have other locations than the journal has,
+        # so the library is saved and the journal started over against the lists as they are now.
+        if (self.compaction_interval and self.number_of_entries >= self.compaction_interval) or \
+                self.signature != ml.get_library_signature(self.library):
+            compact_journal(self.library)
+        location = self.locate_song(song)
+        if location is None or self.file is None:
+            return
+        category, song_number = location
+        self.file.write(json.dumps({'c': category, 'i': song_number, 'p': priority, 'r': number_of_repeats}) + '\n')
+        self.flush()
+        self.number_of_entries += 1
+
+    def flush(self):
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def open_journal(library: ml.MusicLibrary, library_file_name: str, compaction_interval: int = 10000,
+                 sync: bool = False, resume: bool = False) -> LibraryJournal:
+    # Saves the library first, so the journal starts out empty against a known save. With resume, a journal that
+    # belongs to the library's save (and so was replayed when loading it) is appended to instead.
+    close_journal(library)
+    journal = LibraryJournal(library, library_file_name, compaction_interval, sync)
+    library.journal = journal
+    ml.invalidate_picker_index(library)
+    ml.get_picker_index(library)
+
+    journal_entries = read_journal(library, library_file_name) if resume else None
+    if journal_entries is not None:
+        journal.resume(len(journal_entries))
+    else:
+        ml.save_library(library, library_file_name)
+    return journal
+
+
+def close_journal(library: ml.MusicLibrary):
+    if library.journal is not None:
+        library.journal.close()
+        library.journal = None
+        ml.invalidate_picker_index(library)
+
+
+def remove_journal(library_file_name: str):
+    try:
+        os.remove(get_journal_file_name(library_file_name))
+    except FileNotFoundError:
+        pass
+
+
+def compact_journal(library: ml.MusicLibrary):
+    # Writes the journaled changes into the library file, which empties the journal
+    ml.save_library(library, library.journal.library_file_name)
+
+
+def read_journal(library: ml.MusicLibrary, library_file_name: str) -> typing.Optional[typing.List[typing.Any]]:
+    # None if there is no journal for the library's current save
+    journal_file_name = get_journal_file_name(library_file_name)
+    if not library.journal_id or not os.path.exists(journal_file_name):
+        return None
+
+    with open(journal_file_name, 'r') as file:
+        lines = file.read().split('\n')
+    try:
+        if json.loads(lines[0]).get('journal_id') != library.journal_id:
+            return None
+    except json.JSONDecodeError:
+        return None
+
+    entries = []
+    for line in lines[1:]:
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue  # the process stopped in the middle of writing this entry
+    return entries
+
+
+def replay_journal(library: ml.MusicLibrary, library_file_name: str) -> int:
+    # Returns the number of entries applied, a journal from a different save of the library is ignored
+    entries = read_journal(library, library_file_name)
+    if entries is None:
+        return 0
+
+    for entry in entries:
+        song = library.categories[entry['c']][entry['i']]
+        song.priority = entry['p']
+        song.number_of_repeats = entry['r']
+    return len(entries)
@@ -0,0 +1,280 @@
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import typing
+
+import MusicLibrary as ml
+
+# Keeps a library in sync with its music directory while it is in use, instead of choosing Update Library by hand.
+# Only directories are watched: adding, removing or renaming a file changes the mtime of its directory. On Linux
+# the directories are watched with inotify, elsewhere (or when inotify runs out of watches) their mtimes are
+# polled, which is one stat per directory and no listing.
+#
+# Changes are debounced: an update starts once nothing changed for settle_seconds, or max_delay_seconds after the
+# first change if changes keep coming, so copying a whole album in is one update and not one per file. The update
+# is an incremental scan on a worker thread, which only lists the directories that changed. Merging and applying
+# it is left to the thread that owns the library, see LibraryWatcher.apply_pending_update, since picks made
+# meanwhile must not be lost. Priorities and repeats are kept, renamed and moved files included.
+#   watcher = LibraryWatcher(library)
+#   watcher.start()
+#   ... now and then, on the thread that uses the library:
+#   diff = watcher.apply_pending_update()
+
+SETTLE_SECONDS = 2.0
+MAX_DELAY_SECONDS = 30.0
+POLL_INTERVAL_SECONDS = 1.0
+
+# From sys/inotify.h
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x1000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+# Files being written count as changes too, so a slow copy isn't picked up half way
+INOTIFY_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_MODIFY | IN_CLOSE_WRITE | IN_DELETE_SELF
+                | IN_MOVE_SELF | IN_ONLYDIR)
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def get_watched_directories(library_path: str, snapshot: typing.Optional[ml.ScanSnapshot]) -> typing.List[str]:
+    # The music directory itself, for new and removed categories, and every directory the last scan listed
+    directories = [library_path]
+    if snapshot:
+        directories.extend(os.path.join(library_path, directory) for directory in snapshot.directories.keys())
+    return directories
+
+
+def get_mtime(directory: str) -> typing.Optional[int]:
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+class PollingMonitor:
+    def __init__(self, poll_interval: float):
+        self.poll_interval: float = poll_interval
+        self.mtimes: typing.Dict[str, typing.Optional[int]] = {}
+
+    def watch(self, library_path: str, snapshot: typing.Optional[ml.ScanSnapshot]):
+        # Starts from the mtimes the scan saw, so changes made since the scan show up on the first poll
+        self.mtimes = {directory: get_mtime(directory) for directory in get_watched_directories(library_path, snapshot)}
+        if snapshot:
+            for directory, mtime in snapshot.directories.items():
+                self.mtimes[os.path.join(library_path, directory)] = mtime
+            # A library saved before the music directory's mtime was recorded gets one scan to be sure
+            self.mtimes[library_path] = snapshot.library_mtime
+            if (snapshot.library_mtime or 0) >= snapshot.scan_time_ns - ml.SNAPSHOT_MTIME_GRACE_NS:
+                self.mtimes[library_path] = None
+        else:
+            self.mtimes[library_path] = None  # never scanned, the first poll sees a change
+
+    def wait_for_changes(self, timeout: float) -> bool:
+        # Returns whether any directory changed since the previous call
+        time.sleep(min(timeout, self.poll_interval))
+        changed = False
+        for directory, mtime in self.mtimes.items():
+            new_mtime = get_mtime(directory)
+            if new_mtime != mtime:
+                self.mtimes[directory] = new_mtime
+                changed = True
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor:
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd: int = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watch_descriptors: typing.Dict[str, int] = {}
+        self.directories: typing.Dict[int, str] = {}  # watch descriptor -> directory
+
+    def add_watch(self, directory: str) -> int:
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+        if watch_descriptor >= 0:
+            self.watch_descriptors[directory] = watch_descriptor
+            self.directories[watch_descriptor] = directory
+        return watch_descriptor
+
+    def watch(self, library_path: str, snapshot: typing.Optional[ml.ScanSnapshot]):
+        import ctypes
+        directories = get_watched_directories(library_path, snapshot)
+        for directory in set(self.watch_descriptors.keys()) - set(directories):
+            watch_descriptor = self.watch_descriptors.pop(directory)
+            self.directories.pop(watch_descriptor, None)
+            self.libc.inotify_rm_watch(self.fd, watch_descriptor)
+        for directory in directories:
+            if directory not in self.watch_descriptors and self.add_watch(directory) < 0:
+                error_number = ctypes.get_errno()
+                if error_number == 28:  # ENOSPC, out of watches
+                    raise OSError(error_number, 'Out of inotify watches, see /proc/sys/fs/inotify/max_user_watches')
+                # Otherwise removed since the scan, the parent directory's events cover it
+
+    def wait_for_changes(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                break
+            position = 0
+            while position < len(data):
+                watch_descriptor, mask, cookie, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, position)
+                position += INOTIFY_EVENT_HEADER.size
+                name = data[position:position + name_length].rstrip(b'\x00')
+                position += name_length
+                directory = self.directories.get(watch_descriptor)
+                if mask & IN_IGNORED and directory is not None:
+                    # The directory is gone, its watch with it
+                    del self.directories[watch_descriptor]
+                    self.watch_descriptors.pop(directory, None)
+                elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and directory is not None:
+                    # Watched right away, so files copied into a new directory are part of the same batch
+                    self.add_watch(os.path.join(directory, os.fsdecode(name)))
+                changed = True
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_monitor(use_inotify: bool, poll_interval: float) -> typing.Union[InotifyMonitor, PollingMonitor]:
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            return InotifyMonitor()
+        except (OSError, AttributeError):
+            pass  # no inotify in this libc, or out of instances
+    return PollingMonitor(poll_interval)
+
+
+class LibraryWatcher:
+    def __init__(self, library: ml.MusicLibrary, library_path: typing.Optional[str] = None,
+                 settle_seconds: float = SETTLE_SECONDS, max_delay_seconds: float = MAX_DELAY_SECONDS,
+                 poll_interval: float = POLL_INTERVAL_SECONDS, use_inotify: bool = True, max_workers: int = 1):
+        # library_path defaults to the directory the library was scanned from. Whether the scan was recursive
+        # and read tags is taken over from the library too.
+        if library_path is None:
+            if not library.scan_snapshot:
+                raise ValueError('The library has no scan to take the music directory from, give library_path')
+            library_path = library.scan_snapshot.library_path
+        self.library: ml.MusicLibrary = library
+        self.library_path: str = os.path.abspath(library_path)
+        self.settle_seconds: float = settle_seconds
+        self.max_delay_seconds: float = max_delay_seconds
+        self.max_workers: int = max_workers
+        self.monitor = create_monitor(use_inotify, poll_interval)
+        self.pending_update: typing.Optional[ml.MusicLibrary] = None
+        self.update_applied = threading.Event()  # no update is waiting to be applied
+        self.update_applied.set()
+        self.stop_event = threading.Event()
+        self.thread: typing.Optional[threading.Thread] = None
+        self.updates: int = 0
+        self.error: typing.Optional[BaseException] = None  # of the latest update, which is then tried again
+        self.watch_library()
+
+    def watch_library(self):
+        try:
+            self.monitor.watch(self.library_path, self.library.scan_snapshot)
+        except OSError:
+            if isinstance(self.monitor, PollingMonitor):
+                raise
+            # Out of inotify watches, a large tree is still fine to poll
+            self.monitor.close()
+            self.monitor = PollingMonitor(POLL_INTERVAL_SECONDS)
+            self.monitor.watch(self.library_path, self.library.scan_snapshot)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, wait: bool = True):
+        # Without wait, a scan in progress finishes in the background and its result is dropped
+        self.stop_event.set()
+        self.update_applied.set()
+        if self.thread is None:
+            self.monitor.close()
+        elif wait:
+            self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                if self.wait_for_settled_changes(POLL_INTERVAL_SECONDS):
+                    self.scan()
+        finally:
+            self.monitor.close()
+
+    def wait_for_settled_changes(self, timeout: float) -> bool:
+        # Waits up to timeout for a change, then for the changes to stop. Returns False if nothing changed.
+        if not self.monitor.wait_for_changes(timeout):
+            return False
+        first_change_time = last_change_time = time.monotonic()
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            settle_time_left = last_change_time + self.settle_seconds - now
+            delay_time_left = first_change_time + self.max_delay_seconds - now
+            if settle_time_left <= 0 or delay_time_left <= 0:
+                break
+            if self.monitor.wait_for_changes(min(settle_time_left, delay_time_left)):
+                last_change_time = time.monotonic()
+        return not self.stop_event.is_set()
+
+    def scan(self):
+        # Only reads the library, and the songs lists are only replaced by apply_pending_update, which waits for
+        # this scan's result to exist. Changes seen while the result waits are picked up by the next scan.
+        snapshot = self.library.scan_snapshot
+        try:
+            updated_library = ml.scan_library(self.library_path, self.library, self.max_workers,
+                                              snapshot.recursive if snapshot else False,
+                                              read_tags=snapshot.has_tags if snapshot else False)
+        except OSError as e:
+            # Likely a directory removed while being listed, the monitor has seen that too and a new scan follows
+            self.error = e
+            return
+        self.error = None
+        if snapshot and updated_library.scan_snapshot.files == snapshot.files and \
+                list(updated_library.categories.keys()) == list(self.library.categories.keys()):
+            return  # nothing added, removed or rewritten, e.g. a file created and deleted again
+        self.update_applied.clear()
+        self.pending_update = updated_library
+        while not self.update_applied.wait(POLL_INTERVAL_SECONDS) and not self.stop_event.is_set():
+            pass
+
+    def has_pending_update(self) -> bool:
+        return self.pending_update is not None
+
+    def apply_pending_update(self) -> typing.Optional[ml.LibraryDiff]:
+        # Call from the thread that uses the library. Returns None if there was nothing to apply.
+        updated_library = self.pending_update
+        if updated_library is None:
+            return None
+        diff = ml.merge_library(self.library, updated_library, keep_repeats=True)
+        ml.replace_library_songs(self.library, updated_library, diff)
+        self.pending_update = None
+        self.updates += 1
+        self.watch_library()
+        self.update_applied.set()
+        return diff
@@ -1,212 +1,1114 @@
+import hashlib
 import json
 import os
 import random
+import threading
+import time
 import typing
+import uuid
+from array import array
 from itertools import chain
 
+import SongTags
+
 # todo(Aceplace): Move this into MusicLibrary as member variable
 num_priorities = 20
 
+COMPACT_LIBRARY_EXTENSION = '.mlib'
+COMPACT_LIBRARY_MAGIC = b'MCLIB\x00\x01\x00'
+
 
 class SongInfo:
+    __slots__ = ('artist_name', 'song_name', 'file_path', 'duration', '_priority', '_number_of_repeats',
+                 '_picker_index', '_picker_slot')
+
     def __init__(self):
         self.artist_name: str = ''
         self.song_name: str = ''
         self.file_path: str = ''
-        self.priority: int = 0
-        self.number_of_repeats: int = 0
+        self.duration: float = 0.0  # seconds, 0 when unknown
+        self._priority: int = 0
+        self._number_of_repeats: int = 0
+        # Set while the song is tracked by a PickerIndex, so priority/repeat changes keep the index current
+        self._picker_index: typing.Optional['PickerIndex'] = None
+        self._picker_slot: int = 0
+
+    @property
+    def priority(self) -> int:
+        return self._priority
+
+    @priority.setter
+    def priority(self, priority: int):
+        if self._picker_index is not None and priority != self._priority:
+            self._picker_index.move_song(self, priority, self._number_of_repeats)
+        self._priority = priority
+
+    @property
+    def number_of_repeats(self) -> int:
+        return self._number_of_repeats
+
+    @number_of_repeats.setter
+    def number_of_repeats(self, number_of_repeats: int):
+        if self._picker_index is not None and number_of_repeats != self._number_of_repeats:
+            self._picker_index.move_song(self, self._priority, number_of_repeats)
+        self._number_of_repeats = number_of_repeats
+
+
+# Songs bucketed by priority and then by number of repeats, so the least repeated songs of a priority
+# can be chosen without scanning the library. Buckets are unordered; a song's position in its bucket
+# is kept in song._picker_slot so it can be removed by swapping with the last entry.
+# Songs of SongViewList categories are bucketed by their row in the SongStore instead, read from its columns, so
+# indexing a compact library doesn't create a view per song. Their positions are kept in row_slots, and get_song
+# gives the view of a bucket entry.
+class PickerIndex:
+    def __init__(self, library: 'MusicLibrary'):
+        import SongStore
+        self.buckets: typing.Dict[int, typing.Dict[int, typing.List[typing.Union[SongInfo, int]]]] = {}
+        self.min_repeats: typing.Dict[int, int] = {}
+        self.priority_counts: typing.Dict[int, int] = {}
+        self.signature = get_library_signature(library)
+        self.song_lists = list(library.categories.values())  # keeps the ids in the signature from being reused
+        self.stale: bool = False  # another index took over some of the songs, so their changes go there
+        self.version: int = 0  # bumped on every change, for caches derived from the index
+        # Called with the song and its new priority and repeats, before the song itself is updated
+        self.change_listener: typing.Optional[typing.Callable[[SongInfo, int, int], None]] = None
+        self.store: typing.Optional['SongStore.SongStore'] = None  # whose rows are bucketed, the first one found
+        self.row_slots: array = array('q')  # slot of each row of the store, -1 for rows not in the index
+
+        for songs in library.categories.values():
+            if isinstance(songs, SongStore.SongViewList) and (self.store is None or songs.store is self.store):
+                self.add_rows(songs.store, songs.rows)
+            else:
+                for song in songs:
+                    self.add_song(song, song.priority, song.number_of_repeats)
+
+    def add_rows(self, store: 'SongStore.SongStore', rows: range):
+        if self.store is None:
+            if store.picker_index is not None:
+                store.picker_index.stale = True  # a store shared between libraries
+            store.picker_index = self
+            self.store = store
+            self.row_slots = array('q', [-1]) * len(store)
+        # Grouped first, the index is then updated once per group rather than once per row
+        groups: typing.Dict[typing.Tuple[int, int], typing.List[int]] = {}
+        for row, key in zip(rows, zip(store.priorities[rows.start:rows.stop], store.repeats[rows.start:rows.stop])):
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [row]
+            else:
+                group.append(row)
+        row_slots = self.row_slots
+        for (priority, number_of_repeats), group in groups.items():
+            bucket = self.get_bucket(priority, number_of_repeats, len(group))
+            for slot, row in enumerate(group, len(bucket)):
+                row_slots[row] = slot
+            bucket.extend(group)
+
+    def get_bucket(self, priority: int, number_of_repeats: int,
+                   number_of_songs: int = 1) -> typing.List[typing.Union[SongInfo, int]]:
+        # Of songs being added
+        self.version += 1
+        repeat_buckets = self.buckets.setdefault(priority, {})
+        bucket = repeat_buckets.setdefault(number_of_repeats, [])
+        self.priority_counts[priority] = self.priority_counts.get(priority, 0) + number_of_songs
+        if priority not in self.min_repeats or number_of_repeats < self.min_repeats[priority]:
+            self.min_repeats[priority] = number_of_repeats
+        return bucket
+
+    def add_song(self, song: SongInfo, priority: int, number_of_repeats: int):
+        bucket = self.get_bucket(priority, number_of_repeats)
+        if song._picker_index is not None and song._picker_index is not self:
+            song._picker_index.stale = True  # a song shared between libraries
+        song._picker_index = self
+        song._picker_slot = len(bucket)
+        bucket.append(song)
+
+    def add_row(self, row: int, priority: int, number_of_repeats: int):
+        bucket = self.get_bucket(priority, number_of_repeats)
+        self.row_slots[row] = len(bucket)
+        bucket.append(row)
+
+    def has_row(self, row: int) -> bool:
+        return row < len(self.row_slots) and self.row_slots[row] >= 0
+
+    def get_song(self, entry: typing.Union[SongInfo, int]) -> SongInfo:
+        return self.store.get_view(entry) if type(entry) is int else entry
+
+    def remove_song(self, song: SongInfo, priority: int, number_of_repeats: int):
+        self.remove_entry(song._picker_slot, priority, number_of_repeats)
+        song._picker_index = None
+
+    def remove_row(self, row: int, priority: int, number_of_repeats: int):
+        self.remove_entry(self.row_slots[row], priority, number_of_repeats)
+        self.row_slots[row] = -1
+
+    def remove_entry(self, slot: int, priority: int, number_of_repeats: int):
+        self.version += 1
+        repeat_buckets = self.buckets[priority]
+        bucket = repeat_buckets[number_of_repeats]
+        last_entry = bucket.pop()
+        if slot < len(bucket):
+            bucket[slot] = last_entry
+            if type(last_entry) is int:
+                self.row_slots[last_entry] = slot
+            else:
+                last_entry._picker_slot = slot
+
+        self.priority_counts[priority] -= 1
+        if not bucket:
+            del repeat_buckets[number_of_repeats]
+            if not repeat_buckets:
+                del self.buckets[priority]
+                del self.min_repeats[priority]
+            elif self.min_repeats[priority] == number_of_repeats:
+                # Repeats normally go up by one at a time, so there are only a handful of distinct counts
+                self.min_repeats[priority] = min(repeat_buckets.keys())
+
+    def move_song(self, song: SongInfo, priority: int, number_of_repeats: int):
+        self.remove_song(song, song.priority, song.number_of_repeats)
+        self.add_song(song, priority, number_of_repeats)
+        if self.change_listener is not None:
+            self.change_listener(song, priority, number_of_repeats)
+
+    def move_row(self, song: 'SongStore.SongView', priority: int, number_of_repeats: int):
+        self.remove_row(song.row, song.priority, song.number_of_repeats)
+        self.add_row(song.row, priority, number_of_repeats)
+        if self.change_listener is not None:
+            self.change_listener(song, priority, number_of_repeats)
+
+    def get_number_of_songs(self, priority: int) -> int:
+        return self.priority_counts.get(priority, 0)
+
+    def get_max_repeats(self, priority: int) -> typing.Optional[int]:
+        if priority not in self.buckets:
+            return None
+        return max(self.buckets[priority].keys())
+
+    def get_least_repeated_songs(self, priority: int) -> typing.List[SongInfo]:
+        if priority not in self.buckets:
+            return []
+        return list(map(self.get_song, self.buckets[priority][self.min_repeats[priority]]))
+
+    def choose_least_repeated_song(self, priority: int, excluded_songs: typing.Optional[typing.Set[int]] = None,
+                                   rng: typing.Optional[random.Random] = None) -> typing.Optional[SongInfo]:
+        # excluded_songs holds id()s of songs that may not be chosen, least repeated songs are still preferred
+        if priority not in self.buckets:
+            return None
+        rng = rng or random
+        repeat_buckets = self.buckets[priority]
+        if not excluded_songs:
+            return self.get_song(rng.choice(repeat_buckets[self.min_repeats[priority]]))
+
+        for number_of_repeats in sorted(repeat_buckets.keys()):
+            bucket = repeat_buckets[number_of_repeats]
+            # Playlists are small compared to buckets, so a few rejected draws are cheaper than filtering
+            for _ in range(8):
+                song = self.get_song(rng.choice(bucket))
+                if id(song) not in excluded_songs:
+                    return song
+            available_songs_to_choose = [song for song in map(self.get_song, bucket) if id(song) not in excluded_songs]
+            if available_songs_to_choose:
+                return rng.choice(available_songs_to_choose)
+        return None
+
+    def detach(self):
+        for repeat_buckets in self.buckets.values():
+            for bucket in repeat_buckets.values():
+                for song in bucket:
+                    if type(song) is not int and song._picker_index is self:
+                        song._picker_index = None
+        if self.store is not None and self.store.picker_index is self:
+            self.store.picker_index = None
+        self.row_slots = array('q')
+        self.buckets = {}
+        self.min_repeats = {}
+        self.priority_counts = {}
 
 
 class MusicLibrary:
     def __init__(self):
         self.categories: typing.Dict[str, typing.List[SongInfo]] = {}
         self.weights: typing.List[int] = [0 for i in range(num_priorities)]
+        self.picker_index: typing.Optional[PickerIndex] = None
+        self.priority_statistics: typing.Optional['PriorityStatistics'] = None
+        self.search_index: typing.Optional['SongSearch.SongSearchIndex'] = None
+        self.scan_snapshot: typing.Optional['ScanSnapshot'] = None
+        # Changes the last save of the library, so a journal written against an older save is never replayed
+        self.journal_id: typing.Optional[str] = None
+        self.journal: typing.Optional['LibraryJournal.LibraryJournal'] = None
+        self.songs_version: int = 0  # bumped by mark_songs_replaced
+
+
+def get_library_signature(library: MusicLibrary) -> typing.Tuple:
+    # Cheap check for songs having been added to or removed from the category lists. Songs replaced in place
+    # don't change it unless mark_songs_replaced is called.
+    return library.songs_version, tuple((category, id(songs), len(songs))
+                                        for category, songs in library.categories.items())
+
+
+def get_picker_index(library: MusicLibrary) -> PickerIndex:
+    if library.picker_index is None or library.picker_index.stale or \
+            library.picker_index.signature != get_library_signature(library):
+        detach_picker_index(library)
+        library.picker_index = PickerIndex(library)
+        if library.journal is not None:
+            library.picker_index.change_listener = library.journal.record_song_change
+    return library.picker_index
+
+
+def detach_picker_index(library: MusicLibrary):
+    # Changes to the songs aren't seen by anything until the index is built again, not even the journal
+    if library.picker_index is not None:
+        library.picker_index.detach()
+        library.picker_index = None
+
+
+def invalidate_picker_index(library: MusicLibrary):
+    detach_picker_index(library)
+    if library.journal is not None:
+        # Song changes reach the journal through the index, so a library with a journal always has one
+        get_picker_index(library)
+
+
+def mark_songs_replaced(library: MusicLibrary):
+    # Call after replacing songs of a category list in place, e.g. songs[i] = song, which the signature can't see
+    library.songs_version += 1
+    invalidate_picker_index(library)
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+# Shared between a long running operation and whoever started it, possibly on another thread
+class Progress:
+    def __init__(self):
+        self.done: int = 0
+        self.total: int = 0
+        self.cancelled: bool = False
+        self.lock = threading.Lock()
+
+    def advance(self, count: int = 1):
+        with self.lock:
+            self.done += count
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise OperationCancelled()
+
+
+# Directory and file stats from the scan that produced a library, used to skip unchanged directories on update
+# and to notice files rewritten in place or moved
+class ScanSnapshot:
+    def __init__(self):
+        self.library_path: str = ''
+        self.scan_time_ns: int = 0
+        self.recursive: bool = False
+        self.library_mtime: typing.Optional[int] = None  # of the music directory itself, None if unknown
+        self.directories: typing.Dict[str, int] = {}  # directory path -> directory mtime
+        self.files: typing.Dict[str, typing.Tuple[int, int]] = {}  # file path -> (size, mtime)
+        self.has_tags: bool = False  # song names and durations were read from the files' tags
+        # Not saved, only describe the scan itself
+        self.scan_seconds: float = 0.0
+        self.directories_listed: int = 0
+        self.tags_read: int = 0  # files whose tags were read, rather than taken over from the previous scan
+        self.tag_seconds: float = 0.0
+
+
+class CategoryScan:
+    def __init__(self):
+        self.songs: typing.List[SongInfo] = []
+        self.directories: typing.Dict[str, int] = {}
+        self.files: typing.Dict[str, typing.Tuple[int, int]] = {}
+        self.directories_listed: int = 0
+        self.reused: bool = False  # copied from the previous scan instead of listed
+        self.changed_songs: typing.List[SongInfo] = []  # reused songs whose files were rewritten in place
+
+
+# Filesystems with coarse timestamps can change a directory twice within the same mtime,
+# so directories modified this close to the previous scan are always rescanned
+SNAPSHOT_MTIME_GRACE_NS = 2 * 10**9
 
 
-def create_library(path: str) -> MusicLibrary:
-    # library = {
-    #     'categories': {},
-    #     'weights': [0 for i in range(num_priorities)]
-    # }
+def create_song_info(directory: str, music_file_name: str) -> SongInfo:
+    # Names are "artist - song.mp3", files without a dash are taken to be just the song name
+    split_name: typing.List[str] = music_file_name.split('-')
+    song_info = SongInfo()
+    if len(split_name) > 1:
+        song_info.artist_name = split_name[0].strip()
+        song_info.song_name = split_name[1].split('.')[0].strip()
+    else:
+        song_info.song_name = os.path.splitext(music_file_name)[0].strip()
+    song_info.file_path = os.path.join(directory, music_file_name)
+    return song_info
+
+
+def scan_category(path: str, category: str, directory_mtime: int, recursive: bool) -> CategoryScan:
+    category_scan = CategoryScan()
+    category_scan.directories[category] = directory_mtime
+    directories_to_scan: typing.List[str] = [category]
+    # Symlinked directories are followed, but each directory is listed once, so a link back up the tree
+    # (e.g. rock/loop -> rock) doesn't send the scan round in circles
+    visited_directories: typing.Set[typing.Tuple[int, int]] = set()
+    if recursive:
+        stat = os.stat(os.path.join(path, category))
+        visited_directories.add((stat.st_dev, stat.st_ino))
+    while directories_to_scan:
+        directory = directories_to_scan.pop(0)
+        nested_directories: typing.List[str] = []
+        with os.scandir(os.path.join(path, directory)) as entries:
+            for entry in entries:
+                if recursive and entry.is_dir():
+                    stat = os.stat(entry.path)  # DirEntry.stat has no inode on Windows
+                    if (stat.st_dev, stat.st_ino) in visited_directories:
+                        continue
+                    visited_directories.add((stat.st_dev, stat.st_ino))
+                    nested_directory = os.path.join(directory, entry.name)
+                    category_scan.directories[nested_directory] = stat.st_mtime_ns
+                    nested_directories.append(nested_directory)
+                elif os.path.splitext(entry.name)[1] == '.mp3' and entry.is_file():
+                    song_info = create_song_info(directory, entry.name)
+                    stat = entry.stat()
+                    category_scan.files[song_info.file_path] = (stat.st_size, stat.st_mtime_ns)
+                    category_scan.songs.append(song_info)
+        category_scan.directories_listed += 1
+        directories_to_scan[0:0] = nested_directories
+    return category_scan
+
+
+def reuse_category(path: str, category: str, directory_mtime: int, old_library: MusicLibrary,
+                   old_snapshot: ScanSnapshot, old_directories: typing.List[str]) -> typing.Optional[CategoryScan]:
+    # Returns None if files may have been added, removed or renamed since old_snapshot was taken, which changes
+    # the mtime of their directory. Files rewritten in place, e.g. retagged, only change their own stats, so every
+    # file is stat'ed too: that is still no listing and no new songs, but the snapshot stays accurate and the
+    # songs of those files are in changed_songs.
+    if category not in old_library.categories:
+        return None
+    category_scan = CategoryScan()
+    category_scan.reused = True
+    for directory in old_directories:
+        if directory == category:
+            mtime = directory_mtime
+        else:
+            try:
+                mtime = os.stat(os.path.join(path, directory)).st_mtime_ns
+            except OSError:
+                return None
+        if old_snapshot.directories[directory] != mtime or mtime >= old_snapshot.scan_time_ns - SNAPSHOT_MTIME_GRACE_NS:
+            return None
+        category_scan.directories[directory] = mtime
+
+    for old_song in old_library.categories[category]:
+        try:
+            stat = os.stat(os.path.join(path, old_song.file_path))
+        except OSError:
+            return None  # removed while scanning
+        song_info = SongInfo()
+        song_info.artist_name = old_song.artist_name
+        song_info.song_name = old_song.song_name
+        song_info.file_path = old_song.file_path
+        song_info.duration = old_song.duration
+        category_scan.songs.append(song_info)
+        file_stat = (stat.st_size, stat.st_mtime_ns)
+        category_scan.files[old_song.file_path] = file_stat
+        if old_snapshot.files.get(old_song.file_path) != file_stat or \
+                stat.st_mtime_ns >= old_snapshot.scan_time_ns - SNAPSHOT_MTIME_GRACE_NS:
+            category_scan.changed_songs.append(song_info)
+    return category_scan
+
+
+def scan_library(path: str, old_library: typing.Optional[MusicLibrary] = None, max_workers: int = 1,
+                 recursive: bool = False, progress: typing.Optional[Progress] = None,
+                 read_tags: bool = False) -> MusicLibrary:
+    # Categories whose directories are unchanged since old_library was scanned are copied instead of listed again,
+    # only their files are stat'ed.
+    # With max_workers > 1 categories are scanned on a thread pool, which helps on high latency network shares.
+    # With read_tags song names and durations come from the files' tags, see read_song_tags.
+    start_time = time.perf_counter()
     library = MusicLibrary()
+    snapshot = ScanSnapshot()
+    snapshot.library_path = os.path.abspath(path)
+    snapshot.scan_time_ns = time.time_ns()
+    snapshot.recursive = recursive
+    snapshot.has_tags = read_tags
+
+    old_snapshot: typing.Optional[ScanSnapshot] = old_library.scan_snapshot if old_library else None
+    if old_snapshot and (old_snapshot.library_path != snapshot.library_path or old_snapshot.recursive != recursive
+                         or old_snapshot.has_tags != read_tags):
+        old_snapshot = None
 
-    music_subdirectories: typing.List[str] = [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))]
-    for subdirectory in music_subdirectories:
-        music_file_names: typing.List[str] = [file_path for file_path in os.listdir(os.path.join(path, subdirectory))
-                            if os.path.isfile(os.path.join(path, subdirectory, file_path))
-                            and os.path.splitext(file_path)[1] == '.mp3']
-
-        library.categories[subdirectory] = []
-        for music_file_name in music_file_names:
-            music_file_path: str = os.path.join(subdirectory, music_file_name)
-            split_name: typing.List[str] = music_file_name.split('-')
-            artist_name: str = split_name[0].strip()
-            song_name: str = split_name[1].split('.')[0].strip()
-            # song_dict = {
-            #     'artist_name': artist_name,
-            #     'song_name': song_name,
-            #     'file_path': music_file_path,
-            #     'priority': 0,
-            #     'number_of_repeats': 0
-            # }
-            song_info = SongInfo()
-            song_info.artist_name = artist_name
-            song_info.song_name = song_name
-            song_info.file_path = music_file_path
-            library.categories[subdirectory].append(song_info)
+    old_directories: typing.Dict[str, typing.List[str]] = {}
+    if old_snapshot:
+        for directory in old_snapshot.directories.keys():
+            old_directories.setdefault(directory.split(os.sep)[0], []).append(directory)
 
+    # Taken before listing, so a category created while listing shows up as a change afterwards
+    snapshot.library_mtime = os.stat(path).st_mtime_ns
+    with os.scandir(path) as entries:
+        category_entries = [entry for entry in entries if entry.is_dir()]
+    snapshot.directories_listed += 1
+    if progress:
+        progress.total = len(category_entries)
+
+    def scan_or_reuse_category(entry: os.DirEntry) -> CategoryScan:
+        if progress:
+            progress.check_cancelled()
+        directory_mtime: int = entry.stat().st_mtime_ns
+        category_scan = None
+        if entry.name in old_directories:
+            category_scan = reuse_category(path, entry.name, directory_mtime, old_library, old_snapshot,
+                                           old_directories[entry.name])
+        if category_scan is None:
+            category_scan = scan_category(path, entry.name, directory_mtime, recursive)
+        if progress:
+            progress.advance()
+        return category_scan
+
+    if max_workers > 1:
+        import concurrent.futures  # imported here to keep startup of command line tools short
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            category_scans = list(executor.map(scan_or_reuse_category, category_entries))
+    else:
+        category_scans = [scan_or_reuse_category(entry) for entry in category_entries]
+
+    # Merged in directory listing order, so the result doesn't depend on which worker finished first
+    for entry, category_scan in zip(category_entries, category_scans):
+        library.categories[entry.name] = category_scan.songs
+        snapshot.directories.update(category_scan.directories)
+        snapshot.files.update(category_scan.files)
+        snapshot.directories_listed += category_scan.directories_listed
+
+    if read_tags:
+        # Retagging a file doesn't change its directory, so reused categories still have their rewritten files read
+        scanned_songs = [song for category_scan in category_scans
+                         for song in (category_scan.changed_songs if category_scan.reused else category_scan.songs)]
+        read_song_tags(path, scanned_songs, snapshot, old_library if old_snapshot else None, max_workers, progress)
+
+    snapshot.scan_seconds = time.perf_counter() - start_time
+    library.scan_snapshot = snapshot
     return library
 
 
+TAG_CHUNK_SIZE = 256  # files per task of the tag reading process pool
+
+
+def read_song_tags(path: str, songs: typing.List[SongInfo], snapshot: ScanSnapshot,
+                   old_library: typing.Optional[MusicLibrary], max_workers: int, progress: typing.Optional[Progress]):
+    # Tags of files with the same size and mtime as when old_library was scanned are taken over from its songs,
+    # unless the file was modified so close to that scan that a change may not show in its mtime. The others are
+    # read, on a process pool when max_workers > 1 since parsing is cpu bound. Names missing from the tags keep
+    # the values taken from the file name.
+    start_time = time.perf_counter()
+    old_files: typing.Dict[str, typing.Tuple[int, int]] = {}
+    old_songs: typing.Dict[str, SongInfo] = {}
+    unchanged_before_ns = 0
+    if old_library and old_library.scan_snapshot:
+        old_files = old_library.scan_snapshot.files
+        old_songs = {song.file_path: song for song in chain(*old_library.categories.values())}
+        unchanged_before_ns = old_library.scan_snapshot.scan_time_ns - SNAPSHOT_MTIME_GRACE_NS
+
+    songs_to_read: typing.List[SongInfo] = []
+    for song in songs:
+        old_song = old_songs.get(song.file_path)
+        old_file = old_files.get(song.file_path)
+        if old_song is not None and old_file is not None and old_file == snapshot.files.get(song.file_path) \
+                and old_file[1] < unchanged_before_ns:
+            song.artist_name = old_song.artist_name
+            song.song_name = old_song.song_name
+            song.duration = old_song.duration
+        else:
+            songs_to_read.append(song)
+
+    chunks = [songs_to_read[i:i + TAG_CHUNK_SIZE] for i in range(0, len(songs_to_read), TAG_CHUNK_SIZE)]
+    chunk_paths = [[os.path.join(path, song.file_path) for song in chunk] for chunk in chunks]
+    if progress:
+        progress.total += len(songs_to_read)
+
+    def apply_tags(chunk: typing.List[SongInfo], chunk_tags: typing.List[SongTags.SongTags]):
+        for song, song_tags in zip(chunk, chunk_tags):
+            song.artist_name = song_tags.artist_name or song.artist_name
+            song.song_name = song_tags.song_name or song.song_name
+            song.duration = song_tags.duration
+        if progress:
+            progress.advance(len(chunk))
+            progress.check_cancelled()
+
+    if max_workers > 1 and len(chunks) > 1:
+        import concurrent.futures
+        import multiprocessing
+        # Spawned rather than forked, forking a process with other threads running (a gui, a scan thread pool)
+        # can leave the children with locks that are never released
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                          mp_context=multiprocessing.get_context('spawn'))
+        try:
+            for chunk, chunk_tags in zip(chunks, executor.map(SongTags.read_tags_of_files, chunk_paths)):
+                apply_tags(chunk, chunk_tags)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        for chunk, paths in zip(chunks, chunk_paths):
+            apply_tags(chunk, SongTags.read_tags_of_files(paths))
+
+    snapshot.tags_read = len(songs_to_read)
+    snapshot.tag_seconds = time.perf_counter() - start_time
+
+
+def get_tag_throughput(library: MusicLibrary) -> float:
+    # Files per second whose tags were read by the scan that produced the library
+    if not library.scan_snapshot or library.scan_snapshot.tag_seconds <= 0:
+        return 0.0
+    return library.scan_snapshot.tags_read / library.scan_snapshot.tag_seconds
+
+
+def get_scan_throughput(library: MusicLibrary) -> float:
+    # Songs per second of the scan that produced the library
+    if not library.scan_snapshot or library.scan_snapshot.scan_seconds <= 0:
+        return 0.0
+    return sum(len(songs) for songs in library.categories.values()) / library.scan_snapshot.scan_seconds
+
+
+def create_library(path: str, max_workers: int = 1, recursive: bool = False,
+                   progress: typing.Optional[Progress] = None, read_tags: bool = False) -> MusicLibrary:
+    return scan_library(path, max_workers=max_workers, recursive=recursive, progress=progress, read_tags=read_tags)
+
+
+LIBRARY_LOCK_EXTENSION = '.lock'
+LIBRARY_LOCK_TIMEOUT = 30.0  # seconds to wait for another process to be done with a library
+LIBRARY_LOCK_POLL_INTERVAL = 0.05
+
+
+class LibraryInUse(Exception):
+    pass
+
+
+def lock_file(file: typing.IO) -> bool:
+    # Without waiting, False if another open file holds the lock
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock_file(file: typing.IO):
+    if os.name == 'nt':
+        import msvcrt
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+# Advisory lock of a library file for processes that load it, change it and write it back, by saving or through
+# its journal, so one doesn't save over or append to a journal the other just replaced. Taken on a file next to
+# the library, which itself is replaced by every save, and left in place once released. Only processes that take
+# the lock are kept out, the editor doesn't.
+class LibraryLock:
+    def __init__(self, library_file_name: str, timeout: typing.Optional[float] = None):
+        self.library_file_name: str = library_file_name
+        self.file_name: str = os.path.abspath(library_file_name) + LIBRARY_LOCK_EXTENSION
+        self.timeout: float = LIBRARY_LOCK_TIMEOUT if timeout is None else timeout
+        self.file: typing.Optional[typing.IO] = None
+
+    def acquire(self):
+        file = open(self.file_name, 'a+b')
+        deadline = time.monotonic() + self.timeout
+        while not lock_file(file):
+            if time.monotonic() >= deadline:
+                file.close()
+                raise LibraryInUse(f'{self.library_file_name} is in use by another process')
+            time.sleep(LIBRARY_LOCK_POLL_INTERVAL)
+        self.file = file
+
+    def release(self):
+        if self.file:
+            unlock_file(self.file)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> 'LibraryLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def replace_file_atomically(file_name: str, mode: str, write: typing.Callable[[typing.IO], None]):
+    # A crash while writing leaves the previous file in place instead of a partially written one. The temporary
+    # file has a name of its own, so saves from several processes (editor, command line, server) don't write
+    # into each other's, the last rename wins. Created like the file itself rather than with tempfile.mkstemp,
+    # which would leave the library readable only by its owner.
+    directory = os.path.dirname(os.path.abspath(file_name))
+    temporary_file_name = f'{file_name}.{uuid.uuid4().hex[:12]}.tmp'
+    try:
+        with open(temporary_file_name, mode.replace('w', 'x')) as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_file_name, file_name)
+    except BaseException:
+        try:
+            os.remove(temporary_file_name)
+        except OSError:
+            pass
+        raise
+    if os.name == 'posix':
+        # The rename itself is only durable once the directory is synced
+        directory_descriptor = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
+
+
 def save_library(library: MusicLibrary, file_name: str):
-    with open(file_name, 'w') as file:
-        json.dump(to_dict(library), file, indent=4)
+    # The new journal id is only kept once the file is written, a failed save leaves the library matching the
+    # file and journal that are still on disk
+    previous_journal_id = library.journal_id
+    library.journal_id = uuid.uuid4().hex
+    try:
+        # Libraries saved with the compact extension use the binary format from CompactLibrary
+        if os.path.splitext(file_name)[1] == COMPACT_LIBRARY_EXTENSION:
+            import CompactLibrary
+            CompactLibrary.save_compact_library(library, file_name)
+        else:
+            replace_file_atomically(file_name, 'w', lambda file: json.dump(to_dict(library), file, indent=4))
+    except BaseException:
+        library.journal_id = previous_journal_id
+        raise
+
+    # A journal left next to the file belongs to the save just replaced and would never be replayed again
+    import LibraryJournal
+    if library.journal is not None and library.journal.library_file_name == os.path.abspath(file_name):
+        library.journal.reset()
+    else:
+        LibraryJournal.remove_journal(file_name)
 
 
 def load_library(file_name) -> MusicLibrary:
-    with open(file_name, 'r') as file:
-        library = from_dict(json.load(file))
+    with open(file_name, 'rb') as file:
+        is_compact = file.read(len(COMPACT_LIBRARY_MAGIC)) == COMPACT_LIBRARY_MAGIC
+    if is_compact:
+        import CompactLibrary
+        library = CompactLibrary.load_compact_library(file_name)
+    else:
+        with open(file_name, 'r') as file:
+            library = from_dict(json.load(file))
+
+    # Changes made since the library was last saved
+    import LibraryJournal
+    LibraryJournal.replay_journal(library, file_name)
     return library
 
 
-def get_updated_library(old_library: MusicLibrary, library_path: str) -> MusicLibrary:
-    library: MusicLibrary = create_library(library_path)
+def convert_library_file(source_file_name: str, destination_file_name: str):
+    # Format of each file is given by its contents or extension, so this converts between json and compact
+    save_library(load_library(source_file_name), destination_file_name)
 
-    # go through old library and copy priorities over
-    for category in old_library.categories.keys():
-        if category in library.categories.keys():
-            for song in old_library.categories[category]:
-                copy_over_priority(song, library.categories[category])
+
+class LibraryDiff:
+    def __init__(self):
+        self.added: typing.List[SongInfo] = []  # songs of the new library with no match in the old one
+        self.removed: typing.List[SongInfo] = []  # songs of the old library with no match in the new one
+        self.carried_over: typing.List[SongInfo] = []  # songs of the new library that took over old priorities
+        self.moved: typing.List[SongInfo] = []  # carried over songs matched by their file, see match_moved_songs
+
+
+SongKey = typing.Tuple[str, str, str]
+
+
+def get_song_key(category: str, song: SongInfo) -> SongKey:
+    return category, song.artist_name, song.song_name
+
+
+def merge_library(old_library: MusicLibrary, library: MusicLibrary, keep_repeats: bool = False) -> LibraryDiff:
+    # Later duplicates win, same as copying over song by song. Songs whose names changed, e.g. because they are
+    # now read from tags instead of the file name, are matched by their file path instead.
+    old_songs: typing.Dict[SongKey, SongInfo] = {get_song_key(category, song): song
+                                                 for category, songs in old_library.categories.items()
+                                                 for song in songs}
+    old_songs_by_path: typing.Dict[typing.Tuple[str, str], SongInfo] = {
+        (category, song.file_path): song for category, songs in old_library.categories.items() for song in songs}
+    diff = LibraryDiff()
+    new_song_keys: typing.Set[SongKey] = set()
+    matched_by_path: typing.Set[int] = set()  # id()s of old songs
+    for category, songs in library.categories.items():
+        for song in songs:
+            song_key = get_song_key(category, song)
+            new_song_keys.add(song_key)
+            old_song = old_songs.get(song_key)
+            if old_song is None:
+                old_song = old_songs_by_path.get((category, song.file_path))
+                if old_song is None:
+                    diff.added.append(song)
+                    continue
+                matched_by_path.add(id(old_song))
+            song.priority = old_song.priority
+            if keep_repeats:
+                song.number_of_repeats = old_song.number_of_repeats
+            diff.carried_over.append(song)
+
+    diff.removed = [song for category, songs in old_library.categories.items() for song in songs
+                    if get_song_key(category, song) not in new_song_keys and id(song) not in matched_by_path]
+    if diff.added and diff.removed:
+        match_moved_songs(old_library, library, diff, keep_repeats)
 
     library.weights = old_library.weights
+    return diff
+
+
+def match_moved_songs(old_library: MusicLibrary, library: MusicLibrary, diff: LibraryDiff, keep_repeats: bool):
+    # A renamed or moved file keeps its size and mtime, so an added song whose file has the same stats as the
+    # file of exactly one removed song, and no other added song, is taken to be that song under a new name
+    if not old_library.scan_snapshot or not library.scan_snapshot:
+        return
+    old_files, files = old_library.scan_snapshot.files, library.scan_snapshot.files
+    removed_by_stat: typing.Dict[typing.Tuple[int, int], typing.List[SongInfo]] = {}
+    for song in diff.removed:
+        if song.file_path in old_files:
+            removed_by_stat.setdefault(old_files[song.file_path], []).append(song)
+    added_stat_counts: typing.Dict[typing.Tuple[int, int], int] = {}
+    for song in diff.added:
+        if song.file_path in files:
+            added_stat_counts[files[song.file_path]] = added_stat_counts.get(files[song.file_path], 0) + 1
 
+    moved_old_songs: typing.Set[int] = set()  # id()s
+    still_added: typing.List[SongInfo] = []
+    for song in diff.added:
+        stat = files.get(song.file_path)
+        old_songs = removed_by_stat.get(stat)
+        if not old_songs or len(old_songs) > 1 or added_stat_counts[stat] > 1:
+            still_added.append(song)
+            continue
+        song.priority = old_songs[0].priority
+        if keep_repeats:
+            song.number_of_repeats = old_songs[0].number_of_repeats
+        moved_old_songs.add(id(old_songs[0]))
+        diff.carried_over.append(song)
+        diff.moved.append(song)
+    diff.added = still_added
+    diff.removed = [song for song in diff.removed if id(song) not in moved_old_songs]
+
+
+def replace_library_songs(library: MusicLibrary, updated_library: MusicLibrary,
+                          diff: typing.Optional[LibraryDiff] = None):
+    # Takes over the songs and scan of a library returned by get_updated_library_incremental, for when others
+    # hold on to the library object. Priorities and repeats are whatever the merge gave the updated songs.
+    # With the diff of that merge a current search index is patched rather than dropped.
+    search_index = library.search_index
+    if diff is None or search_index is None or search_index.signature != get_library_signature(library):
+        search_index = None
+    library.categories = updated_library.categories
+    mark_songs_replaced(library)
+    library.scan_snapshot = updated_library.scan_snapshot
+    library.priority_statistics = None
+    library.search_index = None
+    if search_index is not None and search_index.update(library, diff):
+        library.search_index = search_index
+    if library.journal is not None:
+        # Journal entries refer to songs by position in their category, which the update may have changed
+        import LibraryJournal
+        LibraryJournal.compact_journal(library)
+
+
+def get_updated_library_with_diff(old_library: MusicLibrary, library_path: str,
+                                  keep_repeats: bool = False) -> typing.Tuple[MusicLibrary, LibraryDiff]:
+    library: MusicLibrary = create_library(library_path)
+    diff = merge_library(old_library, library, keep_repeats)
+    return library, diff
+
+
+def get_updated_library_incremental(old_library: MusicLibrary, library_path: str, keep_repeats: bool = False,
+                                    max_workers: int = 1, recursive: bool = False,
+                                    progress: typing.Optional[Progress] = None,
+                                    read_tags: bool = False) -> typing.Tuple[MusicLibrary, LibraryDiff]:
+    library: MusicLibrary = scan_library(library_path, old_library, max_workers, recursive, progress, read_tags)
+    diff = merge_library(old_library, library, keep_repeats)
+    return library, diff
+
+
+def get_updated_library(old_library: MusicLibrary, library_path: str) -> MusicLibrary:
+    library, _ = get_updated_library_with_diff(old_library, library_path)
     return library
 
 
 def get_updated_library_keep_repeats(old_library: MusicLibrary, library_path: str) -> MusicLibrary:
-    library = create_library(library_path)
+    library, _ = get_updated_library_with_diff(old_library, library_path, keep_repeats=True)
+    return library
 
-    # go through old library and copy priorities over
-    for category in old_library.categories.keys():
-        if category in library.categories.keys():
-            for song in old_library.categories[category]:
-                copy_over_priority_and_repeats(song, library.categories[category])
 
-    library.weights = old_library.weights
+def update_repeats(library: MusicLibrary, get_new_repeats: typing.Callable[[int, int, int], int],
+                   categories: typing.Optional[typing.Iterable[str]] = None) -> int:
+    # Bulk change of repeats, get_new_repeats(number_of_repeats, min_repeats, max_repeats) is called once per
+    # distinct number of repeats in each priority, with the min and max of that priority. Songs are grouped by
+    # the picker index, or in one pass over the given categories, whose min and max then only cover those songs.
+    # Returns the number of songs changed. Songs of a SongStore are grouped and changed by row, see PickerIndex.
+    import SongStore
+    groups: typing.Dict[int, typing.Dict[int, typing.List[typing.Union[SongInfo, int]]]] = {}
+    store: typing.Optional[SongStore.SongStore] = None
+    if categories is None:
+        index = get_picker_index(library)
+        store = index.store
+        for priority, repeat_buckets in index.buckets.items():
+            groups[priority] = dict(repeat_buckets)
+    else:
+        for category in categories:
+            songs = library.categories[category]
+            if isinstance(songs, SongStore.SongViewList) and (store is None or songs.store is store):
+                store = songs.store
+                rows = songs.rows
+                for row, priority, number_of_repeats in zip(rows, store.priorities[rows.start:rows.stop],
+                                                            store.repeats[rows.start:rows.stop]):
+                    groups.setdefault(priority, {}).setdefault(number_of_repeats, []).append(row)
+            else:
+                for song in songs:
+                    groups.setdefault(song.priority, {}).setdefault(song.number_of_repeats, []).append(song)
 
-    return library
+    changes: typing.List[typing.Tuple[typing.List[typing.Union[SongInfo, int]], int]] = []
+    for repeat_buckets in groups.values():
+        min_repeats, max_repeats = min(repeat_buckets.keys()), max(repeat_buckets.keys())
+        for number_of_repeats, songs in repeat_buckets.items():
+            new_repeats = get_new_repeats(number_of_repeats, min_repeats, max_repeats)
+            if new_repeats != number_of_repeats:
+                changes.append((songs, new_repeats))
+    if not changes:
+        return 0
+
+    # Moving songs through the picker index one by one would cost more than rebuilding it, and would journal
+    # every song. The index is rebuilt afterwards and the journal is written into the library file instead.
+    detach_picker_index(library)
+    songs_changed = 0
+    for songs, new_repeats in changes:
+        for song in songs:
+            if type(song) is int:
+                store.repeats[song] = new_repeats
+            else:
+                song.number_of_repeats = new_repeats
+        songs_changed += len(songs)
+    if store is not None:
+        store.version += 1
+    if library.journal is not None:
+        import LibraryJournal
+        LibraryJournal.compact_journal(library)
+    invalidate_picker_index(library)
+    return songs_changed
+
+
+def reset_repeats(library: MusicLibrary, categories: typing.Optional[typing.Iterable[str]] = None) -> int:
+    return update_repeats(library, lambda number_of_repeats, min_repeats, max_repeats: 0, categories)
 
 
-def reset_repeats(library: MusicLibrary):
-    for category in library.categories.keys():
-        for song in library.categories[category]:
-            song.number_of_repeats = 0
+def reset_repeats_special(library: MusicLibrary, categories: typing.Optional[typing.Iterable[str]] = None) -> int:
+    # The most repeated songs of each priority keep one repeat, so they come after the others
+    return update_repeats(library, lambda number_of_repeats, min_repeats, max_repeats:
+                          1 if number_of_repeats == max_repeats else 0, categories)
 
-def reset_repeats_special(library: MusicLibrary):
-    songs = [song for song in chain(*library.categories.values())]
-    for priority in range(0, num_priorities):
-        songs_with_priority = [song for song in songs if song.priority == priority]
-        max_repeats = max(song.number_of_repeats for song in songs_with_priority)
-        for song in songs_with_priority:
-            song.number_of_repeats = 1 if song.number_of_repeats == max_repeats else 0
 
-def reset_repeat_data(library: MusicLibrary):
-    for song in chain(*library.categories.values()):
-        song.number_of_repeats = 0
+def decay_repeats(library: MusicLibrary, factor: float,
+                  categories: typing.Optional[typing.Iterable[str]] = None) -> int:
+    # Scales repeats down, rounding down, which keeps the order songs come up in while shrinking the gaps
+    return update_repeats(library, lambda number_of_repeats, min_repeats, max_repeats:
+                          int(number_of_repeats * factor), categories)
 
-def copy_over_priority(song_to_copy_priority: SongInfo, category_songs: typing.List[SongInfo]):
-    songs_to_modify_priority = [song for song in category_songs
-                                if song.artist_name == song_to_copy_priority.artist_name
-                                and song.song_name == song_to_copy_priority.song_name]
 
-    for song in songs_to_modify_priority:
-        song.priority = song_to_copy_priority.priority
+def normalize_repeats(library: MusicLibrary, categories: typing.Optional[typing.Iterable[str]] = None) -> int:
+    # Lowers the repeats of each priority so its least repeated songs are at 0
+    return update_repeats(library, lambda number_of_repeats, min_repeats, max_repeats:
+                          number_of_repeats - min_repeats, categories)
 
 
-def copy_over_priority_and_repeats(song_to_copy_priority: SongInfo, category_songs: typing.List[SongInfo]):
-    songs_to_modify_priority = [song for song in category_songs
-                                if song.artist_name == song_to_copy_priority.artist_name
-                                and song.song_name == song_to_copy_priority.song_name]
+def reset_repeat_data(library: MusicLibrary, categories: typing.Optional[typing.Iterable[str]] = None) -> int:
+    return reset_repeats(library, categories)
 
-    for song in songs_to_modify_priority:
-        song.priority = song_to_copy_priority.priority
-        song.number_of_repeats = song_to_copy_priority.number_of_repeats
 
+def get_valid_priorities(library: MusicLibrary, index: typing.Optional[PickerIndex] = None) -> typing.List[int]:
+    # index is the library's current picker index, if the caller already has it
+    priority_counts = (index or get_picker_index(library)).priority_counts
+    return [priority for priority in range(num_priorities)
+            if library.weights[priority] > 0 and priority_counts.get(priority, 0) > 0]
 
-def pick_random_song_from_library(library: MusicLibrary) -> typing.Optional[SongInfo]:
-    valid_priorities: typing.List[int] = [priority for priority in range(num_priorities)
-                        if library.weights[priority] > 0 and get_number_of_songs_for_priority(library, priority) > 0]
+
+def create_rng(seed: typing.Union[int, str], *stream: typing.Union[int, str]) -> random.Random:
+    # Generator for one stream of picks, e.g. create_rng(seed, 'station', 3) or create_rng(seed, date). Each stream
+    # is seeded from a hash of the seed and the stream's names, so streams don't overlap the way seed, seed + 1
+    # could, and a stream draws the same numbers in any process and whatever else is drawn meanwhile. That makes
+    # picks reproducible from the seed alone, also when the streams are spread over worker processes.
+    seed_text = json.dumps([seed, *stream])
+    return random.Random(int.from_bytes(hashlib.sha256(seed_text.encode('utf-8')).digest(), 'big'))
+
+
+def pick_random_song_from_library(library: MusicLibrary,
+                                  rng: typing.Optional[random.Random] = None) -> typing.Optional[SongInfo]:
+    # rng defaults to the random module, pass one from create_rng for picks that can be reproduced
+    index = get_picker_index(library)
+    valid_priorities: typing.List[int] = get_valid_priorities(library, index)
     if not valid_priorities:
         return None
 
+    rng = rng or random
     weights = [library.weights[priority] for priority in valid_priorities]
-    priority = random.choices(valid_priorities, weights)[0]
+    priority = rng.choices(valid_priorities, weights)[0]
 
-    songs_with_priority = [song for song in chain(*library.categories.values()) if song.priority == priority]
-    lowest_repeats_in_priority = min([song.number_of_repeats for song in songs_with_priority])
-    available_songs_to_choose = [song for song in songs_with_priority if song.number_of_repeats == lowest_repeats_in_priority]
-
-    song_info = random.choice(available_songs_to_choose)
+    song_info = index.choose_least_repeated_song(priority, rng=rng)
     song_info.number_of_repeats += 1
     return song_info
 
 
-def get_random_song_path_from_library(library: MusicLibrary) -> str:
-    song = pick_random_song_from_library(library)
+def generate_playlist(library: MusicLibrary, number_of_songs: int, allow_duplicates: bool = True,
+                      rng: typing.Optional[random.Random] = None) -> typing.List[SongInfo]:
+    # Same as calling pick_random_song_from_library number_of_songs times: repeats only change which songs
+    # are least repeated, never which priorities are valid, so all priorities can be drawn up front.
+    index = get_picker_index(library)
+    valid_priorities: typing.List[int] = get_valid_priorities(library, index)
+    if not valid_priorities or number_of_songs <= 0:
+        return []
+
+    rng = rng or random
+    weights = [library.weights[priority] for priority in valid_priorities]
+    priorities = rng.choices(valid_priorities, weights, k=number_of_songs)
+
+    playlist: typing.List[SongInfo] = []
+    playlist_song_ids: typing.Set[int] = set()
+    songs_picked_for_priority: typing.Dict[int, int] = {}
+    for priority in priorities:
+        if not allow_duplicates and songs_picked_for_priority.get(priority, 0) >= index.get_number_of_songs(priority):
+            # Every song of this priority is already in the playlist, redraw among the priorities that have songs left
+            remaining_priorities = [remaining_priority for remaining_priority in valid_priorities
+                                    if songs_picked_for_priority.get(remaining_priority, 0)
+                                    < index.get_number_of_songs(remaining_priority)]
+            if not remaining_priorities:
+                break
+            remaining_weights = [library.weights[remaining_priority] for remaining_priority in remaining_priorities]
+            priority = rng.choices(remaining_priorities, remaining_weights)[0]
+
+        song_info = index.choose_least_repeated_song(priority, None if allow_duplicates else playlist_song_ids, rng)
+        song_info.number_of_repeats += 1
+        playlist.append(song_info)
+        playlist_song_ids.add(id(song_info))
+        songs_picked_for_priority[priority] = songs_picked_for_priority.get(priority, 0) + 1
+
+    return playlist
+
+
+def get_random_song_path_from_library(library: MusicLibrary, rng: typing.Optional[random.Random] = None) -> str:
+    song = pick_random_song_from_library(library, rng)
     if not song:
         return ''
     return song.file_path
 
 
+def get_random_playlist_paths_from_library(library: MusicLibrary, number_of_songs: int, allow_duplicates: bool = True,
+                                           rng: typing.Optional[random.Random] = None) -> typing.List[str]:
+    return [song.file_path for song in generate_playlist(library, number_of_songs, allow_duplicates, rng)]
+
+
 def get_number_of_songs_for_priority(library: MusicLibrary, priority: int) -> int:
-    return len([song for song in chain(*library.categories.values()) if song.priority == priority])
+    return get_picker_index(library).get_number_of_songs(priority)
 
 
-def calculate_relative_frequency(library: MusicLibrary, number_of_songs_in_playlist: int) -> typing.List[typing.Union[float, str]]:
-    relative_frequencies = []
-    valid_weights = [library.weights[priority] for priority in range(num_priorities)
-                    if library.weights[priority] > 0 and get_number_of_songs_for_priority(library, priority) > 0]
-    weight_sum = sum(valid_weights)
-    for priority in range(num_priorities):
-        weight = library.weights[priority]
-        num_songs = get_number_of_songs_for_priority(library, priority)
-        try:
-            relative_frequency = 1.0 / (weight / weight_sum / num_songs) / number_of_songs_in_playlist
-            relative_frequencies.append(relative_frequency)
-        except ZeroDivisionError:
-            relative_frequencies.append('--')
+class PriorityStatistics:
+    def __init__(self):
+        self.song_counts: typing.List[int] = []
+        self.min_repeats: typing.List[typing.Optional[int]] = []
+        self.max_repeats: typing.List[typing.Optional[int]] = []
+        self.relative_frequencies: typing.List[typing.Union[float, str]] = []  # '--' for priorities that never play
+        self.number_of_songs_in_playlist: int = 0
+        self.cache_key: typing.Tuple = ()
 
-    return relative_frequencies
 
+def is_store_backed(library: MusicLibrary) -> bool:
+    # Whether every category is a range of rows of a SongStore, as in a loaded compact library
+    import SongStore
+    return all(isinstance(songs, SongStore.SongViewList) for songs in library.categories.values())
 
-def write_song_list(library: MusicLibrary, file_path: str):
-    relative_frequencies = ['{:.2f}'.format(relative_frequency) if relative_frequency != '--' else '--'
-                            for relative_frequency
-                            in calculate_relative_frequency(library, 40)]
 
-    with open(file_path, 'w') as file:
-        for category in library.categories.keys():
-            file.write(category + '\n')
-            for song in library.categories[category]:
-                file.write('{:<15}{:<20} {} - {}\n'.format(f"Priority: {song.priority}",
-                                                   f"Frequency: {relative_frequencies[song.priority]}",
-                                                   f"{song.artist_name}",
-                                                   f"{song.song_name}"))
-            file.write('\n')
+def get_priority_statistics(library: MusicLibrary, number_of_songs_in_playlist: int) -> PriorityStatistics:
+    # Derived from the picker index, which already keeps counts and repeats up to date, and cached until
+    # the weights or the index change. A compact library that has no index yet, e.g. one only loaded for its
+    # statistics, is counted from the columns of its store instead of building one.
+    from_columns = library.picker_index is None and is_store_backed(library)
+    if from_columns:
+        cache_key = (get_library_signature(library),
+                     tuple((id(songs.store), songs.store.version) for songs in library.categories.values()),
+                     tuple(library.weights), number_of_songs_in_playlist)
+    else:
+        index = get_picker_index(library)
+        cache_key = (id(index), index.version, tuple(library.weights), number_of_songs_in_playlist)
+    if library.priority_statistics is not None and library.priority_statistics.cache_key == cache_key:
+        return library.priority_statistics
+
+    statistics = PriorityStatistics()
+    statistics.number_of_songs_in_playlist = number_of_songs_in_playlist
+    statistics.cache_key = cache_key
+    if from_columns:
+        statistics.song_counts = [0 for i in range(num_priorities)]
+        statistics.min_repeats = [None for i in range(num_priorities)]
+        statistics.max_repeats = [None for i in range(num_priorities)]
+        for songs in library.categories.values():
+            for (priority, number_of_repeats), count in songs.store.get_repeat_counts(songs.rows).items():
+                if not statistics.song_counts[priority]:
+                    statistics.min_repeats[priority] = statistics.max_repeats[priority] = number_of_repeats
+                else:
+                    statistics.min_repeats[priority] = min(statistics.min_repeats[priority], number_of_repeats)
+                    statistics.max_repeats[priority] = max(statistics.max_repeats[priority], number_of_repeats)
+                statistics.song_counts[priority] += count
+    else:
+        statistics.song_counts = [index.get_number_of_songs(priority) for priority in range(num_priorities)]
+        statistics.min_repeats = [index.min_repeats.get(priority) for priority in range(num_priorities)]
+        statistics.max_repeats = [index.get_max_repeats(priority) for priority in range(num_priorities)]
+
+    weights = library.weights[:num_priorities]
+    weight_sum = sum(weight for weight, num_songs in zip(weights, statistics.song_counts) if weight > 0 and num_songs > 0)
+    if weight_sum > 0 and number_of_songs_in_playlist != 0:
+        statistics.relative_frequencies = [1.0 / (weight / weight_sum / num_songs) / number_of_songs_in_playlist
+                                           if weight != 0 and num_songs != 0 else '--'
+                                           for weight, num_songs in zip(weights, statistics.song_counts)]
+    else:
+        statistics.relative_frequencies = ['--' for i in range(num_priorities)]
+
+    library.priority_statistics = statistics
+    return statistics
+
+
+def calculate_relative_frequency(library: MusicLibrary, number_of_songs_in_playlist: int) -> typing.List[typing.Union[float, str]]:
+    return list(get_priority_statistics(library, number_of_songs_in_playlist).relative_frequencies)
+
+
+def write_song_list(library: MusicLibrary, file_path: str):
+    import LibraryExport
+    LibraryExport.export_library(library, file_path, 'text')
 
 
 def write_song_list_bare(library: MusicLibrary, file_path: str):
-    with open(file_path, 'w') as file:
-        for category in library.categories.keys():
-            file.write('(cat)' + category + '\n')
-            for song in library.categories[category]:
-                file.write(f'{song.artist_name}-"{song.song_name}\n')
-            file.write('\n')
+    import LibraryExport
+    LibraryExport.export_library(library, file_path, 'bare')
 
 
 def write_song_list_json(library: MusicLibrary, file_path: str):
-    with open(file_path, 'w') as file:
-        json.dump(to_dict(library), file)
+    # Streamed, the same document as json.dump(to_dict(library)) without building it first
+    import LibraryExport
+    LibraryExport.export_library(library, file_path, 'json')
+
+
+def song_to_dict(song: SongInfo) -> typing.Any:
+    obj_song_info = {
+        'song_name': song.song_name,
+        'artist_name': song.artist_name,
+        'priority': song.priority,
+        'file_path': song.file_path,
+        'number_of_repeats': song.number_of_repeats,
+    }
+    if song.duration:
+        obj_song_info['duration'] = song.duration  # left out when unknown
+    return obj_song_info
 
 
 def to_dict(ml: MusicLibrary) -> typing.Any:
@@ -214,17 +1116,7 @@ def to_dict(ml: MusicLibrary) -> typing.Any:
 
     obj_categories = {}
     for ml_category, ml_category_songs_infos in ml.categories.items():
-        categories_song_infos = []
-        for ml_song_info in ml_category_songs_infos:
-            obj_song_info = {
-                'song_name': ml_song_info.song_name,
-                'artist_name': ml_song_info.artist_name,
-                'priority': ml_song_info.priority,
-                'file_path': ml_song_info.file_path,
-                'number_of_repeats': ml_song_info.number_of_repeats,
-            }
-            categories_song_infos.append(obj_song_info)
-        obj_categories[ml_category] = categories_song_infos
+        obj_categories[ml_category] = [song_to_dict(ml_song_info) for ml_song_info in ml_category_songs_infos]
 
     obj_weights = ml.weights
 
@@ -233,9 +1125,38 @@ def to_dict(ml: MusicLibrary) -> typing.Any:
         'weights': obj_weights
     }
 
+    if ml.scan_snapshot:
+        obj_ml['scan_snapshot'] = snapshot_to_dict(ml.scan_snapshot)
+    if ml.journal_id:
+        obj_ml['journal_id'] = ml.journal_id
+
     return obj_ml
 
 
+def snapshot_to_dict(snapshot: ScanSnapshot) -> typing.Any:
+    return {
+        'library_path': snapshot.library_path,
+        'scan_time_ns': snapshot.scan_time_ns,
+        'recursive': snapshot.recursive,
+        'library_mtime': snapshot.library_mtime,
+        'directories': snapshot.directories,
+        'files': snapshot.files,
+        'has_tags': snapshot.has_tags,
+    }
+
+
+def snapshot_from_dict(obj_snapshot) -> ScanSnapshot:
+    snapshot = ScanSnapshot()
+    snapshot.library_path = obj_snapshot['library_path']
+    snapshot.scan_time_ns = obj_snapshot['scan_time_ns']
+    snapshot.recursive = obj_snapshot.get('recursive', False)
+    snapshot.library_mtime = obj_snapshot.get('library_mtime')
+    snapshot.has_tags = obj_snapshot.get('has_tags', False)
+    snapshot.directories = obj_snapshot['directories']
+    snapshot.files = {file_path: tuple(file_stat) for file_path, file_stat in obj_snapshot['files'].items()}
+    return snapshot
+
+
 def from_dict(obj) -> MusicLibrary:
     ml_object = MusicLibrary()
 
@@ -248,9 +1169,14 @@ def from_dict(obj) -> MusicLibrary:
             ml_song_info.priority = obj_song_info['priority']
             ml_song_info.file_path = obj_song_info['file_path']
             ml_song_info.number_of_repeats = obj_song_info['number_of_repeats']
+            ml_song_info.duration = obj_song_info.get('duration', 0.0)
             ml_category_song_infos.append(ml_song_info)
         ml_object.categories[obj_category] = ml_category_song_infos
 
     ml_object.weights = obj['weights']
 
+    if 'scan_snapshot' in obj:
+        ml_object.scan_snapshot = snapshot_from_dict(obj['scan_snapshot'])
+    ml_object.journal_id = obj.get('journal_id')
+
     return ml_object
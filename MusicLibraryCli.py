@@ -0,0 +1,364 @@
+import time
+
+start_time = time.perf_counter()
+
+import argparse
+import contextlib
+import random
+import sys
+import typing
+
+import Instrumentation
+import LibraryExport
+import LibraryJournal
+import LibraryWatcher
+import MusicLibrary as ml
+import PlaylistBatch
+import RotationSimulator
+import SongSearch
+import TimedPlaylist
+
+# Command line access to music libraries for scripts and cron jobs. Only depends on MusicLibrary, never on tkinter.
+# --timing prints how long startup and the command took to stderr.
+
+SONGS_IN_PLAYLIST = 40
+WATCH_APPLY_INTERVAL = 1.0  # seconds between checks for a finished update in watch
+
+
+def scan(args) -> int:
+    library = ml.create_library(args.music_directory, max_workers=args.workers, recursive=args.recursive,
+                                read_tags=args.read_tags)
+    with ml.LibraryLock(args.library):
+        ml.save_library(library, args.library)
+    print(f'{sum(len(songs) for songs in library.categories.values())} songs in {len(library.categories)} categories, '
+          f'{ml.get_scan_throughput(library):.0f} songs/sec')
+    if args.read_tags:
+        print(f'tags of {library.scan_snapshot.tags_read} files read in {library.scan_snapshot.tag_seconds:.2f} s, '
+              f'{ml.get_tag_throughput(library):.0f} files/sec')
+    return 0
+
+
+def update(args) -> int:
+    with ml.LibraryLock(args.library):
+        old_library = ml.load_library(args.library)
+        library, diff = ml.get_updated_library_incremental(old_library, args.music_directory, args.keep_repeats,
+                                                           args.workers, args.recursive, read_tags=args.read_tags)
+        ml.save_library(library, args.library)
+    print(f'{len(diff.added)} songs added, {len(diff.removed)} songs removed, '
+          f'{len(diff.carried_over)} songs kept their priority')
+    for song in diff.added if args.verbose else []:
+        print(f'+ {song.file_path}')
+    for song in diff.removed if args.verbose else []:
+        print(f'- {song.file_path}')
+    return 0
+
+
+def watch(args) -> int:
+    # Keeps the library file in sync with its music directory until interrupted
+    library = ml.load_library(args.library)
+    if not args.music_directory and not library.scan_snapshot:
+        print('The library doesn\'t record its music directory, give --music-directory', file=sys.stderr)
+        return 1
+    watcher = LibraryWatcher.LibraryWatcher(library, args.music_directory, args.settle,
+                                            poll_interval=args.poll_interval, use_inotify=not args.poll,
+                                            max_workers=args.workers)
+    uses_inotify = isinstance(watcher.monitor, LibraryWatcher.InotifyMonitor)
+    print(f'Watching {watcher.library_path} ({"inotify" if uses_inotify else "polling"})', file=sys.stderr)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(WATCH_APPLY_INTERVAL)
+            if not watcher.has_pending_update():
+                continue
+            # Other commands may have journaled picks since, so the update goes into the library as it is saved now.
+            # Under the library's lock, a pick running meanwhile would append to the journal this save replaces.
+            with ml.LibraryLock(args.library):
+                watcher.library = ml.load_library(args.library)
+                diff = watcher.apply_pending_update()
+                ml.save_library(watcher.library, args.library)
+            print(f'{time.strftime("%H:%M:%S")} {len(diff.added)} songs added, {len(diff.removed)} songs removed, '
+                  f'{len(diff.moved)} songs renamed or moved', flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+    return 0
+
+
+def lock_library_for_picks(args) -> typing.ContextManager:
+    # Held from loading the library until its journal is closed, --no-save only reads the library
+    return contextlib.nullcontext() if args.no_save else ml.LibraryLock(args.library)
+
+
+def load_library_for_picks(args) -> ml.MusicLibrary:
+    # Picks are appended to the library's journal rather than rewriting the library
+    library = ml.load_library(args.library)
+    if not args.no_save:
+        LibraryJournal.open_journal(library, args.library, resume=True)
+    return library
+
+
+def get_rng(args) -> typing.Optional[random.Random]:
+    # With --seed the same library file gives the same picks
+    return ml.create_rng(args.seed) if args.seed is not None else None
+
+
+def pick(args) -> int:
+    with lock_library_for_picks(args):
+        library = load_library_for_picks(args)
+        rng = get_rng(args)
+        for _ in range(args.count):
+            song_path = ml.get_random_song_path_from_library(library, rng)
+            if not song_path:
+                print('No songs can be picked, check the priority weights', file=sys.stderr)
+                return 1
+            print(song_path)
+        LibraryJournal.close_journal(library)
+    return 0
+
+
+def print_no_songs_picked(args):
+    print('No songs can be picked, check the priority weights' +
+          (' and that songs have durations (scan --read-tags)' if args.minutes else ''), file=sys.stderr)
+
+
+def generate_playlist(args) -> int:
+    if args.stations:
+        return generate_station_playlists(args)
+    with lock_library_for_picks(args):
+        library = load_library_for_picks(args)
+        rng = get_rng(args)
+        timed_playlist_builder = TimedPlaylist.TimedPlaylistBuilder(library, rng) if args.minutes else None
+        for _ in range(args.playlists):
+            if timed_playlist_builder:
+                song_paths = [song.file_path for song in timed_playlist_builder.generate_playlist(
+                    args.minutes * 60, args.tolerance, not args.no_duplicates)]
+            else:
+                song_paths = ml.get_random_playlist_paths_from_library(library, args.songs, not args.no_duplicates,
+                                                                       rng)
+            if not song_paths:
+                print_no_songs_picked(args)
+                return 1
+            print('\n'.join(song_paths))
+            if args.playlists > 1:
+                print()
+        LibraryJournal.close_journal(library)
+    return 0
+
+
+def generate_station_playlists(args) -> int:
+    # Every station starts from the library as saved and has its own random stream, nothing is saved
+    seed = args.seed
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+        print(f'Seed {seed}', file=sys.stderr)  # to generate the same playlists again
+    jobs = [PlaylistBatch.PlaylistJob(f'station-{station}', args.playlists, args.songs,
+                                      args.minutes * 60 if args.minutes else None, args.tolerance,
+                                      not args.no_duplicates)
+            for station in range(1, args.stations + 1)]
+    for job, playlists in zip(jobs, PlaylistBatch.generate_playlists(args.library, seed, jobs, args.workers)):
+        print(f'# {job.stream}')
+        for song_paths in playlists:
+            if not song_paths:
+                print_no_songs_picked(args)
+                return 1
+            print('\n'.join(song_paths))
+            print()
+    return 0
+
+
+def stats(args) -> int:
+    library = ml.load_library(args.library)
+    statistics = ml.get_priority_statistics(library, args.songs_in_playlist)
+    print('{:>8} {:>8} {:>8} {:>12} {:>12} {:>14}'.format('Priority', 'Weight', 'Songs', 'Min repeats',
+                                                          'Max repeats', 'Frequency'))
+    for priority in range(ml.num_priorities):
+        relative_frequency = statistics.relative_frequencies[priority]
+        print('{:>8} {:>8} {:>8} {:>12} {:>12} {:>14}'.format(
+            priority,
+            library.weights[priority],
+            statistics.song_counts[priority],
+            '--' if statistics.min_repeats[priority] is None else statistics.min_repeats[priority],
+            '--' if statistics.max_repeats[priority] is None else statistics.max_repeats[priority],
+            relative_frequency if relative_frequency == '--' else f'1 in {relative_frequency:.2f}'))
+    return 0
+
+
+def search(args) -> int:
+    library = ml.load_library(args.library)
+    for song in SongSearch.search_songs(library, SongSearch.parse_query(' '.join(args.query)), args.limit):
+        print(f'[ {song.priority} ] {song.artist_name} - {song.song_name}  ({song.number_of_repeats} repeats)  '
+              f'{song.file_path}')
+    return 0
+
+
+def repeats(args) -> int:
+    with ml.LibraryLock(args.library):
+        library = ml.load_library(args.library)
+        categories = args.category or None
+        for category in categories or []:
+            if category not in library.categories:
+                print(f'No category {category} in the library', file=sys.stderr)
+                return 1
+        if args.mode == 'reset':
+            songs_changed = ml.reset_repeats(library, categories)
+        elif args.mode == 'special':
+            songs_changed = ml.reset_repeats_special(library, categories)
+        elif args.mode == 'decay':
+            songs_changed = ml.decay_repeats(library, args.factor, categories)
+        else:
+            songs_changed = ml.normalize_repeats(library, categories)
+        ml.save_library(library, args.library)
+    print(f'{songs_changed} songs changed')
+    return 0
+
+
+def simulate(args) -> int:
+    library = ml.load_library(args.library)
+    weights = [int(weight) for weight in args.weights.split(',')] if args.weights else None
+    if weights is not None and len(weights) != ml.num_priorities:
+        print(f'--weights needs {ml.num_priorities} comma separated weights', file=sys.stderr)
+        return 1
+    if args.songs_in_playlist < 1:
+        print('--songs-in-playlist needs to be at least 1', file=sys.stderr)
+        return 1
+    simulation = RotationSimulator.simulate_rotation(library, args.playlists * args.songs_in_playlist,
+                                                     args.songs_in_playlist, weights, rng=get_rng(args))
+    print('\n'.join(RotationSimulator.get_summary(simulation)))
+    return 0
+
+
+def export(args) -> int:
+    library = ml.load_library(args.library)
+    if args.format == 'library':
+        ml.save_library(library, args.output)
+    else:
+        # Format and compression default to the output's extension, e.g. songs.csv.gz
+        export_format = args.format or LibraryExport.get_export_format(args.output)
+        LibraryExport.export_library(library, args.output, export_format, True if args.gzip else None)
+    return 0
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Create, update and pick songs from music libraries.')
+    parser.add_argument('--timing', action='store_true', help='print startup and command time to stderr')
+    parser.add_argument('--instrument', action='store_true', help='print time spent per library operation at exit')
+    parser.add_argument('--profile', metavar='OPERATION', help='write a cProfile of a library operation at exit')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_scan_arguments(command_parser: argparse.ArgumentParser):
+        command_parser.add_argument('--workers', type=int, default=1, help='directories scanned in parallel')
+        command_parser.add_argument('--recursive', action='store_true', help='include songs in nested folders')
+        command_parser.add_argument('--read-tags', action='store_true',
+                                    help='take artist, title and duration from ID3 tags instead of file names')
+
+    scan_parser = commands.add_parser('scan', help='create a library from a music directory')
+    scan_parser.add_argument('music_directory')
+    scan_parser.add_argument('library')
+    add_scan_arguments(scan_parser)
+    scan_parser.set_defaults(function=scan)
+
+    update_parser = commands.add_parser('update', help='rescan the music directory of a library')
+    update_parser.add_argument('library')
+    update_parser.add_argument('music_directory')
+    update_parser.add_argument('--keep-repeats', action='store_true')
+    update_parser.add_argument('--verbose', action='store_true', help='list added and removed songs')
+    add_scan_arguments(update_parser)
+    update_parser.set_defaults(function=update)
+
+    watch_parser = commands.add_parser('watch', help='keep a library in sync with its music directory')
+    watch_parser.add_argument('library')
+    watch_parser.add_argument('--music-directory', help='defaults to the directory the library was scanned from')
+    watch_parser.add_argument('--settle', type=float, default=LibraryWatcher.SETTLE_SECONDS,
+                              help='seconds without changes before updating')
+    watch_parser.add_argument('--poll', action='store_true', help='poll directory mtimes even if inotify is available')
+    watch_parser.add_argument('--poll-interval', type=float, default=LibraryWatcher.POLL_INTERVAL_SECONDS)
+    watch_parser.add_argument('--workers', type=int, default=1, help='directories scanned in parallel')
+    watch_parser.set_defaults(function=watch)
+
+    pick_parser = commands.add_parser('pick', help='pick random songs')
+    pick_parser.add_argument('library')
+    pick_parser.add_argument('--count', type=int, default=1)
+    pick_parser.add_argument('--no-save', action='store_true', help="don't record the picks in the library")
+    pick_parser.add_argument('--seed', type=int, help='pick reproducibly')
+    pick_parser.set_defaults(function=pick)
+
+    playlist_parser = commands.add_parser('generate-playlist', help='pick whole playlists')
+    playlist_parser.add_argument('library')
+    playlist_parser.add_argument('--songs', type=int, default=SONGS_IN_PLAYLIST)
+    playlist_parser.add_argument('--minutes', type=float,
+                                 help='fill this running time instead of a number of songs, needs song durations')
+    playlist_parser.add_argument('--tolerance', type=float, default=30.0,
+                                 help='seconds the running time may be off by, with --minutes')
+    playlist_parser.add_argument('--playlists', type=int, default=1)
+    playlist_parser.add_argument('--no-duplicates', action='store_true', help='use each song once per playlist')
+    playlist_parser.add_argument('--no-save', action='store_true', help="don't record the picks in the library")
+    playlist_parser.add_argument('--seed', type=int, help='pick reproducibly')
+    playlist_parser.add_argument('--stations', type=int,
+                                 help='playlists for this many stations, each from the library as saved, not saved')
+    playlist_parser.add_argument('--workers', type=int, default=1, help='stations generated in parallel')
+    playlist_parser.set_defaults(function=generate_playlist)
+
+    stats_parser = commands.add_parser('stats', help='show songs, repeats and frequencies per priority')
+    stats_parser.add_argument('library')
+    stats_parser.add_argument('--songs-in-playlist', type=int, default=SONGS_IN_PLAYLIST)
+    stats_parser.set_defaults(function=stats)
+
+    search_parser = commands.add_parser('search', help='find songs by name, category, priority and repeats')
+    search_parser.add_argument('library')
+    search_parser.add_argument('query', nargs='+',
+                               help='words of artist and song names, and filters like category:rock (c:), '
+                                    'priority:3-5 (p:) and repeats:0-2 (r:)')
+    search_parser.add_argument('--limit', type=int, help='show at most this many songs')
+    search_parser.set_defaults(function=search)
+
+    repeats_parser = commands.add_parser('repeats', help='reset or scale down the repeat counts')
+    repeats_parser.add_argument('library')
+    repeats_parser.add_argument('--mode', choices=('reset', 'special', 'decay', 'normalize'), default='reset',
+                                help='special keeps one repeat on the most repeated songs of each priority, '
+                                     'normalize lowers each priority to start at 0')
+    repeats_parser.add_argument('--factor', type=float, default=0.5, help='repeats are multiplied by, with decay')
+    repeats_parser.add_argument('--category', action='append', help='only change songs of this category')
+    repeats_parser.set_defaults(function=repeats)
+
+    simulate_parser = commands.add_parser('simulate', help='simulate many playlists without changing the library')
+    simulate_parser.add_argument('library')
+    simulate_parser.add_argument('--playlists', type=int, default=10000)
+    simulate_parser.add_argument('--songs-in-playlist', type=int, default=SONGS_IN_PLAYLIST)
+    simulate_parser.add_argument('--weights', help='comma separated weights to try instead of the library\'s')
+    simulate_parser.add_argument('--seed', type=int, help='draw the same picks every time, to compare weights')
+    simulate_parser.set_defaults(function=simulate)
+
+    export_parser = commands.add_parser('export', help='write out the song list or convert the library')
+    export_parser.add_argument('library')
+    export_parser.add_argument('output')
+    export_parser.add_argument('--format', choices=tuple(LibraryExport.EXPORT_FORMATS) + ('library',),
+                               help='defaults to the extension of output, text if it has none of .json, .csv, .m3u '
+                                    'or .m3u8. library saves a copy, compact if output ends in '
+                                    + ml.COMPACT_LIBRARY_EXTENSION)
+    export_parser.add_argument('--gzip', action='store_true', help='compress, also done when output ends in .gz')
+    export_parser.set_defaults(function=export)
+
+    return parser
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    args = create_argument_parser().parse_args(argv)
+    if args.instrument or args.profile:
+        Instrumentation.enable(args.profile)
+    else:
+        Instrumentation.enable_from_environment()
+    command_start_time = time.perf_counter()
+    try:
+        result = args.function(args)
+    except ml.LibraryInUse as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.timing:
+        print(f'startup: {(command_start_time - start_time) * 1000:.1f} ms, '
+              f'{args.command}: {(time.perf_counter() - command_start_time) * 1000:.1f} ms', file=sys.stderr)
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main())
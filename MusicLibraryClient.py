@@ -0,0 +1,141 @@
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+import typing
+
+# Client for MusicLibraryServer. An address is either a unix socket path or a localhost tcp port.
+
+Address = typing.Union[str, int]
+
+
+class ServerError(Exception):
+    pass
+
+
+class MusicLibraryClient:
+    def __init__(self, address: Address, timeout: typing.Optional[float] = 10.0):
+        if isinstance(address, int):
+            self.connection = socket.create_connection(('127.0.0.1', address), timeout=timeout)
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.settimeout(timeout)
+            self.connection.connect(address)
+        self.responses = self.connection.makefile('rb')
+
+    def request(self, command: str, **arguments) -> typing.Dict[str, typing.Any]:
+        self.connection.sendall(json.dumps(dict(arguments, command=command)).encode('utf-8') + b'\n')
+        line = self.responses.readline()
+        if not line:
+            raise ServerError('Connection closed by server')
+        response = json.loads(line)
+        if not response['ok']:
+            raise ServerError(response['error'])
+        return response
+
+    def pick(self, count: int = 1) -> typing.List[str]:
+        return self.request('pick', count=count)['songs']
+
+    def generate_playlist(self, number_of_songs: int, allow_duplicates: bool = True) -> typing.List[str]:
+        return self.request('playlist', songs=number_of_songs, allow_duplicates=allow_duplicates)['songs']
+
+    def stats(self, songs_in_playlist: int = 40) -> typing.Dict[str, typing.Any]:
+        return self.request('stats', songs_in_playlist=songs_in_playlist)
+
+    def latency(self) -> typing.Dict[str, typing.Any]:
+        return self.request('latency')
+
+    def save(self):
+        self.request('save')
+
+    def shutdown(self):
+        self.request('shutdown')
+
+    def close(self):
+        self.responses.close()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def measure_latency(address: Address, number_of_clients: int, picks_per_client: int) -> typing.Dict[str, float]:
+    # Round trip times seen by clients picking one song at a time, all connected at once
+    round_trip_times: typing.List[float] = []
+    lock = threading.Lock()
+
+    def run_client():
+        client_round_trip_times = []
+        with MusicLibraryClient(address) as client:
+            for _ in range(picks_per_client):
+                start_time = time.perf_counter()
+                client.pick()
+                client_round_trip_times.append(time.perf_counter() - start_time)
+        with lock:
+            round_trip_times.extend(client_round_trip_times)
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=run_client) for _ in range(number_of_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_time = time.perf_counter() - start_time
+
+    round_trip_times.sort()
+    return {
+        'picks': len(round_trip_times),
+        'picks_per_second': len(round_trip_times) / elapsed_time if elapsed_time > 0 else 0.0,
+        'p50_ms': round_trip_times[len(round_trip_times) // 2] * 1000 if round_trip_times else 0.0,
+        'p99_ms': round_trip_times[min(len(round_trip_times) - 1, len(round_trip_times) * 99 // 100)] * 1000
+        if round_trip_times else 0.0,
+    }
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Pick songs from a running music library server.')
+    parser.add_argument('--socket', help='unix socket of the server, instead of a localhost tcp port')
+    parser.add_argument('--port', type=int, default=8765)
+    commands = parser.add_subparsers(dest='command', required=True)
+    pick_parser = commands.add_parser('pick')
+    pick_parser.add_argument('--count', type=int, default=1)
+    playlist_parser = commands.add_parser('playlist')
+    playlist_parser.add_argument('--songs', type=int, default=40)
+    playlist_parser.add_argument('--no-duplicates', action='store_true')
+    commands.add_parser('stats')
+    commands.add_parser('shutdown')
+    load_test_parser = commands.add_parser('load-test', help='measure pick latency with many clients')
+    load_test_parser.add_argument('--clients', type=int, default=16)
+    load_test_parser.add_argument('--picks', type=int, default=1000, help='picks per client')
+    args = parser.parse_args(argv)
+
+    address: Address = args.socket if args.socket else args.port
+    if args.command == 'load-test':
+        result = measure_latency(address, args.clients, args.picks)
+        with MusicLibraryClient(address) as client:
+            server_latency = client.latency()
+        print(f"{result['picks']} picks, {result['picks_per_second']:.0f} picks/sec, "
+              f"round trip p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms, "
+              f"server p50 {server_latency['p50_ms']:.3f} ms, p99 {server_latency['p99_ms']:.3f} ms")
+        return 0
+
+    with MusicLibraryClient(address) as client:
+        if args.command == 'pick':
+            print('\n'.join(client.pick(args.count)))
+        elif args.command == 'playlist':
+            print('\n'.join(client.generate_playlist(args.songs, not args.no_duplicates)))
+        elif args.command == 'stats':
+            print(json.dumps(client.stats(), indent=4))
+        elif args.command == 'shutdown':
+            client.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
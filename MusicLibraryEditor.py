@@ -1,13 +1,61 @@
 import os
+import threading
 import traceback
 import tkinter as tk
 import typing
 from tkinter import filedialog, messagebox
+import Instrumentation
+import LibraryExport
+import LibraryWatcher
 import MusicLibrary as ml
+import RotationSimulator
+import SongSearch
 import sys
 from itertools import chain
+from VirtualListbox import VirtualListbox
 
 SONGS_IN_PLAYLIST = 40
+SCAN_WORKERS = 4
+TASK_POLL_MILLISECONDS = 100
+WEIGHT_REFRESH_DELAY_MILLISECONDS = 150  # weight edits closer together than this are applied as one
+PREVIEW_PLAYLISTS = 1000  # playlists simulated by Preview Weights
+SEARCH_DELAY_MILLISECONDS = 200  # typing pause before the search box is applied
+SEARCH_RESULT_LIMIT = 10000
+WATCH_POLL_MILLISECONDS = 500  # how often a finished update of a watched music directory is looked for
+
+
+def get_song_row_text(song: ml.SongInfo) -> str:
+    return f"[ {song.priority} ] {song.artist_name} - {song.song_name}"
+
+
+# Runs a slow library operation on a worker thread. The work function only gets the Progress and returns a result,
+# everything that touches widgets happens in App.poll_task on the main thread once the thread is finished.
+class BackgroundTask:
+    def __init__(self, description: str, work: typing.Callable[[ml.Progress], typing.Any],
+                 on_done: typing.Callable[[typing.Any], None], error_title: str):
+        self.description: str = description
+        self.work = work
+        self.on_done = on_done
+        self.error_title: str = error_title
+        self.progress: ml.Progress = ml.Progress()
+        self.result: typing.Any = None
+        self.error: typing.Optional[BaseException] = None
+        self.error_traceback: str = ''
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        try:
+            self.result = self.work(self.progress)
+        except BaseException as e:
+            self.error = e
+            self.error_traceback = traceback.format_exc()
+
+    def get_status_text(self) -> str:
+        if self.progress.cancelled:
+            return f'{self.description} (cancelling)'
+        if self.progress.total:
+            return f'{self.description} {self.progress.done}/{self.progress.total}'
+        return self.description
 
 
 class App(tk.Tk):
@@ -18,7 +66,18 @@ class App(tk.Tk):
         self.current_category: typing.Optional[str] = None
         self.weight_validate_command = (self.register(self.weight_validate), '%P', '%W')
         self.loading_weights: bool = False
-        self.current_songs: typing.List[ml.SongInfo] = []
+        self.weight_refresh_id: typing.Optional[str] = None  # pending after() call of apply_weight_changes
+        self.weight_label_texts: typing.List[str] = []
+        self.current_songs: typing.Sequence[ml.SongInfo] = []
+        self.task: typing.Optional[BackgroundTask] = None
+        self.watcher: typing.Optional[LibraryWatcher.LibraryWatcher] = None
+        self.search_refresh_id: typing.Optional[str] = None  # pending after() call of apply_search
+        self.search_after_task: bool = False  # apply_search waits for the running task to finish
+        self.clearing_search: bool = False
+        self.watch_var = tk.BooleanVar(value=False)
+        # Song names and durations from ID3 tags when scanning, falling back to the file name. Follows the library
+        # that is loaded, so Update Library doesn't switch a library between the two.
+        self.read_tags_var = tk.BooleanVar(value=False)
 
         # Menu
         menu_bar = tk.Menu(self, tearoff=False)
@@ -31,25 +90,42 @@ class App(tk.Tk):
         file_menu.add_command(label='Exit', command=self.quit)
 
         library_menu = tk.Menu(menu_bar, tearoff=False)
+        library_menu.add_checkbutton(label='Read Song Names from Tags', variable=self.read_tags_var)
         library_menu.add_command(label='Create Library from Directory', command=self.create_library_from_directory)
         library_menu.add_command(label='Update Library', command=self.update_library)
         library_menu.add_command(label='Update Library, Keep Repeats', command=self.update_library_keep_repeats)
+        library_menu.add_checkbutton(label='Watch Music Directory', variable=self.watch_var,
+                                     command=self.toggle_watching)
         library_menu.add_command(label='Write Out Library Songlist', command=self.write_song_list_to_file)
         library_menu.add_command(label='Write Out Library Songlist (Bare)', command=self.write_song_list_to_file_bare)
         library_menu.add_command(label='Write Out Library Songlist (Json)', command=self.write_song_list_to_file_json)
+        library_menu.add_command(label='Write Out Library Songlist (Csv)', command=self.write_song_list_to_file_csv)
+        library_menu.add_command(label='Write Out Library Playlist (M3u)', command=self.write_playlist_to_file_m3u)
         library_menu.add_command(label='Reset repeat data', command=self.reset_repeat_data)
         library_menu.add_command(label='Reset repeat data special', command=self.reset_repeat_data_special)
+        library_menu.add_command(label='Reset repeat data of current category',
+                                 command=self.reset_repeat_data_of_category)
+        library_menu.add_command(label='Halve repeat data', command=self.halve_repeat_data)
+        library_menu.add_command(label='Normalize repeat data to minimum', command=self.normalize_repeat_data)
 
         menu_bar.add_cascade(label='File', menu=file_menu)
         menu_bar.add_cascade(label='Library', menu=library_menu)
         self.config(menu=menu_bar)
 
+        # Status bar for background tasks
+        status_frame = tk.Frame(self)
+        status_frame.grid(row=1, column=0, columnspan=2, sticky='WE')
+        self.status_label = tk.Label(status_frame, text='', anchor='w')
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_button = tk.Button(status_frame, text='Cancel', command=self.cancel_task, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT)
+
         # Library Frame
         self.grid_columnconfigure(1, weight=1)
         self.rowconfigure(0, weight=1)
         library_frame = tk.Frame(self)
         library_frame.grid(row=0, column=0, sticky='NWS')
-        library_frame.rowconfigure(3, weight=1)
+        library_frame.rowconfigure(4, weight=1)
 
         # Library Frame -> Category Chooser
         tk.Label(library_frame, text='Categories').grid(row=0, column=0)
@@ -61,27 +137,21 @@ class App(tk.Tk):
             self.priority_om['menu'].add_command(label=priority, command=lambda p=priority: self.refresh_song_lb_p(p))
         self.priority_om.grid(row=2, column=0)
 
+        # Library Frame -> Search, e.g. "beatles p:3-5 c:rock", see SongSearch.parse_query
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add('write', self.search_entry_callback)
+        tk.Entry(library_frame, textvariable=self.search_var).grid(row=3, column=0, sticky='WE')
+
         # Library Frame -> Song Name Listbox
         # tk.Label(library_frame, text='Song Names').grid(row=2, column=0)
 
-        song_name_lb_frame = tk.Frame(library_frame)
-        song_name_lb_frame.grid(row=3, column=0, sticky='NS')
-        song_name_lb_frame.grid_rowconfigure(0, weight=1)
-
-        y_scroll = tk.Scrollbar(song_name_lb_frame, orient=tk.VERTICAL)
-        y_scroll.grid(row=0, column=1, sticky='NS')
-        x_scroll = tk.Scrollbar(song_name_lb_frame, orient=tk.HORIZONTAL)
-        x_scroll.grid(row=1, column=0, sticky='WE')
-
-        self.song_name_lb = tk.Listbox(song_name_lb_frame, xscrollcommand=x_scroll.set, yscrollcommand=y_scroll.set,
-                                       selectmode=tk.EXTENDED)
-        self.song_name_lb.grid(row=0, column=0, sticky='NS')
-        x_scroll.config(command=self.song_name_lb.xview)
-        y_scroll.config(command=self.song_name_lb.yview)
+        # Only the rows in view are in the listbox, so categories of any size show instantly
+        self.song_name_lb = VirtualListbox(library_frame)
+        self.song_name_lb.grid(row=4, column=0, sticky='NS')
 
         # Library Frame -> Set Priorities
         priorities_frame = tk.Frame(library_frame)
-        priorities_frame.grid(row=3, column=1, sticky='NW')
+        priorities_frame.grid(row=4, column=1, sticky='NW')
         tk.Label(priorities_frame, text='Set Priorities:').pack()
         for i in range(20):
             tk.Button(priorities_frame, text=f' {i} ', command=lambda p=i: self.set_priority(p)).pack()
@@ -99,21 +169,43 @@ class App(tk.Tk):
                                     validatecommand=self.weight_validate_command)
             entry_var.set('0')
             weight_label = tk.Label(priority_weights_frame, text=f'Priority: {i}\tWaiting for Loaded Library')
+            self.weight_label_texts.append(weight_label.cget('text'))
             weight_entry.grid(row=i+1, column=0)
             weight_label.grid(row=i+1, column=1, sticky='W')
             self.weight_modifier_widgets.append((weight_entry, weight_label, entry_var))
+        tk.Button(priority_weights_frame, text='Preview Weights', command=self.preview_weights).grid(row=21, column=0)
 
     def weight_entry_callback(self, *args):
         if self.loading_weights:
             return
+        if self.library:
+            # Typing a number fires this for every key, the labels are only recalculated once the typing pauses
+            if self.weight_refresh_id is not None:
+                self.after_cancel(self.weight_refresh_id)
+            self.weight_refresh_id = self.after(WEIGHT_REFRESH_DELAY_MILLISECONDS, self.apply_weight_changes)
+
+    def cancel_weight_changes(self):
+        if self.weight_refresh_id is not None:
+            self.after_cancel(self.weight_refresh_id)
+            self.weight_refresh_id = None
+
+    def flush_weight_changes(self):
+        # Applies edits still waiting for the delay, before the weights are saved or carried over
+        if self.weight_refresh_id is not None:
+            self.cancel_weight_changes()
+            self.apply_weight_changes()
+
+    def apply_weight_changes(self):
+        self.weight_refresh_id = None
         if self.library:
             self.library.weights = [int(weight_widgets[0].get()) for weight_widgets in self.weight_modifier_widgets]
             self.refresh_weight_labels()
 
     def refresh_weight_labels(self):
-        relative_frequencies = ml.calculate_relative_frequency(self.library, SONGS_IN_PLAYLIST)
+        priority_statistics = ml.get_priority_statistics(self.library, SONGS_IN_PLAYLIST)
+        relative_frequencies = priority_statistics.relative_frequencies
         for priority, weight_label in enumerate(list(zip(*self.weight_modifier_widgets))[1]):
-            num_songs_in_priority = ml.get_number_of_songs_for_priority(self.library, priority)
+            num_songs_in_priority = priority_statistics.song_counts[priority]
             priority_playlist_frequency = float(num_songs_in_priority / relative_frequencies[priority]) \
                                             if relative_frequencies[priority] != '--' else 0.0
             if relative_frequencies[priority] == '--':
@@ -126,16 +218,68 @@ class App(tk.Tk):
                                                         float(relative_frequencies[priority]),
                                                         priority_playlist_frequency,
                                                         SONGS_IN_PLAYLIST)
-            weight_label.configure(text=weight_label_text)
+            # Reconfiguring a label makes tk lay out the frame again, so unchanged labels are left alone
+            if weight_label_text != self.weight_label_texts[priority]:
+                weight_label.configure(text=weight_label_text)
+                self.weight_label_texts[priority] = weight_label_text
+
+    def start_task(self, description: str, work: typing.Callable[[ml.Progress], typing.Any],
+                   on_done: typing.Callable[[typing.Any], None], error_title: str) -> bool:
+        if self.task:
+            messagebox.showinfo('Busy', f'Wait for "{self.task.description}" to finish or cancel it first')
+            return False
+        self.task = BackgroundTask(description, work, on_done, error_title)
+        self.status_label.configure(text=self.task.get_status_text())
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.task.thread.start()
+        self.after(TASK_POLL_MILLISECONDS, self.poll_task)
+        return True
+
+    def poll_task(self):
+        task = self.task
+        if task.thread.is_alive():
+            self.status_label.configure(text=task.get_status_text())
+            self.after(TASK_POLL_MILLISECONDS, self.poll_task)
+            return
+
+        self.task = None
+        self.cancel_button.configure(state=tk.DISABLED)
+        if isinstance(task.error, ml.OperationCancelled):
+            self.status_label.configure(text=f'{task.description} cancelled')
+        elif task.error:
+            self.status_label.configure(text='')
+            print(task.error_traceback)
+            messagebox.showerror(task.error_title, task.error)
+        else:
+            self.status_label.configure(text='')
+            try:
+                task.on_done(task.result)
+            except Exception as e:
+                print(traceback.print_exc())
+                messagebox.showerror(task.error_title, e)
+        if self.search_after_task:
+            self.search_after_task = False
+            self.apply_search()
+
+    def cancel_task(self):
+        # Takes effect at the next category, the library is left as it was
+        if self.task:
+            self.task.progress.cancelled = True
+            self.status_label.configure(text=self.task.get_status_text())
 
     def load_library(self, library_filename: typing.Optional[str] = None):
+        if self.task:
+            return
         try:
             if not library_filename:
                 library_filename = filedialog.askopenfilename(initialdir=os.getcwd(), title="Select Music Library",
-                                                              filetypes=(("json", "*.json"),))
+                                                              filetypes=(("json", "*.json"),
+                                                                         ("compact library", "*" + ml.COMPACT_LIBRARY_EXTENSION)))
 
             if library_filename:
                 self.library = ml.load_library(library_filename)
+                self.stop_watching()
+                self.read_tags_var.set(bool(self.library.scan_snapshot and self.library.scan_snapshot.has_tags))
                 self.current_library_filename = library_filename
                 self.current_category = None
                 self.refresh_category_om()
@@ -146,76 +290,171 @@ class App(tk.Tk):
             messagebox.showerror('Open Library Error', e)
 
     def create_library_from_directory(self):
-        try:
-            library_directory = filedialog.askdirectory()
-
-            if library_directory:
-                self.library = ml.create_library(library_directory)
-                self.current_library_filename = None
-                self.current_category = None
-                self.refresh_category_om()
-                self.refresh_song_lb(None)
-                self.load_weights()
-        except Exception as e:
-            print(traceback.print_exc())
-            messagebox.showerror('Create Library Error', e)
+        library_directory = filedialog.askdirectory()
+        if not library_directory:
+            return
+        read_tags = self.read_tags_var.get()
+        weights_at_start = list(self.library.weights) if self.library else None
+
+        def on_done(library: ml.MusicLibrary):
+            # Pending edits go into the library they were typed for, and weights edited during the scan are kept
+            self.flush_weight_changes()
+            if self.library and self.library.weights != weights_at_start:
+                library.weights = list(self.library.weights)
+            self.library = library
+            self.stop_watching()
+            self.current_library_filename = None
+            self.current_category = None
+            self.refresh_category_om()
+            self.refresh_song_lb(None)
+            self.load_weights()
+
+        self.start_task('Scanning', lambda progress: ml.create_library(library_directory, max_workers=SCAN_WORKERS,
+                                                                       progress=progress, read_tags=read_tags),
+                        on_done, 'Create Library Error')
 
     def update_library(self):
+        self.start_update_library(keep_repeats=False)
+
+    def update_library_keep_repeats(self):
+        self.start_update_library(keep_repeats=True)
+
+    def start_update_library(self, keep_repeats: bool):
         if not self.library:
             return
+        library_directory = filedialog.askdirectory()
+        if not library_directory:
+            return
 
-        try:
+        # The old library is only read on the worker thread, nothing may change it until the task is done
+        self.flush_weight_changes()
+        old_library = self.library
+        read_tags = self.read_tags_var.get()
+
+        def on_done(result: typing.Tuple[ml.MusicLibrary, ml.LibraryDiff]):
+            library, diff = result
+            # The merge carried over the weights from when the update started, edits made since are taken too
+            self.flush_weight_changes()
+            library.weights = list(self.library.weights)
+            SongSearch.update_search_index(old_library, library, diff)
+            self.library = library
+            self.stop_watching()
+            self.current_category = None
+            self.refresh_category_om()
+            self.refresh_song_lb(None)
+            self.load_weights()
+            self.show_library_diff(diff)
+
+        self.start_task('Updating', lambda progress: ml.get_updated_library_incremental(
+                            old_library, library_directory, keep_repeats, SCAN_WORKERS, progress=progress,
+                            read_tags=read_tags),
+                        on_done, 'Update Library Error')
+
+    def toggle_watching(self):
+        if self.watch_var.get():
+            self.start_watching()
+        else:
+            self.stop_watching()
+
+    def start_watching(self):
+        self.watch_var.set(False)
+        if not self.library or self.watcher:
+            return
+        # The directory the library was scanned from, asked for if the library doesn't know
+        library_directory = self.library.scan_snapshot.library_path if self.library.scan_snapshot else None
+        if not library_directory:
             library_directory = filedialog.askdirectory()
-
-            if library_directory:
-                self.library = ml.get_updated_library(self.library, library_directory)
-                self.current_category = None
-                self.refresh_category_om()
-                self.refresh_song_lb(None)
-                self.load_weights()
+            if not library_directory:
+                return
+        try:
+            self.watcher = LibraryWatcher.LibraryWatcher(self.library, library_directory, max_workers=SCAN_WORKERS)
         except Exception as e:
             print(traceback.print_exc())
-            messagebox.showerror('Create Library Error', e)
+            messagebox.showerror('Watch Music Directory Error', e)
+            return
+        self.watcher.start()
+        self.watch_var.set(True)
+        self.after(WATCH_POLL_MILLISECONDS, self.poll_watcher)
+
+    def stop_watching(self):
+        # Doesn't wait for a scan in progress, its result is dropped
+        if self.watcher:
+            self.watcher.stop(wait=False)
+            self.watcher = None
+        self.watch_var.set(False)
+
+    def poll_watcher(self):
+        watcher = self.watcher
+        if not watcher:
+            return
+        # Background tasks read the library, so updates wait for them to finish
+        if not self.task and watcher.has_pending_update():
+            diff = watcher.apply_pending_update()
+            if self.current_category not in self.library.categories:
+                self.current_category = None
+            self.refresh_category_om()
+            if self.search_var.get().strip():
+                self.apply_search()
+            else:
+                self.refresh_song_lb(self.current_category)
+            self.refresh_weight_labels()
+            self.status_label.configure(text=f'Music directory changed: {len(diff.added)} songs added, '
+                                             f'{len(diff.removed)} removed, {len(diff.moved)} renamed or moved')
+        self.after(WATCH_POLL_MILLISECONDS, self.poll_watcher)
 
-    def update_library_keep_repeats(self):
+    def preview_weights(self):
+        # Simulates the weights as typed, including edits that are still waiting to be applied
         if not self.library:
             return
-
-        try:
-            library_directory = filedialog.askdirectory()
-
-            if library_directory:
-                self.library = ml.get_updated_library_keep_repeats(self.library, library_directory)
-                self.current_category = None
-                self.refresh_category_om()
-                self.refresh_song_lb(None)
-                self.load_weights()
-        except Exception as e:
-            print(traceback.print_exc())
-            messagebox.showerror('Create Library Error', e)
+        library = self.library
+        weights = [int(weight_widgets[0].get()) for weight_widgets in self.weight_modifier_widgets]
+        self.start_task('Simulating', lambda progress: RotationSimulator.simulate_rotation(
+                            library, PREVIEW_PLAYLISTS * SONGS_IN_PLAYLIST, SONGS_IN_PLAYLIST, weights, progress),
+                        self.show_rotation_simulation, 'Preview Weights Error')
+
+    def show_rotation_simulation(self, simulation: RotationSimulator.RotationSimulation):
+        window = tk.Toplevel(self)
+        window.title('Weights Preview')
+        summary_lines = RotationSimulator.get_summary(simulation)
+        text = tk.Text(window, font='TkFixedFont', wrap=tk.NONE, width=max(len(line) for line in summary_lines),
+                       height=len(summary_lines))
+        text.insert('1.0', '\n'.join(summary_lines))
+        text.config(state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+
+    def show_library_diff(self, diff: ml.LibraryDiff):
+        messagebox.showinfo('Library Updated', f'{len(diff.added)} songs added\n'
+                                               f'{len(diff.removed)} songs removed\n'
+                                               f'{len(diff.carried_over)} songs kept their priority')
 
     def save_library(self):
-        try:
-            if self.current_library_filename:
-                ml.save_library(self.library, self.current_library_filename)
-            else:
-                self.save_library_as()
-        except Exception as e:
-            print(traceback.print_exc())
-            messagebox.showerror('Create Library Error', e)
+        if not self.library:
+            return
+        if self.current_library_filename:
+            self.start_save_library(self.current_library_filename)
+        else:
+            self.save_library_as()
 
     def save_library_as(self):
-        try:
-            library_filename = filedialog.asksaveasfilename(initialdir=os.getcwd(),
-                                                            title='Save music library',
-                                                            filetypes=(('json', '*.json'),),
-                                                            defaultextension='.json')
-            if library_filename:
-                ml.save_library(self.library, library_filename)
-                self.current_library_filename = library_filename
-        except Exception as e:
-            print(traceback.print_exc())
-            messagebox.showerror('Create Library Error', e)
+        if not self.library:
+            return
+        library_filename = filedialog.asksaveasfilename(initialdir=os.getcwd(),
+                                                        title='Save music library',
+                                                        filetypes=(('json', '*.json'),
+                                                                   ('compact library', '*' + ml.COMPACT_LIBRARY_EXTENSION)),
+                                                        defaultextension='.json')
+        if library_filename:
+            self.start_save_library(library_filename)
+
+    def start_save_library(self, library_filename: str):
+        self.flush_weight_changes()
+        library = self.library
+
+        def on_done(result):
+            self.current_library_filename = library_filename
+
+        self.start_task('Saving', lambda progress: ml.save_library(library, library_filename),
+                        on_done, 'Save Library Error')
 
     def write_song_list_to_file(self):
         if not self.library:
@@ -262,50 +501,111 @@ class App(tk.Tk):
             print(traceback.print_exc())
             messagebox.showerror('Write song list error.', e)
 
+    def write_song_list_to_file_csv(self):
+        self.export_library_to_file('csv', 'Library Song List',
+                                    (('Csv File', '*.csv'), ('Gzipped Csv File', '*.csv.gz')), '.csv')
+
+    def write_playlist_to_file_m3u(self):
+        self.export_library_to_file('m3u', 'Library Playlist',
+                                    (('M3u Playlist', '*.m3u8'), ('Gzipped M3u Playlist', '*.m3u8.gz')), '.m3u8')
+
+    def export_library_to_file(self, export_format: str, title: str,
+                               filetypes: typing.Tuple[typing.Tuple[str, str], ...], defaultextension: str):
+        if not self.library:
+            return
+
+        try:
+            export_file_name = filedialog.asksaveasfilename(initialdir=os.getcwd(), title=title, filetypes=filetypes,
+                                                            defaultextension=defaultextension)
+            if export_file_name:
+                # Compressed when the name ends in .gz
+                LibraryExport.export_library(self.library, export_file_name, export_format)
+        except Exception as e:
+            print(traceback.print_exc())
+            messagebox.showerror('Write song list error.', e)
+
     def reset_repeat_data(self):
-        if self.library:
+        if self.library and not self.task:
             ml.reset_repeat_data(self.library)
 
     def reset_repeat_data_special(self):
-        if self.library:
+        if self.library and not self.task:
             ml.reset_repeats_special(self.library)
 
+    def reset_repeat_data_of_category(self):
+        if self.library and not self.task and self.current_category:
+            ml.reset_repeat_data(self.library, [self.current_category])
+
+    def halve_repeat_data(self):
+        if self.library and not self.task:
+            ml.decay_repeats(self.library, 0.5)
+
+    def normalize_repeat_data(self):
+        if self.library and not self.task:
+            ml.normalize_repeats(self.library)
+
+    def search_entry_callback(self, *args):
+        # Searches once typing pauses rather than on every key
+        if self.clearing_search:
+            return
+        if self.search_refresh_id is not None:
+            self.after_cancel(self.search_refresh_id)
+        self.search_refresh_id = self.after(SEARCH_DELAY_MILLISECONDS, self.apply_search)
+
+    def clear_search(self):
+        if self.search_refresh_id is not None:
+            self.after_cancel(self.search_refresh_id)
+            self.search_refresh_id = None
+        self.clearing_search = True
+        self.search_var.set('')
+        self.clearing_search = False
+
+    def apply_search(self):
+        self.search_refresh_id = None
+        if not self.library:
+            return
+        query = SongSearch.parse_query(self.search_var.get())
+        if not query.text.strip() and not query.has_filters():
+            self.refresh_song_lb(self.current_category)
+            return
+        if not SongSearch.has_current_search_index(self.library):
+            # Indexing a large library takes a few seconds, the search runs again once it's done. Another task
+            # may be about to replace the library, so the search waits for it instead.
+            if self.task:
+                self.search_after_task = True
+            else:
+                library = self.library
+                self.start_task('Indexing', lambda progress: SongSearch.get_search_index(library),
+                                lambda search_index: self.apply_search(), 'Search Error')
+            return
+        self.current_songs = SongSearch.search_songs(self.library, query, SEARCH_RESULT_LIMIT)
+        self.song_name_lb.set_items(self.current_songs, get_song_row_text)
+        self.status_label.configure(text=f'First {SEARCH_RESULT_LIMIT} songs found'
+                                    if len(self.current_songs) == SEARCH_RESULT_LIMIT
+                                    else f'{len(self.current_songs)} songs found')
+
     def refresh_category_om(self):
         self.category_om['menu'].delete(0, 'end')
         for category in self.library.categories.keys():
             self.category_om['menu'].add_command(label=category, command=lambda c=category: self.refresh_song_lb(c))
 
     def refresh_song_lb(self, category):
-        self.song_name_lb.delete(0, tk.END)
-        self.current_songs = []
+        self.clear_search()
         self.current_category = category
-        if not self.current_category:
-            return
-        for song in self.library.categories[category]:
-            self.current_songs.append(song)
-            insert_string = f"[ {song.priority} ] {song.artist_name} - {song.song_name}"
-            self.song_name_lb.insert(tk.END, insert_string)
-        self.song_name_lb.config(width=0)
-        
+        self.current_songs = self.library.categories[category] if self.current_category else []
+        self.song_name_lb.set_items(self.current_songs, get_song_row_text)
+
     def refresh_song_lb_p(self, priority):
-        self.song_name_lb.delete(0, tk.END)
-        self.current_songs = []
-        songs = chain(*self.library.categories.values())
-        for song in songs:
-            if song.priority == priority:
-                self.current_songs.append(song)
-                insert_string = f"[ {song.priority} ] {song.artist_name} - {song.song_name}"
-                self.song_name_lb.insert(tk.END, insert_string)
-        self.song_name_lb.config(width=0)
-    
+        self.clear_search()
+        self.current_songs = [song for song in chain(*self.library.categories.values()) if song.priority == priority]
+        self.song_name_lb.set_items(self.current_songs, get_song_row_text)
+
     def refresh_song_lb_keep(self, priority):
-        self.song_name_lb.delete(0, tk.END)
-        for song in self.current_songs:
-            insert_string = f"[ {song.priority} ] {song.artist_name} - {song.song_name}"
-            self.song_name_lb.insert(tk.END, insert_string)
-        self.song_name_lb.config(width=0)
+        # Keeps selection and scroll position
+        self.song_name_lb.refresh()
 
     def load_weights(self):
+        self.cancel_weight_changes()  # edits meant for the previous library
         self.loading_weights = True  # This prevents weight entry callback from modifying library while library is writing into it
         for priority in range(20):
             self.weight_modifier_widgets[priority][2].set(str(self.library.weights[priority]))
@@ -313,29 +613,16 @@ class App(tk.Tk):
         self.refresh_weight_labels()
 
     def set_priority(self, priority: int):
-        # if not self.current_category:
-        #    return
-        
-        songs = chain(*self.library.categories.values())
+        # Songs can't change while a background task reads the library
+        if not self.library or self.task:
+            return
 
+        # Listbox rows are in the same order as self.current_songs
         selected_song_indexes = self.song_name_lb.curselection()
-        y_view_fraction, _ = self.song_name_lb.yview()
-        for lb_song_string in map(self.song_name_lb.get, selected_song_indexes):
-            artist_name, song_name = map(str.strip, lb_song_string[6:].split('-'))
-            print(artist_name, song_name)
-            for song in songs:
-                if song.artist_name == artist_name and song.song_name == song_name:
-                    print('set priority')
-                    song.priority = priority
-                    break
-            # song = [song for song in songs
-            #        if song.artist_name == artist_name and song.song_name == song_name][0]
-            # song.priority = priority
-
-        self.refresh_song_lb_keep(self.current_category)
-        for i in selected_song_indexes:
-            self.song_name_lb.selection_set(i)
-        self.song_name_lb.yview_moveto(y_view_fraction)
+        for song_index in selected_song_indexes:
+            self.current_songs[song_index].priority = priority
+
+        self.song_name_lb.refresh_rows(selected_song_indexes)
         self.refresh_weight_labels()
 
     def weight_validate(self, new_value, widget_name):
@@ -363,7 +650,18 @@ class App(tk.Tk):
             return False
 
 
+# Timed when instrumentation is enabled, see Instrumentation
+EDITOR_OPERATIONS = [
+    'weight_entry_callback', 'apply_weight_changes', 'refresh_weight_labels', 'load_library',
+    'create_library_from_directory', 'update_library', 'update_library_keep_repeats', 'save_library', 'save_library_as',
+    'refresh_category_om', 'refresh_song_lb', 'refresh_song_lb_p', 'refresh_song_lb_keep', 'load_weights',
+    'set_priority', 'poll_task', 'preview_weights', 'poll_watcher', 'apply_search',
+]
+
+
 if __name__ == '__main__':
+    Instrumentation.enable_from_environment()
+    Instrumentation.instrument(App, 'App', EDITOR_OPERATIONS)
     root = App()
     try:
         library_file_path = sys.argv[1]
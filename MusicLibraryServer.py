@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+import typing
+from operator import attrgetter
+
+import Instrumentation
+import LibraryWatcher
+import MusicLibrary as ml
+
+# Keeps one library in memory and serves picks to any number of local clients, see MusicLibraryClient.
+# Requests and responses are single lines of json:
+#   {"command": "pick", "count": 1}                                  -> {"ok": true, "songs": [file paths]}
+#   {"command": "playlist", "songs": 40, "allow_duplicates": true}   -> {"ok": true, "songs": [file paths]}
+#   {"command": "stats", "songs_in_playlist": 40}                    -> {"ok": true, "song_counts": [...], ...}
+#   {"command": "latency"}                                           -> {"ok": true, "p50_ms": .., "p99_ms": ..}
+#   {"command": "save"}                                              -> {"ok": true}
+#   {"command": "shutdown"}                                          -> {"ok": true}, then saves and stops
+# Failed requests get {"ok": false, "error": message}.
+
+SONGS_IN_PLAYLIST = 40
+LATENCY_SAMPLES = 10000
+WATCH_APPLY_INTERVAL = 1.0  # seconds between checks for a finished library update, with --watch
+
+
+# Category, its songs, and the priority and number of repeats of each song
+CategorySnapshot = typing.Tuple[str, typing.List[ml.SongInfo], typing.List[int], typing.List[int]]
+
+
+# The songs of a library with their priorities and repeats as they were when it was taken, so the library can be
+# saved on a worker thread while picks go on. Taking it is one pass over the songs, a fraction of a save.
+class LibrarySnapshot:
+    def __init__(self, library: ml.MusicLibrary):
+        get_priority, get_repeats = attrgetter('priority'), attrgetter('number_of_repeats')
+        self.categories: typing.List[CategorySnapshot] = [
+            (category, list(songs), list(map(get_priority, songs)), list(map(get_repeats, songs)))
+            for category, songs in library.categories.items()]
+        self.weights: typing.List[int] = list(library.weights)
+        self.scan_snapshot: typing.Optional[ml.ScanSnapshot] = library.scan_snapshot
+
+    def to_library(self) -> ml.MusicLibrary:
+        # Copies of the songs, never seen by the picker index. Names don't change while the server runs, updates
+        # from the watcher replace songs rather than renaming them.
+        library = ml.MusicLibrary()
+        for category, songs, priorities, repeats in self.categories:
+            category_songs = []
+            for song, priority, number_of_repeats in zip(songs, priorities, repeats):
+                song_copy = ml.SongInfo()
+                song_copy.artist_name = song.artist_name
+                song_copy.song_name = song.song_name
+                song_copy.file_path = song.file_path
+                song_copy.duration = song.duration
+                song_copy.priority = priority
+                song_copy.number_of_repeats = number_of_repeats
+                category_songs.append(song_copy)
+            library.categories[category] = category_songs
+        library.weights = self.weights
+        library.scan_snapshot = self.scan_snapshot
+        return library
+
+
+def save_snapshot(snapshot: LibrarySnapshot, file_name: str) -> str:
+    # Returns the journal id of the save
+    library = snapshot.to_library()
+    ml.save_library(library, file_name)
+    return library.journal_id
+
+
+def get_percentile(sorted_samples: typing.List[float], percentile: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * percentile / 100))]
+
+
+def remove_stale_socket(socket_path: str):
+    # A socket left behind by a server that didn't shut down cleanly is removed, anything else is left alone
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError(f'{socket_path} exists and is not a socket')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass  # nobody listening
+        else:
+            raise ValueError(f'Another server is already listening on {socket_path}')
+    os.remove(socket_path)
+
+
+class LibraryServer:
+    def __init__(self, library_file_name: str, save_interval: float, watch: bool = False):
+        self.library_file_name: str = library_file_name
+        # Held until the server stops, the only process that writes the library meanwhile. Command line picks or
+        # updates would otherwise journal against saves the server replaces, or be saved over by it.
+        self.library_lock: ml.LibraryLock = ml.LibraryLock(library_file_name, timeout=0)
+        self.library_lock.acquire()
+        self.library: ml.MusicLibrary = ml.load_library(library_file_name)
+        self.save_interval: float = save_interval
+        # Keeps the songs in sync with the music directory the library was scanned from
+        self.watcher: typing.Optional[LibraryWatcher.LibraryWatcher] = \
+            LibraryWatcher.LibraryWatcher(self.library) if watch else None
+        self.unsaved_changes: bool = False
+        # Handling time of the latest requests in seconds
+        self.latencies: typing.Deque[float] = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.number_of_requests: int = 0
+        self.stop_event: typing.Optional[asyncio.Event] = None
+        self.save_lock: typing.Optional[asyncio.Lock] = None  # one save at a time
+        self.client_tasks: typing.Set[asyncio.Task] = set()
+        self.port: typing.Optional[int] = None  # the tcp port listened on, once serving
+
+    def handle_request(self, request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        # Runs without awaiting anything, so requests from different clients never change repeats at the same time
+        command = request.get('command')
+        if command == 'pick':
+            songs = []
+            for _ in range(request.get('count', 1)):
+                song = ml.pick_random_song_from_library(self.library)
+                if not song:
+                    break
+                songs.append(song.file_path)
+            self.unsaved_changes = self.unsaved_changes or bool(songs)
+            return {'ok': True, 'songs': songs}
+        if command == 'playlist':
+            songs = ml.get_random_playlist_paths_from_library(self.library, request.get('songs', SONGS_IN_PLAYLIST),
+                                                              request.get('allow_duplicates', True))
+            self.unsaved_changes = self.unsaved_changes or bool(songs)
+            return {'ok': True, 'songs': songs}
+        if command == 'stats':
+            statistics = ml.get_priority_statistics(self.library, request.get('songs_in_playlist', SONGS_IN_PLAYLIST))
+            return {'ok': True,
+                    'weights': self.library.weights,
+                    'song_counts': statistics.song_counts,
+                    'min_repeats': statistics.min_repeats,
+                    'max_repeats': statistics.max_repeats,
+                    'relative_frequencies': statistics.relative_frequencies}
+        if command == 'latency':
+            sorted_latencies = sorted(self.latencies)
+            return {'ok': True,
+                    'requests': self.number_of_requests,
+                    'p50_ms': get_percentile(sorted_latencies, 50) * 1000,
+                    'p99_ms': get_percentile(sorted_latencies, 99) * 1000}
+        if command == 'shutdown':
+            self.stop_event.set()
+            return {'ok': True}
+        return {'ok': False, 'error': f'Unknown command {command}'}
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.client_tasks.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start_time = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    if request.get('command') == 'save':
+                        # Waits for the save to be written, without holding up other clients meanwhile
+                        await self.save()
+                        response = {'ok': True}
+                    else:
+                        response = self.handle_request(request)
+                        self.latencies.append(time.perf_counter() - start_time)
+                except Exception as e:
+                    response = {'ok': False, 'error': str(e)}
+                self.number_of_requests += 1
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # client went away, or the server is shutting down
+        finally:
+            writer.close()
+            self.client_tasks.discard(asyncio.current_task())
+
+    async def save(self):
+        # Written on a worker thread from a snapshot, a large library takes seconds to save and requests are
+        # handled meanwhile. Picks made after the snapshot are left for the next save.
+        async with self.save_lock:
+            snapshot = LibrarySnapshot(self.library)
+            self.unsaved_changes = False
+            future = asyncio.get_running_loop().run_in_executor(None, save_snapshot, snapshot, self.library_file_name)
+            try:
+                await asyncio.shield(future)
+            finally:
+                # Also when cancelled, e.g. on shutdown, so the next save never races this one's thread
+                await asyncio.wait([future])
+                if future.exception() is None:
+                    self.library.journal_id = future.result()
+                else:
+                    self.unsaved_changes = True
+
+    async def save_periodically(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if self.unsaved_changes:
+                try:
+                    await self.save()
+                except OSError as e:
+                    print(f'Saving {self.library_file_name} failed: {e}', file=sys.stderr)
+
+    async def apply_library_updates(self):
+        # Updates are applied between requests, so a pick never sees a half updated library
+        while True:
+            await asyncio.sleep(WATCH_APPLY_INTERVAL)
+            if self.watcher.apply_pending_update():
+                self.unsaved_changes = True
+
+    async def serve(self, socket_path: typing.Optional[str], port: int, ready: typing.Optional[threading.Event] = None):
+        # Port 0 picks a free port, see self.port. ready is set once clients can connect, for running the server
+        # on a thread of its own.
+        if socket_path:
+            remove_stale_socket(socket_path)
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host='127.0.0.1', port=port)
+            self.port = server.sockets[0].getsockname()[1]
+
+        self.stop_event = asyncio.Event()
+        self.save_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # not available on windows or outside the main thread
+
+        save_task = asyncio.create_task(self.save_periodically())
+        watch_task = None
+        if self.watcher:
+            self.watcher.start()
+            watch_task = asyncio.create_task(self.apply_library_updates())
+        async with server:
+            if ready:
+                ready.set()
+            await self.stop_event.wait()
+            # Connected clients are dropped, otherwise leaving the block waits for them to disconnect
+            server.close()
+            for client_task in list(self.client_tasks):
+                client_task.cancel()
+            await asyncio.gather(*self.client_tasks, return_exceptions=True)
+        save_task.cancel()
+        if watch_task:
+            watch_task.cancel()
+            self.watcher.stop()
+        if self.unsaved_changes:
+            await self.save()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.library_lock.release()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Serve song picks from a music library kept in memory.')
+    parser.add_argument('library')
+    parser.add_argument('--socket', help='unix socket to listen on, instead of a localhost tcp port')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--save-interval', type=float, default=60.0, help='seconds between saves of the library')
+    parser.add_argument('--watch', action='store_true',
+                        help='pick up songs added to, removed from or renamed in the music directory')
+    args = parser.parse_args(argv)
+
+    Instrumentation.enable_from_environment()
+    try:
+        server = LibraryServer(args.library, args.save_interval, args.watch)
+        asyncio.run(server.serve(args.socket, args.port))
+    except (ValueError, ml.LibraryInUse) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import functools
+import typing
+
+import MusicLibrary as ml
+import TimedPlaylist
+
+# Playlists for many stations or days at once, spread over worker processes and reproducible from a seed:
+#   jobs = [PlaylistJob(f'station-{station}', number_of_playlists=24) for station in range(10)]
+#   playlists = generate_playlists(library_file_name, seed=2024, jobs=jobs, max_workers=4)
+# Every job loads the library as saved and draws from its own stream, ml.create_rng(seed, job.stream), so its
+# playlists only depend on the library file, the seed and the job. The same call gives the same playlists for any
+# number of workers and in whatever order the workers finish, and a single job can be generated again on its own.
+# Within a job the playlists follow each other like playlists picked one after another, repeats included, but
+# jobs don't see each other's picks and nothing is saved: the jobs are alternatives that start from the same
+# library, e.g. stations sharing a music collection or days planned ahead.
+
+
+class PlaylistJob:
+    def __init__(self, stream: str, number_of_playlists: int = 1, songs_in_playlist: int = 40,
+                 target_seconds: typing.Optional[float] = None, tolerance_seconds: float = 30.0,
+                 allow_duplicates: bool = True):
+        self.stream: str = stream  # names the job's random stream, so every job needs its own
+        self.number_of_playlists: int = number_of_playlists
+        self.songs_in_playlist: int = songs_in_playlist
+        self.target_seconds: typing.Optional[float] = target_seconds  # fill a running time instead, see TimedPlaylist
+        self.tolerance_seconds: float = tolerance_seconds
+        self.allow_duplicates: bool = allow_duplicates
+
+
+def run_playlist_job(library_file_name: str, seed: typing.Union[int, str],
+                     job: PlaylistJob) -> typing.List[typing.List[str]]:
+    # Loaded for every job rather than once per worker, as the picks of one job would change the next one's
+    library = ml.load_library(library_file_name)
+    rng = ml.create_rng(seed, job.stream)
+    if job.target_seconds is not None:
+        builder = TimedPlaylist.TimedPlaylistBuilder(library, rng)
+        return [[song.file_path for song in builder.generate_playlist(job.target_seconds, job.tolerance_seconds,
+                                                                      job.allow_duplicates)]
+                for _ in range(job.number_of_playlists)]
+    return [ml.get_random_playlist_paths_from_library(library, job.songs_in_playlist, job.allow_duplicates, rng)
+            for _ in range(job.number_of_playlists)]
+
+
+def generate_playlists(library_file_name: str, seed: typing.Union[int, str], jobs: typing.List[PlaylistJob],
+                       max_workers: int = 1) -> typing.List[typing.List[typing.List[str]]]:
+    # Song paths of each job's playlists, in the order of jobs
+    streams = [job.stream for job in jobs]
+    if len(set(streams)) != len(streams):
+        raise ValueError('Every playlist job needs a stream name of its own')
+    run_job = functools.partial(run_playlist_job, library_file_name, seed)
+    if max_workers <= 1 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(min(max_workers, len(jobs))) as executor:
+        return list(executor.map(run_job, jobs))
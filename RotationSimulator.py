@@ -0,0 +1,185 @@
+import random
+import typing
+
+import MusicLibrary as ml
+
+# Simulates many picks of pick_random_song_from_library without touching the library, to see how a set of
+# weights plays out once repeat balancing is taken into account, e.g. before applying them in the editor.
+#
+# Songs of different priorities don't affect each other: a pick first draws a priority by weight and then a
+# random song among the least repeated songs of that priority. So all priorities are drawn in one batch, and
+# the songs of each priority are played in rounds: every song at the lowest repeat count once, in random order,
+# after which they join the songs at the next count. That gives each priority's whole play order from a few
+# shuffles instead of a bucket lookup per pick.
+
+
+class PrioritySimulation:
+    def __init__(self):
+        self.weight: int = 0
+        self.songs: typing.List[ml.SongInfo] = []
+        self.picks: int = 0
+        self.expected_share: float = 0.0  # of all picks, from the weights alone
+        self.share: float = 0.0
+        self.plays: typing.List[int] = []  # per song, in the order of songs
+        self.mean_gaps: typing.List[typing.Optional[float]] = []  # per song, picks between plays, None if played once
+        self.gap_percentiles: typing.Dict[int, int] = {}  # 50, 90 and 100 -> picks between plays of the same song
+        self.mean_gap: float = 0.0
+        self.fairness: float = 1.0  # Jain's index of the plays per song, 1.0 when every song played equally often
+
+    def get_relative_frequency(self, number_of_playlists: float) -> typing.Union[float, str]:
+        # Each song plays in 1 out of this many playlists, same meaning as calculate_relative_frequency
+        if not self.picks or not self.songs:
+            return '--'
+        return number_of_playlists * len(self.songs) / self.picks
+
+
+class RotationSimulation:
+    def __init__(self):
+        self.number_of_picks: int = 0
+        self.songs_in_playlist: int = 0
+        self.weights: typing.List[int] = []
+        self.priorities: typing.Dict[int, PrioritySimulation] = {}  # priorities that were picked from
+
+    def get_number_of_playlists(self) -> float:
+        return self.number_of_picks / self.songs_in_playlist if self.songs_in_playlist else 0.0
+
+    def get_gap_in_playlists(self, gap: float) -> float:
+        return gap / self.songs_in_playlist if self.songs_in_playlist else 0.0
+
+    def get_fairness(self) -> float:
+        # Jain's index over all songs that could be picked, of their plays relative to what the weights promise them
+        relative_plays = [song_plays * len(priority.songs) / (priority.expected_share * self.number_of_picks)
+                          for priority in self.priorities.values() for song_plays in priority.plays]
+        return get_jain_index(relative_plays)
+
+    def get_largest_share_error(self) -> float:
+        # How far the drawn priorities are from the weights, should shrink as the number of picks grows
+        return max((abs(priority.share - priority.expected_share) for priority in self.priorities.values()),
+                   default=0.0)
+
+
+def get_jain_index(values: typing.List[float]) -> float:
+    square_sum = sum(value * value for value in values)
+    if not square_sum:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * square_sum)
+
+
+def get_percentile(sorted_values: typing.List[int], percentile: int) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, len(sorted_values) * percentile // 100)]
+
+
+def get_play_order(repeats: typing.List[int], number_of_picks: int,
+                   rng: typing.Optional[random.Random] = None) -> typing.List[int]:
+    # Indexes of the songs in the order the least repeated first rule plays them
+    song_indexes = sorted(range(len(repeats)), key=repeats.__getitem__)
+    play_order: typing.List[int] = []
+    if not song_indexes:
+        return play_order
+    next_song = 0  # songs before this one in song_indexes have joined the rounds
+    level = repeats[song_indexes[0]]
+    round_songs: typing.List[int] = []
+    while len(play_order) < number_of_picks:
+        while next_song < len(song_indexes) and repeats[song_indexes[next_song]] <= level:
+            round_songs.append(song_indexes[next_song])
+            next_song += 1
+        (rng or random).shuffle(round_songs)
+        play_order.extend(round_songs[:number_of_picks - len(play_order)])
+        level += 1
+    return play_order
+
+
+def simulate_priority(priority_simulation: PrioritySimulation, repeats: typing.List[int],
+                      pick_positions: typing.List[int], rng: typing.Optional[random.Random] = None):
+    plays = [0] * len(repeats)
+    last_positions = [-1] * len(repeats)
+    gap_sums = [0] * len(repeats)
+    gaps: typing.List[int] = []
+    for position, song_index in zip(pick_positions, get_play_order(repeats, len(pick_positions), rng)):
+        last_position = last_positions[song_index]
+        if last_position >= 0:
+            gaps.append(position - last_position)
+            gap_sums[song_index] += position - last_position
+        last_positions[song_index] = position
+        plays[song_index] += 1
+
+    priority_simulation.plays = plays
+    priority_simulation.mean_gaps = [gap_sum / (song_plays - 1) if song_plays > 1 else None
+                                     for gap_sum, song_plays in zip(gap_sums, plays)]
+    gaps.sort()
+    priority_simulation.gap_percentiles = {percentile: get_percentile(gaps, percentile) for percentile in (50, 90, 100)}
+    priority_simulation.mean_gap = sum(gaps) / len(gaps) if gaps else 0.0
+    priority_simulation.fairness = get_jain_index(plays)
+
+
+def simulate_rotation(library: ml.MusicLibrary, number_of_picks: int, songs_in_playlist: int,
+                      weights: typing.Optional[typing.List[int]] = None,
+                      progress: typing.Optional[ml.Progress] = None,
+                      rng: typing.Optional[random.Random] = None) -> RotationSimulation:
+    # Starts from the library's current repeats, weights default to the library's. Only reads the songs,
+    # so it can run on a worker thread as long as nothing changes the library meanwhile. Give an rng from
+    # ml.create_rng to compare weights on the same draws.
+    rng = rng or random
+    simulation = RotationSimulation()
+    simulation.number_of_picks = number_of_picks
+    simulation.songs_in_playlist = songs_in_playlist
+    simulation.weights = list(library.weights if weights is None else weights)
+
+    songs_by_priority: typing.Dict[int, typing.List[ml.SongInfo]] = {}
+    for songs in library.categories.values():
+        for song in songs:
+            songs_by_priority.setdefault(song.priority, []).append(song)
+    valid_priorities = [priority for priority in range(ml.num_priorities)
+                        if simulation.weights[priority] > 0 and songs_by_priority.get(priority)]
+    if not valid_priorities or number_of_picks <= 0:
+        return simulation
+    if progress:
+        progress.total = len(valid_priorities) + 1
+
+    valid_weights = [simulation.weights[priority] for priority in valid_priorities]
+    pick_positions: typing.Dict[int, typing.List[int]] = {priority: [] for priority in valid_priorities}
+    for position, priority in enumerate(rng.choices(valid_priorities, valid_weights, k=number_of_picks)):
+        pick_positions[priority].append(position)
+    if progress:
+        progress.advance()
+
+    weight_sum = sum(valid_weights)
+    for priority in valid_priorities:
+        if progress:
+            progress.check_cancelled()
+        priority_simulation = PrioritySimulation()
+        priority_simulation.weight = simulation.weights[priority]
+        priority_simulation.songs = songs_by_priority[priority]
+        priority_simulation.picks = len(pick_positions[priority])
+        priority_simulation.expected_share = priority_simulation.weight / weight_sum
+        priority_simulation.share = priority_simulation.picks / number_of_picks
+        simulate_priority(priority_simulation, [song.number_of_repeats for song in priority_simulation.songs],
+                          pick_positions[priority], rng)
+        simulation.priorities[priority] = priority_simulation
+        if progress:
+            progress.advance()
+    return simulation
+
+
+def get_summary(simulation: RotationSimulation) -> typing.List[str]:
+    number_of_playlists = simulation.get_number_of_playlists()
+    lines = [f'{simulation.number_of_picks} picks, {number_of_playlists:.0f} playlists of '
+             f'{simulation.songs_in_playlist} songs',
+             '{:>8} {:>6} {:>7} {:>8} {:>9} {:>11} {:>11} {:>11} {:>11} {:>8}'.format(
+                 'Priority', 'Weight', 'Songs', 'Share', 'Expected', 'Plays/song', '1 in X', 'Gap p50', 'Gap max',
+                 'Fairness')]
+    for priority, priority_simulation in sorted(simulation.priorities.items()):
+        relative_frequency = priority_simulation.get_relative_frequency(number_of_playlists)
+        lines.append('{:>8} {:>6} {:>7} {:>7.2%} {:>8.2%} {:>11.2f} {:>11} {:>11.1f} {:>11.1f} {:>8.4f}'.format(
+            priority, priority_simulation.weight, len(priority_simulation.songs), priority_simulation.share,
+            priority_simulation.expected_share, priority_simulation.picks / len(priority_simulation.songs),
+            relative_frequency if relative_frequency == '--' else f'{relative_frequency:.2f}',
+            simulation.get_gap_in_playlists(priority_simulation.gap_percentiles[50]),
+            simulation.get_gap_in_playlists(priority_simulation.gap_percentiles[100]),
+            priority_simulation.fairness))
+    lines.append('Gaps are in playlists between plays of the same song. '
+                 f'Overall fairness {simulation.get_fairness():.4f}, '
+                 f'largest share error {simulation.get_largest_share_error():.2%}')
+    return lines
@@ -0,0 +1,331 @@
+import bisect
+import heapq
+import itertools
+import os
+import re
+import shlex
+import typing
+from array import array
+
+import MusicLibrary as ml
+
+# Finds songs by words of their artist and song names, optionally narrowed down to categories and ranges of
+# priorities and repeats:
+#   search_songs(library, parse_query('beat yell category:rock priority:3-5 repeats:0'))
+# Every word of the text matches any word starting with it, so results can be shown while typing. Results are
+# in the order the songs were indexed, see below, except for queries without text: those with categories are in
+# library order, those with only priority and repeat filters come from the picker index grouped by priority and
+# then number of repeats.
+#
+# The index maps every word to the numbers of the songs that contain it. Priorities and repeats are read from the
+# songs when filtering, so priority changes and picks need no index update. Names only change when a scan
+# replaces the category lists: replace_library_songs and update_search_index patch the index from the scan's
+# LibraryDiff, any other change to the lists has the index built again, like the picker index. Songs are numbered
+# in library order when the index is built, songs added by later updates are numbered after them.
+
+WORD_PATTERN = re.compile(r'\w+')
+QUERY_FILTERS = {'category': 'category', 'c': 'category', 'priority': 'priority', 'p': 'priority',
+                 'repeats': 'repeats', 'r': 'repeats'}
+# Songs of a word that can be intersected with the candidates of a query in the time it takes to check one
+# candidate's words, see SongSearchIndex.get_text_candidates
+WORD_CHECK_COST = 32
+
+
+def get_words(text: str) -> typing.List[str]:
+    return WORD_PATTERN.findall(text.casefold())
+
+
+def get_song_words(song: ml.SongInfo) -> typing.List[str]:
+    return get_words(f'{song.artist_name} {song.song_name}')
+
+
+class SongQuery:
+    def __init__(self):
+        self.text: str = ''
+        self.categories: typing.Optional[typing.List[str]] = None  # None for all categories
+        # Inclusive ranges, None for no limit
+        self.min_priority: typing.Optional[int] = None
+        self.max_priority: typing.Optional[int] = None
+        self.min_repeats: typing.Optional[int] = None
+        self.max_repeats: typing.Optional[int] = None
+
+    def has_filters(self) -> bool:
+        return (self.categories is not None or self.min_priority is not None or self.max_priority is not None or
+                self.min_repeats is not None or self.max_repeats is not None)
+
+
+def parse_range(value: str) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    # "3" is just 3, "3-5" is 3 to 5, "3-" is 3 or more and "-5" is up to 5
+    low, separator, high = value.partition('-')
+    if not separator:
+        return int(value), int(value)
+    return int(low) if low else None, int(high) if high else None
+
+
+def parse_query(query_text: str) -> SongQuery:
+    # Words like category:rock (c:), priority:3-5 (p:) and repeats:0-2 (r:) are filters, the rest is text.
+    # Category names with spaces go in quotes. Filters that don't parse, e.g. while still being typed, are ignored.
+    query = SongQuery()
+    try:
+        parts = shlex.split(query_text)
+    except ValueError:
+        parts = query_text.split()  # unfinished quote
+    text_parts = []
+    for part in parts:
+        name, separator, value = part.partition(':')
+        query_filter = QUERY_FILTERS.get(name.lower()) if separator else None
+        if query_filter is None:
+            text_parts.append(part)
+        elif query_filter == 'category':
+            if value:
+                query.categories = (query.categories or []) + [value]
+        else:
+            try:
+                low, high = parse_range(value)
+            except ValueError:
+                continue
+            if query_filter == 'priority':
+                query.min_priority, query.max_priority = low, high
+            else:
+                query.min_repeats, query.max_repeats = low, high
+    query.text = ' '.join(text_parts)
+    return query
+
+
+def remove_song_numbers(song_numbers: array, removed_numbers: typing.List[int]) -> array:
+    # Both ascending. Copied a slice at a time, as a word like "the" has much of the library in its postings.
+    kept_numbers = array('I')
+    start = 0
+    for song_number in removed_numbers:
+        position = bisect.bisect_left(song_numbers, song_number, start)
+        kept_numbers += song_numbers[start:position]
+        start = position + 1
+    kept_numbers += song_numbers[start:]
+    return kept_numbers
+
+
+class SongSearchIndex:
+    def __init__(self, library: ml.MusicLibrary):
+        self.library: ml.MusicLibrary = library
+        self.signature: typing.Tuple = ml.get_library_signature(library)
+        self.song_lists = list(library.categories.values())  # keeps the ids in the signature from being reused
+        self.songs: typing.List[typing.Optional[ml.SongInfo]] = []  # by song number, None once removed
+        self.removed_songs: int = 0
+        self.category_names: typing.List[str] = list(library.categories.keys())
+        self.song_categories = array('I')  # category number of each song
+
+        postings: typing.Dict[str, array] = {}
+        for category_number, songs in enumerate(library.categories.values()):
+            for song in songs:
+                self.add_song(postings, song, category_number)
+
+        # Sorted words, so the words starting with a prefix are one slice
+        self.words: typing.List[str] = sorted(postings.keys())
+        self.postings: typing.List[array] = [postings[word] for word in self.words]  # ascending song numbers
+        self.posting_offsets = array('Q')  # songs before each word's postings, to size a slice of words
+        self.update_posting_offsets()
+
+    def add_song(self, postings: typing.Dict[str, array], song: ml.SongInfo, category_number: int):
+        # Numbered after every song so far, which keeps each word's song numbers ascending
+        song_number = len(self.songs)
+        self.songs.append(song)
+        self.song_categories.append(category_number)
+        for word in dict.fromkeys(get_song_words(song)):
+            song_numbers = postings.get(word)
+            if song_numbers is None:
+                song_numbers = postings[word] = array('I')
+            song_numbers.append(song_number)
+
+    def update_posting_offsets(self):
+        self.posting_offsets = array('Q', itertools.accumulate(map(len, self.postings), initial=0))
+
+    def update(self, library: ml.MusicLibrary, diff: ml.LibraryDiff) -> bool:
+        # Takes the index over to the songs of library, whose merge with the indexed library gave diff. Carried
+        # over songs with the same file and names keep their numbers and only their song objects are swapped, the
+        # others are indexed as new songs and the songs that are gone are taken out of the postings. Only the
+        # words of changed songs are read, the rest is a pass over the songs and the word list. Returns False once
+        # most song numbers are of removed songs, when building the index again is the better deal.
+        numbers_by_path: typing.Dict[str, int] = {song.file_path: song_number for song_number, song in
+                                                  enumerate(self.songs) if song is not None}
+        kept_songs = bytearray(song is None for song in self.songs)  # removed ones count as kept, they stay removed
+        added_songs: typing.List[ml.SongInfo] = []
+        for song in diff.carried_over:
+            song_number = numbers_by_path.get(song.file_path)
+            old_song = self.songs[song_number] if song_number is not None else None
+            if old_song is None or old_song.artist_name != song.artist_name or old_song.song_name != song.song_name:
+                added_songs.append(song)  # moved, renamed or retagged
+                continue
+            kept_songs[song_number] = 1
+            self.songs[song_number] = song
+
+        postings: typing.Dict[str, array] = dict(zip(self.words, self.postings))
+        removed_words: typing.Dict[str, typing.List[int]] = {}  # ascending song numbers
+        song_number = kept_songs.find(0)
+        while song_number >= 0:
+            for word in dict.fromkeys(get_song_words(self.songs[song_number])):
+                removed_words.setdefault(word, []).append(song_number)
+            self.songs[song_number] = None
+            self.removed_songs += 1
+            song_number = kept_songs.find(0, song_number + 1)
+        words_gone = False
+        for word, removed_numbers in removed_words.items():
+            song_numbers = remove_song_numbers(postings[word], removed_numbers)
+            if song_numbers:
+                postings[word] = song_numbers
+            else:
+                del postings[word]
+                words_gone = True
+
+        added_songs.extend(diff.added)
+        known_words = len(postings)
+        if added_songs:
+            for category in library.categories.keys():
+                if category not in self.category_names:
+                    self.category_names.append(category)
+            category_numbers = {category: category_number
+                                for category_number, category in enumerate(self.category_names)}
+            # A scan puts every song's file under its category's directory
+            song_categories = [category_numbers.get(song.file_path.split(os.sep)[0]) for song in added_songs]
+            if None in song_categories:
+                added_ids = {id(song): song_number for song_number, song in enumerate(added_songs)}
+                for category, songs in library.categories.items():
+                    for song in songs:
+                        if id(song) in added_ids:
+                            song_categories[added_ids[id(song)]] = category_numbers[category]
+            for song, category_number in zip(added_songs, song_categories):
+                self.add_song(postings, song, category_number)
+
+        if words_gone:
+            self.words = [word for word in self.words if word in postings]
+        if len(postings) > known_words:
+            # Words new to the index come last in the dict. Sorting two sorted runs is a merge.
+            self.words += sorted(itertools.islice(postings.keys(), known_words, None))
+            self.words.sort()
+        self.postings = [postings[word] for word in self.words]
+        self.update_posting_offsets()
+
+        self.library = library
+        self.signature = ml.get_library_signature(library)
+        self.song_lists = list(library.categories.values())
+        return self.removed_songs * 2 <= len(self.songs)
+
+    def get_word_range(self, prefix: str) -> typing.Tuple[int, int]:
+        return bisect.bisect_left(self.words, prefix), bisect.bisect_left(self.words, prefix + '\U0010ffff')
+
+    def get_text_candidates(self, words: typing.List[str],
+                            limit: typing.Optional[int]) -> typing.Tuple[typing.Iterable[int], typing.List[str]]:
+        # Ascending song numbers matching the words, and the words still to check on each of those songs. Starting
+        # from the word with the fewest songs, the songs of the other words are intersected with the candidates
+        # while that's cheaper than checking the words of each candidate.
+        word_ranges = [self.get_word_range(word) for word in words]
+        sizes = [self.posting_offsets[end] - self.posting_offsets[start] for start, end in word_ranges]
+        word_order = sorted(range(len(words)), key=sizes.__getitem__)
+        start, end = word_ranges[word_order[0]]
+        if len(words) == 1:
+            if end - start == 1:
+                return self.postings[start], []
+            if limit is not None:
+                # Merged lazily, so a short word matching much of the library stops at the limit
+                return (song_number for song_number, _ in itertools.groupby(heapq.merge(*self.postings[start:end]))), []
+        candidates = set().union(*self.postings[start:end])
+        remaining_words: typing.List[str] = []
+        for word_number in word_order[1:]:
+            if sizes[word_number] > len(candidates) * WORD_CHECK_COST:
+                remaining_words.append(words[word_number])
+                continue
+            start, end = word_ranges[word_number]
+            matches: typing.Set[int] = set()
+            for song_numbers in self.postings[start:end]:
+                matches.update(candidates.intersection(song_numbers))
+            candidates = matches
+        return sorted(candidates), remaining_words
+
+    def search(self, query: SongQuery, limit: typing.Optional[int] = None) -> typing.List[ml.SongInfo]:
+        categories = query.categories
+        if categories is not None:
+            categories = [category for category in self.library.categories.keys() if category in categories]
+        min_priority = query.min_priority if query.min_priority is not None else 0
+        max_priority = query.max_priority if query.max_priority is not None else ml.num_priorities - 1
+        min_repeats = query.min_repeats if query.min_repeats is not None else 0
+        max_repeats = query.max_repeats
+
+        words = get_words(query.text)
+        remaining_words: typing.List[str] = []
+        if words:
+            candidates, remaining_words = self.get_text_candidates(words, limit)
+            if categories is not None:
+                category_numbers = {self.category_names.index(category) for category in categories}
+                song_categories = self.song_categories
+                candidates = (song_number for song_number in candidates
+                              if song_categories[song_number] in category_numbers)
+            candidate_songs = map(self.songs.__getitem__, candidates)
+        elif categories is not None:
+            candidate_songs = itertools.chain.from_iterable(self.library.categories[category]
+                                                            for category in categories)
+        elif query.has_filters():
+            return self.search_picker_index(min_priority, max_priority, min_repeats, max_repeats, limit)
+        else:
+            return []  # an empty query finds nothing rather than everything
+
+        check_priority = query.min_priority is not None or query.max_priority is not None
+        check_repeats = query.min_repeats is not None or query.max_repeats is not None
+        if not check_priority and not check_repeats and not remaining_words:
+            return list(itertools.islice(candidate_songs, limit))
+
+        results: typing.List[ml.SongInfo] = []
+        for song in candidate_songs:
+            if check_priority and not min_priority <= song.priority <= max_priority:
+                continue
+            if check_repeats:
+                number_of_repeats = song.number_of_repeats
+                if number_of_repeats < min_repeats or (max_repeats is not None and number_of_repeats > max_repeats):
+                    continue
+            if remaining_words:
+                song_words = get_song_words(song)
+                if not all(any(song_word.startswith(word) for song_word in song_words) for word in remaining_words):
+                    continue
+            results.append(song)
+            if len(results) == limit:
+                break
+        return results
+
+    def search_picker_index(self, min_priority: int, max_priority: int, min_repeats: int,
+                            max_repeats: typing.Optional[int], limit: typing.Optional[int]) -> typing.List[ml.SongInfo]:
+        results: typing.List[ml.SongInfo] = []
+        index = ml.get_picker_index(self.library)
+        for priority in range(max(0, min_priority), max_priority + 1):
+            repeat_buckets = index.buckets.get(priority, {})
+            for number_of_repeats in sorted(repeat_buckets.keys()):
+                if number_of_repeats < min_repeats or (max_repeats is not None and number_of_repeats > max_repeats):
+                    continue
+                bucket = repeat_buckets[number_of_repeats]
+                results.extend(map(index.get_song, bucket[:limit - len(results)] if limit is not None else bucket))
+                if limit is not None and len(results) >= limit:
+                    return results[:limit]
+        return results
+
+
+def has_current_search_index(library: ml.MusicLibrary) -> bool:
+    return library.search_index is not None and library.search_index.signature == ml.get_library_signature(library)
+
+
+def get_search_index(library: ml.MusicLibrary) -> SongSearchIndex:
+    if not has_current_search_index(library):
+        library.search_index = SongSearchIndex(library)
+    return library.search_index
+
+
+def update_search_index(old_library: ml.MusicLibrary, library: ml.MusicLibrary, diff: ml.LibraryDiff):
+    # Moves a current index of old_library over to library, which merge_library(old_library, library) gave diff,
+    # instead of indexing library from scratch
+    search_index = old_library.search_index
+    if search_index is None or search_index.signature != ml.get_library_signature(old_library):
+        return
+    old_library.search_index = None
+    if search_index.update(library, diff):
+        library.search_index = search_index
+
+
+def search_songs(library: ml.MusicLibrary, query: SongQuery,
+                 limit: typing.Optional[int] = None) -> typing.List[ml.SongInfo]:
+    return get_search_index(library).search(query, limit)
@@ -0,0 +1,206 @@
+import collections
+import collections.abc
+import typing
+from array import array
+
+import MusicLibrary as ml
+
+
+# Column oriented storage for the songs of a library. Strings are kept once in a string table and songs refer
+# to them by id, priorities, repeats and durations are kept in typed arrays, and the songs of each category are a contiguous
+# range of rows given by category_offsets.
+class SongStore:
+    def __init__(self):
+        self.strings: typing.List[str] = []
+        self.string_ids: typing.Dict[str, int] = {}
+        self.artist_name_ids: array = array('l')
+        self.song_name_ids: array = array('l')
+        self.file_path_ids: array = array('l')
+        self.priorities: array = array('l')
+        self.repeats: array = array('l')
+        self.durations: array = array('d')
+        self.category_names: typing.List[str] = []
+        self.category_offsets: array = array('q', [0])
+        self.views: typing.Dict[int, 'SongView'] = {}  # row -> view, for the rows that were looked at
+        # Index that buckets rows of this store by their number rather than by view, see PickerIndex
+        self.picker_index: typing.Optional[ml.PickerIndex] = None
+        self.version: int = 0  # bumped on every change of a priority or number of repeats
+
+    def __len__(self) -> int:
+        return len(self.priorities)
+
+    def intern_string(self, string: str) -> int:
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def append_song(self, artist_name: str, song_name: str, file_path: str, priority: int, number_of_repeats: int,
+                    duration: float = 0.0):
+        # Songs must be appended category by category, followed by end_category
+        self.artist_name_ids.append(self.intern_string(artist_name))
+        self.song_name_ids.append(self.intern_string(song_name))
+        self.file_path_ids.append(self.intern_string(file_path))
+        self.priorities.append(priority)
+        self.repeats.append(number_of_repeats)
+        self.durations.append(duration)
+
+    def end_category(self, category: str):
+        self.category_names.append(category)
+        self.category_offsets.append(len(self.priorities))
+
+    def get_category_rows(self, category_number: int) -> range:
+        return range(self.category_offsets[category_number], self.category_offsets[category_number + 1])
+
+    def get_view(self, row: int) -> 'SongView':
+        # One view per row, so ids of views stay the same for as long as the store lives
+        view = self.views.get(row)
+        if view is None:
+            view = SongView(self, row)
+            self.views[row] = view
+        return view
+
+    def get_repeat_counts(self, rows: range) -> typing.Counter[typing.Tuple[int, int]]:
+        # Number of songs by priority and number of repeats, counted in one C level pass over the columns
+        return collections.Counter(zip(self.priorities[rows.start:rows.stop], self.repeats[rows.start:rows.stop]))
+
+    def get_priority_counts(self, rows: range) -> typing.List[int]:
+        counts = [0 for i in range(ml.num_priorities)]
+        for (priority, number_of_repeats), count in self.get_repeat_counts(rows).items():
+            counts[priority] += count
+        return counts
+
+    def get_min_repeats(self, rows: range) -> typing.List[typing.Optional[int]]:
+        min_repeats: typing.List[typing.Optional[int]] = [None for i in range(ml.num_priorities)]
+        for priority, number_of_repeats in self.get_repeat_counts(rows).keys():
+            if min_repeats[priority] is None or number_of_repeats < min_repeats[priority]:
+                min_repeats[priority] = number_of_repeats
+        return min_repeats
+
+
+# Stands in for SongInfo, reading and writing one row of a SongStore. A view is tracked by a picker index either
+# itself, like a SongInfo, or through its row, when the store's picker index bucketed its rows.
+class SongView:
+    __slots__ = ('store', 'row', '_picker_index', '_picker_slot')
+
+    def __init__(self, store: SongStore, row: int):
+        self.store: SongStore = store
+        self.row: int = row
+        self._picker_index: typing.Optional[ml.PickerIndex] = None
+        self._picker_slot: int = 0
+
+    @property
+    def artist_name(self) -> str:
+        return self.store.strings[self.store.artist_name_ids[self.row]]
+
+    @artist_name.setter
+    def artist_name(self, artist_name: str):
+        self.store.artist_name_ids[self.row] = self.store.intern_string(artist_name)
+
+    @property
+    def song_name(self) -> str:
+        return self.store.strings[self.store.song_name_ids[self.row]]
+
+    @song_name.setter
+    def song_name(self, song_name: str):
+        self.store.song_name_ids[self.row] = self.store.intern_string(song_name)
+
+    @property
+    def file_path(self) -> str:
+        return self.store.strings[self.store.file_path_ids[self.row]]
+
+    @file_path.setter
+    def file_path(self, file_path: str):
+        self.store.file_path_ids[self.row] = self.store.intern_string(file_path)
+
+    @property
+    def duration(self) -> float:
+        return self.store.durations[self.row]
+
+    @duration.setter
+    def duration(self, duration: float):
+        self.store.durations[self.row] = duration
+
+    @property
+    def priority(self) -> int:
+        return self.store.priorities[self.row]
+
+    @priority.setter
+    def priority(self, priority: int):
+        if priority != self.priority:
+            self.move_in_picker_index(priority, self.number_of_repeats)
+        self.store.priorities[self.row] = priority
+        self.store.version += 1
+
+    @property
+    def number_of_repeats(self) -> int:
+        return self.store.repeats[self.row]
+
+    @number_of_repeats.setter
+    def number_of_repeats(self, number_of_repeats: int):
+        if number_of_repeats != self.number_of_repeats:
+            self.move_in_picker_index(self.priority, number_of_repeats)
+        self.store.repeats[self.row] = number_of_repeats
+        self.store.version += 1
+
+    def move_in_picker_index(self, priority: int, number_of_repeats: int):
+        if self._picker_index is not None:
+            self._picker_index.move_song(self, priority, number_of_repeats)
+        elif self.store.picker_index is not None and self.store.picker_index.has_row(self.row):
+            self.store.picker_index.move_row(self, priority, number_of_repeats)
+
+
+def create_store(library: ml.MusicLibrary) -> SongStore:
+    store = SongStore()
+    for category, songs in library.categories.items():
+        if isinstance(songs, SongViewList):
+            # Copied from the columns, the rows don't need views
+            source, strings = songs.store, songs.store.strings
+            for row in songs.rows:
+                store.append_song(strings[source.artist_name_ids[row]], strings[source.song_name_ids[row]],
+                                  strings[source.file_path_ids[row]], source.priorities[row], source.repeats[row],
+                                  source.durations[row])
+        else:
+            for song in songs:
+                store.append_song(song.artist_name, song.song_name, song.file_path, song.priority,
+                                  song.number_of_repeats, song.duration)
+        store.end_category(category)
+    return store
+
+
+# Read only list of the SongViews of a category, creating each view the first time it is used, so only the songs
+# actually looked at become python objects
+class SongViewList(collections.abc.Sequence):
+    def __init__(self, store: SongStore, rows: range):
+        self.store: SongStore = store
+        self.rows: range = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.rows)))]
+        return self.store.get_view(self.rows[index])
+
+    def __iter__(self) -> typing.Iterator[SongView]:
+        for index in range(len(self.rows)):
+            yield self[index]
+
+
+def create_library_from_store(store: SongStore) -> ml.MusicLibrary:
+    # The songs of the returned library are views, so changes to them are written straight into the store
+    library = ml.MusicLibrary()
+    for category_number, category in enumerate(store.category_names):
+        library.categories[category] = SongViewList(store, store.get_category_rows(category_number))
+    return library
+
+
+def get_compact_library(library: ml.MusicLibrary) -> typing.Tuple[ml.MusicLibrary, SongStore]:
+    store = create_store(library)
+    compact_library = create_library_from_store(store)
+    compact_library.weights = library.weights
+    compact_library.scan_snapshot = library.scan_snapshot
+    return compact_library, store
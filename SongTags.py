@@ -0,0 +1,263 @@
+import struct
+import typing
+
+# Reads artist, title and duration from mp3 files without any third party libraries. Tags come from an ID3v2
+# tag at the start of the file (versions 2.2 to 2.4), or an ID3v1 tag at the end. The duration comes from the
+# TLEN frame, the Xing/Info or VBRI header of variable bitrate files, or else the bitrate of the first frame.
+# Anything that can't be read is left empty, callers fall back to the file name.
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_SIZE = 128
+FRAME_SEARCH_SIZE = 64 * 1024  # how far past the tag to look for the first mpeg frame
+
+ARTIST_FRAMES = (b'TPE1', b'TP1')
+TITLE_FRAMES = (b'TIT2', b'TT2')
+LENGTH_FRAMES = (b'TLEN', b'TLE')
+
+# kbit/s by [mpeg 1 or not][layer][bitrate index]
+BITRATES = {
+    True: {1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+           2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+           3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]},
+    False: {1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+            2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+            3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]},
+}
+SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}  # by version bits
+
+
+class SongTags:
+    def __init__(self):
+        self.artist_name: str = ''
+        self.song_name: str = ''
+        self.duration: float = 0.0  # seconds, 0 when unknown
+
+
+class MpegFrame:
+    def __init__(self):
+        self.is_mpeg1: bool = True
+        self.layer: int = 3
+        self.bitrate: int = 0  # kbit/s
+        self.sample_rate: int = 0
+        self.is_mono: bool = False
+        self.length: int = 0  # bytes, header included
+
+    def get_samples(self) -> int:
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and not self.is_mpeg1:
+            return 576
+        return 1152
+
+
+def get_syncsafe_int(data: bytes) -> int:
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+    return value
+
+
+def remove_unsynchronisation(data: bytes) -> bytes:
+    return data.replace(b'\xff\x00', b'\xff')
+
+
+def decode_text_frame(data: bytes) -> str:
+    if not data:
+        return ''
+    encoding, text = data[0], data[1:]
+    if encoding == 1:
+        text = text.decode('utf-16', 'replace')
+    elif encoding == 2:
+        text = text.decode('utf-16-be', 'replace')
+    elif encoding == 3:
+        text = text.decode('utf-8', 'replace')
+    else:
+        text = text.decode('latin-1')
+    # ID3v2.4 separates multiple values with nulls, only the first one is used
+    return text.split('\x00')[0].strip()
+
+
+def decode_id3v1_field(data: bytes) -> str:
+    return data.split(b'\x00')[0].decode('latin-1').strip()
+
+
+def read_id3v2_frames(file: typing.BinaryIO,
+                      wanted_frames: typing.Collection[bytes]) -> typing.Tuple[typing.Dict[bytes, bytes], int]:
+    # Returns the wanted frames found and the size of the tag, 0 if there is none. Other frames, like
+    # embedded pictures, are skipped over without being read.
+    header = file.read(ID3V2_HEADER_SIZE)
+    if len(header) < ID3V2_HEADER_SIZE or header[:3] != b'ID3':
+        return {}, 0
+    major_version, flags = header[3], header[5]
+    tag_size = get_syncsafe_int(header[6:10])
+    total_size = ID3V2_HEADER_SIZE + tag_size + (ID3V2_HEADER_SIZE if flags & 0x10 else 0)
+    if major_version not in (2, 3, 4):
+        return {}, total_size
+
+    if flags & 0x80 and major_version < 4:
+        # The whole tag is unsynchronised, so frame sizes only make sense after undoing it
+        tag_data = remove_unsynchronisation(file.read(tag_size))
+        position = 0
+
+        def read(size: int) -> bytes:
+            nonlocal position
+            data = tag_data[position:position + size]
+            position += size
+            return data
+
+        def tell() -> int:
+            return position
+
+        def skip(size: int):
+            nonlocal position
+            position += size
+        tag_end = len(tag_data)
+    else:
+        read, tell = file.read, file.tell
+
+        def skip(size: int):
+            file.seek(size, 1)
+        tag_end = file.tell() + tag_size
+
+    if flags & 0x40 and major_version >= 3:
+        extended_header_size = read(4)
+        if len(extended_header_size) < 4:
+            return {}, total_size
+        if major_version == 4:
+            skip(get_syncsafe_int(extended_header_size) - 4)
+        else:
+            skip(struct.unpack('>I', extended_header_size)[0])
+
+    frame_header_size = 6 if major_version == 2 else 10
+    frames: typing.Dict[bytes, bytes] = {}
+    while tell() + frame_header_size <= tag_end and len(frames) < len(wanted_frames):
+        frame_header = read(frame_header_size)
+        if len(frame_header) < frame_header_size or frame_header[0] == 0:
+            break  # padding
+        if major_version == 2:
+            frame_id, frame_size, frame_flags = frame_header[:3], int.from_bytes(frame_header[3:6], 'big'), 0
+        elif major_version == 3:
+            frame_id, frame_size = frame_header[:4], struct.unpack('>I', frame_header[4:8])[0]
+            frame_flags = struct.unpack('>H', frame_header[8:10])[0]
+        else:
+            frame_id, frame_size = frame_header[:4], get_syncsafe_int(frame_header[4:8])
+            frame_flags = struct.unpack('>H', frame_header[8:10])[0]
+        if tell() + frame_size > tag_end:
+            break
+
+        if frame_id not in wanted_frames:
+            skip(frame_size)
+            continue
+        data = read(frame_size)
+        if major_version == 3:
+            if frame_flags & 0x00c0:
+                continue  # compressed or encrypted
+        elif major_version == 4:
+            if frame_flags & 0x000c:
+                continue
+            if frame_flags & 0x0002:
+                data = remove_unsynchronisation(data)
+            if frame_flags & 0x0001:
+                data = data[4:]  # data length indicator
+        frames[frame_id] = data
+    return frames, total_size
+
+
+def parse_mpeg_frame_header(header: bytes) -> typing.Optional[MpegFrame]:
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version_bits = (header[1] >> 3) & 3
+    layer_bits = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    frame = MpegFrame()
+    frame.is_mpeg1 = version_bits == 3
+    frame.layer = 4 - layer_bits
+    frame.bitrate = BITRATES[frame.is_mpeg1][frame.layer][bitrate_index]
+    frame.sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+    frame.is_mono = header[3] >> 6 == 3
+    padding = (header[2] >> 1) & 1
+    if frame.layer == 1:
+        frame.length = (12 * frame.bitrate * 1000 // frame.sample_rate + padding) * 4
+    elif frame.layer == 3 and not frame.is_mpeg1:
+        frame.length = 72 * frame.bitrate * 1000 // frame.sample_rate + padding
+    else:
+        frame.length = 144 * frame.bitrate * 1000 // frame.sample_rate + padding
+    return frame
+
+
+def find_first_mpeg_frame(data: bytes) -> typing.Tuple[typing.Optional[MpegFrame], int]:
+    # A frame only counts if another one follows right after it, stray 0xff bytes are common in junk data
+    position = data.find(b'\xff')
+    while 0 <= position <= len(data) - 4:
+        frame = parse_mpeg_frame_header(data[position:position + 4])
+        if frame:
+            next_position = position + frame.length
+            if next_position + 4 > len(data) or parse_mpeg_frame_header(data[next_position:next_position + 4]):
+                return frame, position
+        position = data.find(b'\xff', position + 1)
+    return None, -1
+
+
+def get_vbr_frame_count(frame: MpegFrame, frame_data: bytes) -> typing.Optional[int]:
+    # Number of frames from a Xing/Info header, which follows the side information, or a VBRI header
+    if frame.is_mpeg1:
+        xing_offset = 4 + (17 if frame.is_mono else 32)
+    else:
+        xing_offset = 4 + (9 if frame.is_mono else 17)
+    if frame_data[xing_offset:xing_offset + 4] in (b'Xing', b'Info') and len(frame_data) >= xing_offset + 12:
+        flags = struct.unpack('>I', frame_data[xing_offset + 4:xing_offset + 8])[0]
+        if flags & 1:
+            return struct.unpack('>I', frame_data[xing_offset + 8:xing_offset + 12])[0]
+    if frame_data[36:40] == b'VBRI' and len(frame_data) >= 54:
+        return struct.unpack('>I', frame_data[50:54])[0]
+    return None
+
+
+def read_tags(file_path: str) -> SongTags:
+    song_tags = SongTags()
+    try:
+        with open(file_path, 'rb') as file:
+            file_size = file.seek(0, 2)
+            file.seek(0)
+            frames, audio_start = read_id3v2_frames(file, ARTIST_FRAMES + TITLE_FRAMES + LENGTH_FRAMES)
+            for frame_id, data in frames.items():
+                text = decode_text_frame(data)
+                if frame_id in ARTIST_FRAMES:
+                    song_tags.artist_name = text
+                elif frame_id in TITLE_FRAMES:
+                    song_tags.song_name = text
+                elif text.isdigit():
+                    song_tags.duration = int(text) / 1000
+
+            has_id3v1 = False
+            if file_size >= audio_start + ID3V1_SIZE:
+                file.seek(file_size - ID3V1_SIZE)
+                id3v1 = file.read(ID3V1_SIZE)
+                has_id3v1 = id3v1[:3] == b'TAG'
+                if has_id3v1:
+                    song_tags.song_name = song_tags.song_name or decode_id3v1_field(id3v1[3:33])
+                    song_tags.artist_name = song_tags.artist_name or decode_id3v1_field(id3v1[33:63])
+
+            if not song_tags.duration:
+                file.seek(audio_start)
+                data = file.read(FRAME_SEARCH_SIZE)
+                frame, position = find_first_mpeg_frame(data)
+                if frame:
+                    frame_count = get_vbr_frame_count(frame, data[position:position + frame.length])
+                    if frame_count:
+                        song_tags.duration = frame_count * frame.get_samples() / frame.sample_rate
+                    else:
+                        audio_size = file_size - audio_start - position - (ID3V1_SIZE if has_id3v1 else 0)
+                        song_tags.duration = max(0, audio_size) * 8 / (frame.bitrate * 1000)
+    except (OSError, ValueError, struct.error):
+        return SongTags()
+    return song_tags
+
+
+def read_tags_of_files(file_paths: typing.List[str]) -> typing.List[SongTags]:
+    # Unit of work for a process pool, a list of files at a time keeps the cost of passing results around low
+    return [read_tags(file_path) for file_path in file_paths]
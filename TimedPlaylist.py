@@ -0,0 +1,168 @@
+import bisect
+import random
+import typing
+from itertools import chain
+
+import MusicLibrary as ml
+
+# Playlists that fill a running time instead of a number of songs, e.g. a week of hourly slots:
+#   builder = TimedPlaylistBuilder(library)
+#   playlists = [builder.generate_playlist(3600, 30) for hour in range(7 * 24)]
+# Priorities are drawn by weight and the least repeated songs of a priority go first, same as
+# ml.pick_random_song_from_library, but only among the songs that fit. A song fits if it is short enough and
+# either finishes the playlist or leaves room for at least the shortest song, so the playlist doesn't end up
+# with a gap nothing can fill. Songs without a known duration are never picked.
+
+
+# Songs of one priority and number of repeats, sorted by duration so the songs that fit are at most two runs
+class DurationBucket:
+    def __init__(self):
+        self.durations: typing.List[float] = []
+        self.songs: typing.List[ml.SongInfo] = []
+
+    def add_song(self, song: ml.SongInfo):
+        position = bisect.bisect_right(self.durations, song.duration)
+        self.durations.insert(position, song.duration)
+        self.songs.insert(position, song)
+
+    def remove_song(self, song: ml.SongInfo):
+        position = bisect.bisect_left(self.durations, song.duration)
+        while self.songs[position] is not song:
+            position += 1
+        del self.durations[position]
+        del self.songs[position]
+
+    def get_fitting_runs(self, max_continue: float, min_finish: float,
+                         max_finish: float) -> typing.Tuple[int, int, int]:
+        # Songs [0, continue_end) leave room for more songs, songs [finish_start, finish_end) finish the playlist
+        continue_end = bisect.bisect_right(self.durations, max_continue)
+        finish_start = max(continue_end, bisect.bisect_left(self.durations, min_finish))
+        finish_end = max(finish_start, bisect.bisect_right(self.durations, max_finish))
+        return continue_end, finish_start, finish_end
+
+
+class TimedPlaylistBuilder:
+    def __init__(self, library: ml.MusicLibrary, rng: typing.Optional[random.Random] = None):
+        self.library: ml.MusicLibrary = library
+        self.rng = rng or random  # the random module unless given a generator, e.g. from ml.create_rng
+        # priority -> number of repeats -> songs by duration, built from the picker index
+        self.buckets: typing.Dict[int, typing.Dict[int, DurationBucket]] = {}
+        self.picker_index: typing.Optional[ml.PickerIndex] = None
+        self.picker_index_version: int = -1
+        self.min_duration: float = 0.0
+
+    def update_index(self):
+        # Picks made elsewhere and priority changes show up as a new picker index version, the index is
+        # then rebuilt. Repeats changed by this builder are applied to both as they happen.
+        picker_index = ml.get_picker_index(self.library)
+        if picker_index is self.picker_index and picker_index.version == self.picker_index_version:
+            return
+        self.buckets = {}
+        for priority, repeat_buckets in picker_index.buckets.items():
+            for number_of_repeats, songs in repeat_buckets.items():
+                timed_songs = sorted((song for song in map(picker_index.get_song, songs) if song.duration > 0),
+                                     key=lambda song: song.duration)
+                if timed_songs:
+                    bucket = self.buckets.setdefault(priority, {}).setdefault(number_of_repeats, DurationBucket())
+                    bucket.durations = [song.duration for song in timed_songs]
+                    bucket.songs = timed_songs
+        self.min_duration = min((bucket.durations[0] for repeat_buckets in self.buckets.values()
+                                 for bucket in repeat_buckets.values()), default=0.0)
+        self.picker_index = picker_index
+        self.picker_index_version = picker_index.version
+
+    def has_fitting_song(self, priority: int, max_continue: float, min_finish: float, max_finish: float) -> bool:
+        for bucket in self.buckets.get(priority, {}).values():
+            continue_end, finish_start, finish_end = bucket.get_fitting_runs(max_continue, min_finish, max_finish)
+            if continue_end or finish_end > finish_start:
+                return True
+        return False
+
+    def choose_song(self, priority: int, max_continue: float, min_finish: float, max_finish: float,
+                    excluded_songs: typing.Set[int]) -> typing.Optional[ml.SongInfo]:
+        # Least repeated first among the songs that fit, excluded_songs holds id()s of songs already in the playlist
+        repeat_buckets = self.buckets.get(priority, {})
+        for number_of_repeats in sorted(repeat_buckets.keys()):
+            bucket = repeat_buckets[number_of_repeats]
+            continue_end, finish_start, finish_end = bucket.get_fitting_runs(max_continue, min_finish, max_finish)
+            fitting_songs = continue_end + finish_end - finish_start
+            if not fitting_songs:
+                continue
+            for _ in range(8):
+                position = self.rng.randrange(fitting_songs)
+                song = bucket.songs[position if position < continue_end else finish_start + position - continue_end]
+                if id(song) not in excluded_songs:
+                    return song
+            available_songs = [song for song in chain(bucket.songs[:continue_end],
+                                                      bucket.songs[finish_start:finish_end])
+                               if id(song) not in excluded_songs]
+            if available_songs:
+                return self.rng.choice(available_songs)
+        return None
+
+    def add_repeat(self, song: ml.SongInfo):
+        repeat_buckets = self.buckets[song.priority]
+        repeat_buckets[song.number_of_repeats].remove_song(song)
+        if not repeat_buckets[song.number_of_repeats].songs:
+            del repeat_buckets[song.number_of_repeats]
+        repeat_buckets.setdefault(song.number_of_repeats + 1, DurationBucket()).add_song(song)
+        song.number_of_repeats += 1
+        self.picker_index_version = self.picker_index.version
+
+    def generate_playlist(self, target_seconds: float, tolerance_seconds: float,
+                          allow_duplicates: bool = False) -> typing.List[ml.SongInfo]:
+        # Adds songs until the running time is within tolerance_seconds of target_seconds, never going over
+        # target_seconds + tolerance_seconds. If no song leaves room for another one, songs that merely fit
+        # are used, and the playlist stops short if not even those are left.
+        self.update_index()
+        valid_priorities = [priority for priority in ml.get_valid_priorities(self.library) if priority in self.buckets]
+        candidate_priorities = valid_priorities
+        look_ahead = True
+        playlist: typing.List[ml.SongInfo] = []
+        playlist_song_ids: typing.Set[int] = set()
+        total_seconds = 0.0
+        while candidate_priorities and total_seconds < target_seconds - tolerance_seconds:
+            min_finish = target_seconds - tolerance_seconds - total_seconds
+            max_finish = target_seconds + tolerance_seconds - total_seconds
+            max_continue = max_finish - self.min_duration if look_ahead else max_finish
+            priority = self.rng.choices(candidate_priorities,
+                                        [self.library.weights[p] for p in candidate_priorities])[0]
+            song = self.choose_song(priority, max_continue, min_finish, max_finish,
+                                    set() if allow_duplicates else playlist_song_ids)
+            if song is None:
+                # Redraw among the priorities that still have a song that fits, same as generate_playlist does
+                # for priorities that ran out of songs
+                candidate_priorities = [candidate_priority for candidate_priority in candidate_priorities
+                                        if candidate_priority != priority and
+                                        self.has_fitting_song(candidate_priority, max_continue, min_finish, max_finish)]
+                if not candidate_priorities and look_ahead:
+                    look_ahead = False
+                    candidate_priorities = valid_priorities
+                continue
+            self.add_repeat(song)
+            playlist.append(song)
+            playlist_song_ids.add(id(song))
+            total_seconds += song.duration
+            candidate_priorities = valid_priorities
+            look_ahead = True
+        return playlist
+
+
+def get_playlist_duration(playlist: typing.Iterable[ml.SongInfo]) -> float:
+    return sum(song.duration for song in playlist)
+
+
+def generate_timed_playlist(library: ml.MusicLibrary, target_seconds: float, tolerance_seconds: float,
+                            allow_duplicates: bool = False,
+                            rng: typing.Optional[random.Random] = None) -> typing.List[ml.SongInfo]:
+    return TimedPlaylistBuilder(library, rng).generate_playlist(target_seconds, tolerance_seconds, allow_duplicates)
+
+
+def generate_timed_playlists(library: ml.MusicLibrary, number_of_playlists: int, target_seconds: float,
+                             tolerance_seconds: float,
+                             allow_duplicates: bool = False,
+                             rng: typing.Optional[random.Random] = None) -> typing.List[typing.List[ml.SongInfo]]:
+    # One index for all playlists, rather than sorting the library again for each of them
+    builder = TimedPlaylistBuilder(library, rng)
+    return [builder.generate_playlist(target_seconds, tolerance_seconds, allow_duplicates)
+            for _ in range(number_of_playlists)]
@@ -0,0 +1,231 @@
+import tkinter as tk
+import tkinter.font as tkfont
+import typing
+
+
+def get_index_runs(indexes: typing.Iterable[int]) -> typing.List[typing.Tuple[int, int]]:
+    # Sorted indexes grouped into (first, last) runs of consecutive indexes
+    runs = []
+    for index in indexes:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1] = (runs[-1][0], index)
+        else:
+            runs.append((index, index))
+    return runs
+
+
+# Listbox over a sequence of items that only holds the rows currently in view, so showing or refreshing
+# a list of any length costs the same. Rows are formatted from the items when they scroll into view.
+# Selection is kept per item (extended mode: click, shift click, control click and drag, and the arrow, page,
+# home and end keys, with shift to extend) and survives refreshes.
+class VirtualListbox(tk.Frame):
+    def __init__(self, master, **listbox_options):
+        tk.Frame.__init__(self, master)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.items: typing.Sequence[typing.Any] = []
+        self.format_item: typing.Callable[[typing.Any], str] = str
+        self.first_row: int = 0  # item shown at the top of the listbox
+        self.visible_rows: int = 1
+        self.selected: typing.Set[int] = set()
+        self.anchor: typing.Optional[int] = None
+        self.cursor: typing.Optional[int] = None  # item the keys move from, the last one clicked or moved to
+        self.width: int = 0
+
+        self.y_scroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.y_scroll.grid(row=0, column=1, sticky='NS')
+        self.x_scroll = tk.Scrollbar(self, orient=tk.HORIZONTAL)
+        self.x_scroll.grid(row=1, column=0, sticky='WE')
+        self.listbox = tk.Listbox(self, xscrollcommand=self.x_scroll.set, selectmode=tk.EXTENDED,
+                                  exportselection=False, activestyle='none', **listbox_options)
+        self.listbox.grid(row=0, column=0, sticky='NSEW')
+        self.x_scroll.config(command=self.listbox.xview)
+
+        font = tkfont.nametofont(self.listbox.cget('font'))
+        self.row_height: int = font.metrics('linespace') + 2 * int(self.listbox.cget('selectborderwidth')) + 1
+
+        # The Listbox class bindings select rows of the listbox, not items, so none of them are used
+        self.listbox.bindtags(tuple(tag for tag in self.listbox.bindtags() if tag != 'Listbox'))
+        self.listbox.bind('<Configure>', self.on_configure)
+        self.listbox.bind('<Button-1>', self.on_click)
+        self.listbox.bind('<Shift-Button-1>', self.on_shift_click)
+        self.listbox.bind('<Control-Button-1>', self.on_control_click)
+        self.listbox.bind('<B1-Motion>', self.on_drag)
+        self.listbox.bind('<Control-a>', self.on_select_all)
+        for key, get_index in (('Up', lambda index: index - 1), ('Down', lambda index: index + 1),
+                               ('Prior', lambda index: index - self.visible_rows),
+                               ('Next', lambda index: index + self.visible_rows),
+                               ('Home', lambda index: 0), ('End', lambda index: len(self.items) - 1)):
+            self.listbox.bind(f'<{key}>', lambda event, get_index=get_index: self.move_cursor(get_index, False))
+            self.listbox.bind(f'<Shift-{key}>', lambda event, get_index=get_index: self.move_cursor(get_index, True))
+        self.listbox.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.listbox.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.listbox.bind('<Button-5>', lambda event: self.scroll(3))
+
+    def set_items(self, items: typing.Sequence[typing.Any], format_item: typing.Callable[[typing.Any], str]):
+        # Shows a new list from the top with nothing selected
+        self.items = items
+        self.format_item = format_item
+        self.first_row = 0
+        self.selected = set()
+        self.anchor = self.cursor = None
+        self.width = 0
+        self.refresh()
+
+    def refresh(self):
+        # Formats the rows in view again, for when any item may have changed
+        self.first_row = max(0, min(self.first_row, len(self.items) - self.visible_rows))
+        last_row = min(len(self.items), self.first_row + self.visible_rows)
+        self.listbox.delete(0, tk.END)
+        self.insert_rows(self.first_row, last_row - 1)
+        self.update_scrollbar()
+        self.measure_row_height()
+
+    def measure_row_height(self):
+        # The font based estimate can be a pixel or two off, once two rows are shown their distance is exact
+        first_row_box, second_row_box = self.listbox.bbox(0), self.listbox.bbox(1)
+        if not first_row_box or not second_row_box or second_row_box[1] - first_row_box[1] == self.row_height:
+            return
+        self.row_height = max(1, second_row_box[1] - first_row_box[1])
+        visible_rows = max(1, self.listbox.winfo_height() // self.row_height)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.refresh()
+
+    def refresh_rows(self, indexes: typing.Iterable[int]):
+        # Formats the given items again if they are in view
+        last_row = min(len(self.items), self.first_row + self.visible_rows) - 1
+        visible_indexes = [index for index in sorted(indexes) if self.first_row <= index <= last_row]
+        for first_index, last_index in get_index_runs(visible_indexes):
+            self.listbox.delete(first_index - self.first_row, last_index - self.first_row)
+            self.insert_rows(first_index, last_index)
+
+    def insert_rows(self, first_index: int, last_index: int):
+        if last_index < first_index:
+            return
+        rows = [self.format_item(self.items[index]) for index in range(first_index, last_index + 1)]
+        self.listbox.insert(first_index - self.first_row, *rows)
+        for index in range(first_index, last_index + 1):
+            if index in self.selected:
+                self.listbox.selection_set(index - self.first_row)
+        # Grows to fit the widest row seen so far, formatting every item just to measure it would defeat the purpose
+        widest_row = max(len(row) for row in rows)
+        if widest_row > self.width:
+            self.width = widest_row
+            self.listbox.config(width=self.width)
+
+    def curselection(self) -> typing.Tuple[int, ...]:
+        return tuple(sorted(self.selected))
+
+    def selection_set(self, first: int, last: typing.Optional[int] = None):
+        self.selected.update(range(first, (first if last is None else last) + 1))
+        self.refresh()
+
+    def selection_clear(self):
+        self.selected = set()
+        self.refresh()
+
+    def yview(self, *args):
+        # Same interface as Listbox.yview, in items instead of rows of the listbox
+        if not args:
+            if not self.items:
+                return 0.0, 1.0
+            return self.first_row / len(self.items), min(1.0, (self.first_row + self.visible_rows) / len(self.items))
+        if args[0] == 'moveto':
+            self.yview_moveto(float(args[1]))
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]) * (self.visible_rows if args[2] == 'pages' else 1))
+
+    def yview_moveto(self, fraction: float):
+        self.first_row = int(round(fraction * len(self.items)))
+        self.refresh()
+
+    def scroll(self, rows: int):
+        first_row = max(0, min(self.first_row + rows, len(self.items) - self.visible_rows))
+        if first_row != self.first_row:
+            self.first_row = first_row
+            self.refresh()
+        return 'break'
+
+    def update_scrollbar(self):
+        self.y_scroll.set(*self.yview())
+
+    def see(self, index: int):
+        if index < self.first_row:
+            self.first_row = index
+        elif index >= self.first_row + self.visible_rows:
+            self.first_row = index - self.visible_rows + 1
+
+    def get_index_at(self, y: int) -> typing.Optional[int]:
+        if not self.items or not self.listbox.size():
+            return None
+        return self.first_row + self.listbox.nearest(y)
+
+    def on_configure(self, event):
+        visible_rows = max(1, event.height // self.row_height)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.refresh()
+
+    def on_click(self, event):
+        index = self.get_index_at(event.y)
+        if index is not None:
+            self.selected = {index}
+            self.anchor = self.cursor = index
+            self.refresh()
+        self.listbox.focus_set()
+        return 'break'
+
+    def on_shift_click(self, event):
+        index = self.get_index_at(event.y)
+        if index is not None:
+            anchor = index if self.anchor is None else self.anchor
+            self.selected = set(range(min(anchor, index), max(anchor, index) + 1))
+            self.cursor = index
+            self.refresh()
+        return 'break'
+
+    def on_control_click(self, event):
+        index = self.get_index_at(event.y)
+        if index is not None:
+            self.selected.symmetric_difference_update({index})
+            self.anchor = self.cursor = index
+            self.refresh()
+        return 'break'
+
+    def on_drag(self, event):
+        # Dragging past the top or bottom scrolls the list
+        if event.y < 0:
+            self.scroll(-1)
+        elif event.y > self.listbox.winfo_height():
+            self.scroll(1)
+        self.on_shift_click(event)
+        return 'break'
+
+    def move_cursor(self, get_index: typing.Callable[[int], int], extend: bool):
+        if not self.items:
+            return 'break'
+        cursor = self.first_row if self.cursor is None else self.cursor
+        index = max(0, min(get_index(cursor), len(self.items) - 1))
+        if extend:
+            anchor = cursor if self.anchor is None else self.anchor
+            self.selected = set(range(min(anchor, index), max(anchor, index) + 1))
+        else:
+            self.selected = {index}
+            self.anchor = index
+        self.cursor = index
+        self.see(index)
+        self.refresh()
+        return 'break'
+
+    def on_mouse_wheel(self, event):
+        # A notch is a delta of 120 on windows but 1 on macOS, so only the direction is used
+        if event.delta:
+            self.scroll(-3 if event.delta > 0 else 3)
+        return 'break'
+
+    def on_select_all(self, event):
+        self.selected = set(range(len(self.items)))
+        self.refresh()
+        return 'break'
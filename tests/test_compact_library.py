@@ -0,0 +1,90 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import LibraryJournal
+import MusicLibrary as ml
+
+
+def create_test_library() -> ml.MusicLibrary:
+    rng = random.Random(5678)
+    library = ml.MusicLibrary()
+    library.weights = [priority + 1 for priority in range(ml.num_priorities)]
+    for category in ('rock', 'jazz', 'pop'):
+        library.categories[category] = [ml.create_song_info(category, f'Artist {i % 7} - Song {i} é.mp3')
+                                        for i in range(50)]
+        for song in library.categories[category]:
+            song.priority = rng.randrange(ml.num_priorities)
+            song.number_of_repeats = rng.randrange(5)
+            song.duration = rng.choice([0.0, 181.5, 240.25])
+    return library
+
+
+def get_library_contents(library: ml.MusicLibrary) -> dict:
+    contents = ml.to_dict(library)
+    del contents['journal_id']
+    return contents
+
+
+def get_total_repeats(library: ml.MusicLibrary) -> int:
+    return sum(song.number_of_repeats for songs in library.categories.values() for song in songs)
+
+
+def get_store(library: ml.MusicLibrary):
+    return next(iter(library.categories.values())).store
+
+
+class CompactLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.json_file_name = os.path.join(self.directory, 'library.json')
+        self.compact_file_name = os.path.join(self.directory, 'library' + ml.COMPACT_LIBRARY_EXTENSION)
+        self.library = create_test_library()
+        ml.save_library(self.library, self.json_file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_roundtrip(self):
+        ml.convert_library_file(self.json_file_name, self.compact_file_name)
+        library = ml.load_library(self.compact_file_name)
+        self.assertEqual(get_library_contents(library), get_library_contents(self.library))
+
+        converted_file_name = os.path.join(self.directory, 'converted.json')
+        ml.convert_library_file(self.compact_file_name, converted_file_name)
+        self.assertEqual(get_library_contents(ml.load_library(converted_file_name)), get_library_contents(self.library))
+
+    def test_save_over_itself(self):
+        ml.convert_library_file(self.json_file_name, self.compact_file_name)
+        library = ml.load_library(self.compact_file_name)
+        LibraryJournal.open_journal(library, self.compact_file_name, resume=True)
+        for _ in range(20):
+            ml.pick_random_song_from_library(library)
+        library.categories['jazz'][3].song_name = 'Renamed Song'
+        LibraryJournal.close_journal(library)
+        ml.save_library(library, self.compact_file_name)
+        expected_contents = get_library_contents(library)
+
+        self.assertEqual(get_library_contents(ml.load_library(self.compact_file_name)), expected_contents)
+        ml.save_library(library, self.compact_file_name)  # mapped from the file it saved over the first time
+        self.assertEqual(get_library_contents(ml.load_library(self.compact_file_name)), expected_contents)
+
+    def test_picks_only_create_views_of_picked_songs(self):
+        ml.convert_library_file(self.json_file_name, self.compact_file_name)
+        library = ml.load_library(self.compact_file_name)
+        ml.get_priority_statistics(library, 10)
+        LibraryJournal.open_journal(library, self.compact_file_name, resume=True)
+        picked_songs = {id(ml.pick_random_song_from_library(library)) for _ in range(5)}
+        LibraryJournal.close_journal(library)
+        ml.save_library(library, self.compact_file_name)
+        self.assertEqual(len(get_store(library).views), len(picked_songs))
+        self.assertEqual(get_total_repeats(ml.load_library(self.compact_file_name)), get_total_repeats(self.library) + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
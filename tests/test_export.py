@@ -0,0 +1,42 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import LibraryExport
+import MusicLibrary as ml
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.music_path = os.path.join(self.directory, 'music')
+        os.makedirs(os.path.join(self.music_path, 'rock'))
+        open(os.path.join(self.music_path, 'rock', 'Artist - Song.mp3'), 'wb').close()
+        self.library = ml.create_library(self.music_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_m3u_paths_resolve_from_playlist_directory(self):
+        playlist_path = os.path.join(self.directory, 'playlists', 'all.m3u')
+        os.makedirs(os.path.dirname(playlist_path))
+        LibraryExport.export_library(self.library, playlist_path)
+        with open(playlist_path, encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[0], '#EXTM3U')
+        self.assertTrue(os.path.isfile(os.path.join(os.path.dirname(playlist_path), lines[2])))
+
+    def test_json_export_loads_as_library(self):
+        export_path = os.path.join(self.directory, 'export.json')
+        LibraryExport.export_library(self.library, export_path)
+        library = ml.load_library(export_path)
+        self.assertEqual([song.file_path for song in library.categories['rock']],
+                         [song.file_path for song in self.library.categories['rock']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import LibraryJournal
+import MusicLibrary as ml
+import MusicLibraryCli
+
+
+def create_test_library(number_of_songs: int, first_song_number: int = 0) -> ml.MusicLibrary:
+    library = ml.MusicLibrary()
+    library.weights = [1 for i in range(ml.num_priorities)]
+    library.categories['rock'] = [ml.create_song_info('rock', f'Artist {i} - Song {i}.mp3')
+                                  for i in range(first_song_number, first_song_number + number_of_songs)]
+    return library
+
+
+def get_song_values(library: ml.MusicLibrary) -> dict:
+    return {song.file_path: (song.priority, song.number_of_repeats)
+            for songs in library.categories.values() for song in songs}
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library_file_name = os.path.join(self.directory, 'library.json')
+        self.library = create_test_library(20)
+        for song_number, song in enumerate(self.library.categories['rock']):
+            song.number_of_repeats = song_number % 4
+        ml.save_library(self.library, self.library_file_name)
+        LibraryJournal.open_journal(self.library, self.library_file_name)
+
+    def tearDown(self):
+        LibraryJournal.close_journal(self.library)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def change_songs(self):
+        songs = self.library.categories['rock']
+        songs[3].priority = 11
+        songs[4].number_of_repeats = 5
+        songs[-1].priority = 7
+        songs[-1].number_of_repeats = 9
+
+    def assert_reloads_as_is(self):
+        # Without closing the journal, as after a crash
+        self.assertEqual(get_song_values(ml.load_library(self.library_file_name)), get_song_values(self.library))
+
+    def test_changes_are_journaled(self):
+        ml.pick_random_song_from_library(self.library)
+        self.change_songs()
+        self.assert_reloads_as_is()
+
+    def test_changes_after_reset(self):
+        ml.reset_repeats(self.library)
+        self.change_songs()
+        self.assert_reloads_as_is()
+
+    def test_changes_after_decay(self):
+        ml.decay_repeats(self.library, 0.5)
+        self.change_songs()
+        self.assert_reloads_as_is()
+
+    def test_changes_after_replacing_songs(self):
+        updated_library = create_test_library(20, 10)
+        diff = ml.merge_library(self.library, updated_library, keep_repeats=True)
+        ml.replace_library_songs(self.library, updated_library, diff)
+        self.change_songs()
+        self.assert_reloads_as_is()
+
+    def test_changes_to_added_songs(self):
+        self.library.categories['rock'].insert(0, ml.create_song_info('rock', 'Artist - New Song.mp3'))
+        ml.pick_random_song_from_library(self.library)
+        self.change_songs()
+        self.library.categories['rock'][0].priority = 3
+        self.assert_reloads_as_is()
+
+    def test_save_by_another_process_removes_journal(self):
+        # As the watch command does, the journal it replaces would otherwise be appended to and never replayed
+        self.change_songs()
+        other_library = ml.load_library(self.library_file_name)
+        ml.save_library(other_library, self.library_file_name)
+        self.assertFalse(os.path.exists(LibraryJournal.get_journal_file_name(self.library_file_name)))
+        self.assertEqual(get_song_values(ml.load_library(self.library_file_name)), get_song_values(self.library))
+
+    def test_locked_library_is_not_picked_from(self):
+        with ml.LibraryLock(self.library_file_name):
+            with self.assertRaises(ml.LibraryInUse):
+                ml.LibraryLock(self.library_file_name, timeout=0).acquire()
+            ml.LIBRARY_LOCK_TIMEOUT, timeout = 0, ml.LIBRARY_LOCK_TIMEOUT
+            try:
+                self.assertEqual(MusicLibraryCli.main(['pick', self.library_file_name]), 1)
+            finally:
+                ml.LIBRARY_LOCK_TIMEOUT = timeout
+        with ml.LibraryLock(self.library_file_name, timeout=0):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
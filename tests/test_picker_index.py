@@ -0,0 +1,127 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MusicLibrary as ml
+import SongStore as ss
+
+
+def create_song(number: int, rng: random.Random) -> ml.SongInfo:
+    song = ml.create_song_info('rock', f'Artist {number} - Song {number}.mp3')
+    song.priority = rng.randrange(ml.num_priorities)
+    song.number_of_repeats = rng.randrange(4)
+    return song
+
+
+class PickerIndexTest(unittest.TestCase):
+    def assert_index_matches_songs(self, library: ml.MusicLibrary):
+        # The index against a brute force grouping of the songs in the category lists
+        index = ml.get_picker_index(library)
+        expected_buckets = {}
+        for song in (song for songs in library.categories.values() for song in songs):
+            expected_buckets.setdefault(song.priority, {}).setdefault(song.number_of_repeats, set()).add(id(song))
+        buckets = {priority: {number_of_repeats: {id(index.get_song(entry)) for entry in bucket}
+                              for number_of_repeats, bucket in repeat_buckets.items()}
+                   for priority, repeat_buckets in index.buckets.items()}
+        self.assertEqual(buckets, expected_buckets)
+        for priority in range(ml.num_priorities):
+            repeat_buckets = expected_buckets.get(priority, {})
+            self.assertEqual(index.get_number_of_songs(priority), sum(map(len, repeat_buckets.values())))
+            self.assertEqual(index.min_repeats.get(priority), min(repeat_buckets.keys(), default=None))
+        for repeat_buckets in index.buckets.values():
+            for bucket in repeat_buckets.values():
+                for slot, entry in enumerate(bucket):
+                    if type(entry) is int:
+                        self.assertEqual(index.row_slots[entry], slot)
+                    else:
+                        self.assertIs(entry._picker_index, index)
+                        self.assertEqual(entry._picker_slot, slot)
+
+    def assert_column_statistics_match_index(self, library: ml.MusicLibrary):
+        index = ml.get_picker_index(library)
+        song_counts = [0 for i in range(ml.num_priorities)]
+        for songs in library.categories.values():
+            song_counts = [count + category_count for count, category_count in
+                           zip(song_counts, songs.store.get_priority_counts(songs.rows))]
+        self.assertEqual(song_counts, [index.get_number_of_songs(priority) for priority in range(ml.num_priorities)])
+        statistics = ml.get_priority_statistics(library, 10)
+        ml.detach_picker_index(library)
+        column_statistics = ml.get_priority_statistics(library, 10)
+        self.assertIsNot(column_statistics, statistics)
+        for attribute in ('song_counts', 'min_repeats', 'max_repeats', 'relative_frequencies'):
+            self.assertEqual(getattr(column_statistics, attribute), getattr(statistics, attribute))
+
+    def test_random_changes(self):
+        rng = random.Random(1234)
+        library = ml.MusicLibrary()
+        library.weights = [1 for i in range(ml.num_priorities)]
+        song_numbers = iter(range(10**6))
+        for category in ('rock', 'jazz', 'pop'):
+            library.categories[category] = [create_song(next(song_numbers), rng) for _ in range(30)]
+
+        for step in range(2000):
+            songs = library.categories[rng.choice(list(library.categories.keys()))]
+            action = rng.randrange(9)
+            if action == 0 and songs:
+                rng.choice(songs).priority = rng.randrange(ml.num_priorities)
+            elif action == 1 and songs:
+                rng.choice(songs).number_of_repeats = rng.randrange(6)
+            elif action == 2:
+                songs.append(create_song(next(song_numbers), rng))
+            elif action == 3 and songs:
+                songs.pop(rng.randrange(len(songs)))
+            elif action == 4 and songs:
+                songs[rng.randrange(len(songs))] = create_song(next(song_numbers), rng)
+                ml.mark_songs_replaced(library)
+            elif action == 5:
+                library.categories[rng.choice(list(library.categories.keys()))] = \
+                    [create_song(next(song_numbers), rng) for _ in range(rng.randrange(40))]
+            elif action == 6:
+                ml.pick_random_song_from_library(library, rng)
+            elif action == 7:
+                ml.generate_playlist(library, 10, allow_duplicates=rng.random() < 0.5, rng=rng)
+            else:
+                ml.decay_repeats(library, 0.5)
+            self.assert_index_matches_songs(library)
+
+    def test_random_changes_to_store(self):
+        # Rows of the store are indexed by row number, categories replaced by lists of songs are mixed in
+        rng = random.Random(4321)
+        library = ml.MusicLibrary()
+        library.weights = [1 for i in range(ml.num_priorities)]
+        song_numbers = iter(range(10**6))
+        for category in ('rock', 'jazz', 'pop'):
+            library.categories[category] = [create_song(next(song_numbers), rng) for _ in range(30)]
+        library, store = ss.get_compact_library(library)
+
+        for step in range(1000):
+            category = rng.choice(list(library.categories.keys()))
+            songs = library.categories[category]
+            action = rng.randrange(8)
+            if action == 0 and songs:
+                rng.choice(songs).priority = rng.randrange(ml.num_priorities)
+            elif action == 1 and songs:
+                rng.choice(songs).number_of_repeats = rng.randrange(6)
+            elif action == 2 and step % 50 == 0:
+                library.categories[category] = [create_song(next(song_numbers), rng) for _ in range(rng.randrange(40))]
+            elif action == 3:
+                ml.pick_random_song_from_library(library, rng)
+            elif action == 4:
+                ml.generate_playlist(library, 10, allow_duplicates=rng.random() < 0.5, rng=rng)
+            elif action == 5:
+                ml.decay_repeats(library, 0.5, [category])
+            elif action == 6:
+                ml.normalize_repeats(library)
+            else:
+                library.categories[category] = ss.SongViewList(store, store.get_category_rows(
+                    store.category_names.index(category)))
+            self.assert_index_matches_songs(library)
+            if ml.is_store_backed(library):
+                self.assert_column_statistics_match_index(library)
+
+
+if __name__ == '__main__':
+    unittest.main()
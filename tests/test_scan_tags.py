@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MusicLibrary as ml
+
+
+def get_id3_text_frame(frame_id: bytes, text: str) -> bytes:
+    # ID3v2.3 text frame, utf-8 encoded
+    data = b'\x03' + text.encode('utf-8')
+    return frame_id + len(data).to_bytes(4, 'big') + b'\x00\x00' + data
+
+
+def write_tagged_file(file_path: str, artist_name: str, song_name: str):
+    frames = get_id3_text_frame(b'TPE1', artist_name) + get_id3_text_frame(b'TIT2', song_name)
+    tag_size = bytes((len(frames) >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    with open(file_path, 'wb') as file:
+        file.write(b'ID3\x03\x00\x00' + tag_size + frames + b'\xff\xfb\x90\x00' + bytes(413))
+
+
+def set_mtime(path: str, mtime: float):
+    os.utime(path, (mtime, mtime))
+
+
+class ScanTagsTest(unittest.TestCase):
+    def setUp(self):
+        # Files and directories dated an hour back, well outside the mtime grace period of a scan
+        self.path = tempfile.mkdtemp()
+        self.old_time = time.time() - 3600
+        os.makedirs(os.path.join(self.path, 'rock'))
+        for number in range(3):
+            file_path = os.path.join(self.path, 'rock', f'file {number}.mp3')
+            write_tagged_file(file_path, 'Old Artist', f'Song {number}')
+            set_mtime(file_path, self.old_time)
+        set_mtime(os.path.join(self.path, 'rock'), self.old_time)
+        self.library = ml.create_library(self.path, read_tags=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def get_artists(self, library: ml.MusicLibrary) -> dict:
+        return {song.file_path: song.artist_name for song in library.categories['rock']}
+
+    def test_unchanged_files_are_not_read_again(self):
+        library = ml.scan_library(self.path, self.library, read_tags=True)
+        self.assertEqual(library.scan_snapshot.tags_read, 0)
+        self.assertEqual(self.get_artists(library), self.get_artists(self.library))
+
+    def test_retagged_file_is_read_again(self):
+        # Rewriting a file in place leaves its directory's mtime alone
+        file_path = os.path.join(self.path, 'rock', 'file 1.mp3')
+        write_tagged_file(file_path, 'New Artist Name', 'Song 1')
+        set_mtime(file_path, self.old_time + 60)
+        set_mtime(os.path.join(self.path, 'rock'), self.old_time)
+
+        library = ml.scan_library(self.path, self.library, read_tags=True)
+        self.assertEqual(library.scan_snapshot.directories_listed, 1)  # the category was reused, not listed
+        self.assertEqual(library.scan_snapshot.tags_read, 1)
+        artists = self.get_artists(library)
+        self.assertEqual(artists[os.path.join('rock', 'file 1.mp3')], 'New Artist Name')
+        self.assertEqual(artists[os.path.join('rock', 'file 0.mp3')], 'Old Artist')
+        self.assertEqual(library.scan_snapshot.files[os.path.join('rock', 'file 1.mp3')],
+                         (os.stat(file_path).st_size, os.stat(file_path).st_mtime_ns))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MusicLibrary as ml
+import MusicLibraryClient
+import MusicLibraryServer
+
+
+def create_test_library(number_of_songs: int) -> ml.MusicLibrary:
+    library = ml.MusicLibrary()
+    library.weights = [1 for i in range(ml.num_priorities)]
+    library.categories['rock'] = [ml.create_song_info('rock', f'Artist {i} - Song {i}.mp3')
+                                  for i in range(number_of_songs)]
+    return library
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library_file_name = os.path.join(self.directory, 'library.json')
+        ml.save_library(create_test_library(20), self.library_file_name)
+        self.server = MusicLibraryServer.LibraryServer(self.library_file_name, save_interval=60.0)
+        ready = threading.Event()
+        socket_path = os.path.join(self.directory, 'server.socket') if hasattr(socket, 'AF_UNIX') else None
+        self.thread = threading.Thread(target=asyncio.run, args=(self.server.serve(socket_path, 0, ready),))
+        self.thread.start()
+        self.assertTrue(ready.wait(10))
+        self.address = socket_path or self.server.port
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            with MusicLibraryClient.MusicLibraryClient(self.address) as client:
+                client.shutdown()
+        self.thread.join(10)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_picks_are_saved_on_shutdown(self):
+        with MusicLibraryClient.MusicLibraryClient(self.address) as client:
+            self.assertEqual(len(client.pick(5)), 5)
+            self.assertEqual(len(client.generate_playlist(10, allow_duplicates=False)), 10)
+            self.assertEqual(sum(client.stats()['song_counts']), 20)
+            client.shutdown()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        library = ml.load_library(self.library_file_name)
+        self.assertEqual(sum(song.number_of_repeats for song in library.categories['rock']), 15)
+
+    def test_save_request(self):
+        with MusicLibraryClient.MusicLibraryClient(self.address) as client:
+            picked_songs = client.pick(3)
+            client.save()
+            library = ml.load_library(self.library_file_name)
+            repeats = {song.file_path: song.number_of_repeats for song in library.categories['rock']}
+            for song_path in set(picked_songs):
+                self.assertEqual(repeats[song_path], picked_songs.count(song_path))
+
+    def test_idle_client_does_not_block_shutdown(self):
+        idle_client = MusicLibraryClient.MusicLibraryClient(self.address)
+        try:
+            idle_client.pick()
+            with MusicLibraryClient.MusicLibraryClient(self.address) as client:
+                client.shutdown()
+            self.thread.join(10)
+            self.assertFalse(self.thread.is_alive())
+            library = ml.load_library(self.library_file_name)
+            self.assertEqual(sum(song.number_of_repeats for song in library.categories['rock']), 1)
+        finally:
+            idle_client.close()
+
+    def test_library_is_locked_while_serving(self):
+        with self.assertRaises(ml.LibraryInUse):
+            MusicLibraryServer.LibraryServer(self.library_file_name, save_interval=60.0)
+        with MusicLibraryClient.MusicLibraryClient(self.address) as client:
+            client.shutdown()
+        self.thread.join(10)
+        with ml.LibraryLock(self.library_file_name, timeout=0):
+            pass
+
+    def test_unknown_command(self):
+        with MusicLibraryClient.MusicLibraryClient(self.address) as client:
+            with self.assertRaises(MusicLibraryClient.ServerError):
+                client.request('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MusicLibrary as ml
+import SongSearch
+
+
+def create_file(path: str, file_name: str, mtime: float):
+    file_path = os.path.join(path, file_name)
+    with open(file_path, 'wb') as file:
+        file.write(file_name.encode())
+    os.utime(file_path, (mtime, mtime))
+
+
+class SongSearchUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.old_time = time.time() - 3600
+        for category, file_names in (('rock', ['Beatles - Yellow Submarine.mp3', 'Beatles - Help.mp3',
+                                               'Queen - Bohemian Rhapsody.mp3']),
+                                     ('jazz', ['Miles Davis - So What.mp3', 'Coltrane - Giant Steps.mp3'])):
+            os.makedirs(os.path.join(self.path, category))
+            for file_name in file_names:
+                create_file(os.path.join(self.path, category), file_name, self.old_time)
+        self.library = ml.create_library(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def assert_same_results(self, library: ml.MusicLibrary, query_texts):
+        fresh_index = SongSearch.SongSearchIndex(library)
+        for query_text in query_texts:
+            query = SongSearch.parse_query(query_text)
+            self.assertEqual(sorted(song.file_path for song in SongSearch.search_songs(library, query)),
+                             sorted(song.file_path for song in fresh_index.search(query)), query_text)
+
+    def test_update_patches_index(self):
+        search_index = SongSearch.get_search_index(self.library)
+        os.remove(os.path.join(self.path, 'rock', 'Beatles - Help.mp3'))
+        os.rename(os.path.join(self.path, 'rock', 'Queen - Bohemian Rhapsody.mp3'),
+                  os.path.join(self.path, 'rock', 'Queen - Killer Queen.mp3'))
+        create_file(os.path.join(self.path, 'jazz'), 'Beatles - Jazz Help.mp3', time.time())
+        os.makedirs(os.path.join(self.path, 'pop'))
+        create_file(os.path.join(self.path, 'pop'), 'Abba - Waterloo.mp3', time.time())
+
+        updated_library, diff = ml.get_updated_library_incremental(self.library, self.path, keep_repeats=True)
+        ml.replace_library_songs(self.library, updated_library, diff)
+        self.assertIs(self.library.search_index, search_index)
+        self.assertTrue(SongSearch.has_current_search_index(self.library))
+        self.assertEqual(search_index.removed_songs, 2)
+        self.assertEqual(SongSearch.search_songs(self.library, SongSearch.parse_query('help'))[0].song_name,
+                         'Jazz Help')
+        self.assertIs(SongSearch.search_songs(self.library, SongSearch.parse_query('so what'))[0],
+                      self.library.categories['jazz'][
+                          [song.song_name for song in self.library.categories['jazz']].index('So What')])
+        self.assert_same_results(self.library, ['help', 'beatles', 'queen', 'bohemian', 'killer', 'waterloo',
+                                                'c:pop', 'c:jazz', 'b c:jazz', 'q c:rock', 'so'])
+
+    def test_update_moves_index_to_new_library(self):
+        SongSearch.get_search_index(self.library)
+        create_file(os.path.join(self.path, 'rock'), 'Queen - Radio Ga Ga.mp3', time.time())
+        updated_library, diff = ml.get_updated_library_incremental(self.library, self.path)
+        SongSearch.update_search_index(self.library, updated_library, diff)
+        self.assertIsNone(self.library.search_index)
+        self.assertTrue(SongSearch.has_current_search_index(updated_library))
+        self.assert_same_results(updated_library, ['queen', 'radio', 'ga', 'beatles yellow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import LibraryWatcher
+import MusicLibrary as ml
+
+
+def set_mtime(path: str, mtime: float):
+    os.utime(path, (mtime, mtime))
+
+
+class PollingMonitorTest(unittest.TestCase):
+    def setUp(self):
+        # Dated an hour back, well outside the mtime grace period of a scan
+        self.path = tempfile.mkdtemp()
+        self.old_time = time.time() - 3600
+        os.makedirs(os.path.join(self.path, 'rock'))
+        open(os.path.join(self.path, 'rock', 'Artist - Song.mp3'), 'wb').close()
+        set_mtime(os.path.join(self.path, 'rock'), self.old_time)
+        set_mtime(self.path, self.old_time)
+        self.library = ml.create_library(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_unchanged_library_has_no_changes(self):
+        monitor = LibraryWatcher.PollingMonitor(0.0)
+        monitor.watch(self.path, self.library.scan_snapshot)
+        self.assertFalse(monitor.wait_for_changes(0.0))
+
+    def test_category_created_before_watching(self):
+        # Created after the scan but before the monitor starts, which only the scan's mtime of the root shows
+        os.makedirs(os.path.join(self.path, 'pop'))
+        set_mtime(self.path, self.old_time + 60)
+        monitor = LibraryWatcher.PollingMonitor(0.0)
+        monitor.watch(self.path, self.library.scan_snapshot)
+        self.assertTrue(monitor.wait_for_changes(0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()